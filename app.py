@@ -3,25 +3,44 @@ Video Downloader - FastAPI 应用
 基于 yt-dlp 的视频下载服务
 """
 import os
+import sys
+import time
 import uuid
 import asyncio
-from datetime import datetime
-from typing import Dict, Optional, Any
+import importlib
+import threading
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Dict, List, Optional, Any
 from contextlib import asynccontextmanager
 
+_import_started = time.monotonic()
+
 # 版本信息 - 每次更新代码时修改这里
 APP_VERSION = "1.1.1"
 BUILD_TIME = "2026-02-02 12:00"
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response, StreamingResponse
 
 from models import (
     DownloadRequest, BatchDownloadRequest, DownloadResponse,
-    TaskStatus, DownloadTask, TaskListResponse, SortOrder
+    TaskStatus, DownloadTask, TaskListResponse, SortOrder, TaskAttempt, VideoRecord
 )
-from downloader import VideoDownloader, detect_url_type, UrlType
+from scheduler import DownloadScheduler, backoff_delay, RETRY_MAX_ATTEMPTS
+from rate_limiter import rate_limiter, connection_tuner, site_key
+from task_store import create_task_store
+from events import TaskEventBroker
+from progress import ProgressAggregator
+from process_pool import ProcessDownloadPool, EXECUTION_MODE
+from batches import BatchManager, BATCH_SLOT_RELEASE_STATUSES
+from single_flight import SingleFlight, download_key
+from ydl_pool import ydl_pool
+import metrics
+if TYPE_CHECKING:
+    from downloader import ErrorKind
+# downloader（yt-dlp）在首次使用时才导入；cos_uploader / cache 内部也按需导入 SDK
 from cos_uploader import (
     upload_video_folder, get_cos_client, list_videos,
     delete_folder, delete_file, get_file_url
@@ -31,22 +50,103 @@ from cos_uploader import (
 DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "./downloads")
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "8081"))
+# 开始接受请求后在后台导入 yt-dlp、创建下载器并预热提取器/实例池
+STARTUP_PREWARM = os.getenv("STARTUP_PREWARM", "true").lower() == "true"
+
+# 启动耗时（GET /api/version）
+startup_timings: Dict[str, Any] = {"prewarm": {"status": "enabled" if STARTUP_PREWARM else "disabled"}}
+
+# 全局任务存储（TASK_STORE=memory/sqlite/redis）
+task_store = create_task_store()
+
+# 任务变更推送（SSE）
+event_broker = TaskEventBroker()
+
+# 下载器实例（首次使用时创建：导入 yt-dlp 要加载大量提取器模块，不阻塞启动和健康检查）
+_downloader = None
+_downloader_lock = threading.Lock()
+
 
-# 全局任务存储 (生产环境应使用 Redis)
-tasks: Dict[str, DownloadTask] = {}
+def get_downloader():
+    """获取下载器实例（首次调用时导入 downloader 并创建）"""
+    global _downloader
+    if _downloader is None:
+        with _downloader_lock:
+            if _downloader is None:
+                from downloader import VideoDownloader
+                _downloader = VideoDownloader(DOWNLOAD_DIR)
+    return _downloader
 
-# 下载器实例
-downloader = VideoDownloader(DOWNLOAD_DIR)
+
+async def load_downloader():
+    """downloader 模块（首次导入要加载 yt-dlp，在 info 线程池中进行，不阻塞事件循环）"""
+    module = sys.modules.get('downloader')
+    if module is None:
+        module = await scheduler.run_info(lambda: importlib.import_module('downloader'))
+    return module
+
+
+def upload_folder_to_cos(video_dir: str, uploader: str, title: str) -> Dict[str, Any]:
+    """上传视频目录到 COS 并回写登记表（阻塞，在 info 线程池中调用）"""
+    registry = get_downloader().registry
+    result = upload_video_folder(video_dir, uploader, title,
+                                 registry.cos_sources(video_dir), registry.checksums(video_dir))
+    if result.get('success'):
+        registry.mark_uploaded(video_dir, result['cos_prefix'])
+    return result
+
+
+def prewarm():
+    """后台预热：导入 yt-dlp 并创建下载器、加载提取器规则和 YoutubeDL 实例、创建 COS 客户端"""
+    timings = startup_timings["prewarm"]
+    timings["status"] = "running"
+    started = time.monotonic()
+    try:
+        get_downloader()
+        timings["downloader"] = round(time.monotonic() - started, 3)
+        for step, seconds in get_downloader().prewarm().items():
+            timings[step] = round(seconds, 3)
+        start = time.monotonic()
+        get_cos_client()
+        timings["cos"] = round(time.monotonic() - start, 3)
+        timings["status"] = "done"
+    except Exception as e:
+        timings["status"] = "failed"
+        timings["error"] = str(e)
+    timings["total"] = round(time.monotonic() - started, 3)
+
+# 多进程下载池（EXECUTION_MODE=process 时在启动阶段创建）
+process_pool: Optional[ProcessDownloadPool] = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期"""
+    started = time.monotonic()
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
     print(f"📁 下载目录: {os.path.abspath(DOWNLOAD_DIR)}")
     print(f"🚀 Video Downloader 启动在 http://{HOST}:{PORT}")
     print(f"🌐 Web UI: http://localhost:{PORT}/ui")
+    global process_pool
+    if EXECUTION_MODE == 'process':
+        process_pool = ProcessDownloadPool(DOWNLOAD_DIR, scheduler.max_concurrent)
+        scheduler.cancel_flags = process_pool.cancel_flags
+    await scheduler.start()
+    await event_broker.start()
+    await progress.start()
+    startup_timings["lifespan"] = round(time.monotonic() - started, 3)
+    startup_timings["ready_at"] = datetime.now().isoformat()
+    # 预热在 info 线程池中进行，服务已经可以响应请求
+    prewarm_task = asyncio.create_task(scheduler.run_info(prewarm)) if STARTUP_PREWARM else None
     yield
+    if prewarm_task:
+        prewarm_task.cancel()
+    await progress.stop()
+    await event_broker.stop()
+    await scheduler.stop()
+    if process_pool:
+        process_pool.shutdown()
+    ydl_pool.clear()
     print("👋 Video Downloader 关闭")
 
 
@@ -76,31 +176,55 @@ if os.path.exists(STATIC_DIR):
     app.mount("/ui", StaticFiles(directory=STATIC_DIR, html=True), name="static")
 
 
-def create_progress_callback(task_id: str):
-    """创建进度回调"""
-    def callback(d):
-        if task_id in tasks:
-            if d['status'] == 'downloading':
-                total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
-                downloaded = d.get('downloaded_bytes') or 0
-                # 确保是数字类型
-                try:
-                    total = float(total) if total else 0
-                    downloaded = float(downloaded) if downloaded else 0
-                except (ValueError, TypeError):
-                    total = 0
-                    downloaded = 0
-                if total > 0:
-                    progress = (downloaded / total) * 100
-                    # 只有视频文件才更新进度（排除字幕、缩略图等小文件）
-                    if total > 1024 * 1024:  # 大于 1MB 才认为是视频
-                        tasks[task_id].progress = min(progress, 99)
-                tasks[task_id].status = TaskStatus.DOWNLOADING
-            elif d['status'] == 'finished':
-                filename = d.get('filename', '')
-                if filename and filename.endswith(('.mp4', '.webm', '.mkv')):
-                    tasks[task_id].filename = filename
-    return callback
+# 进行中的相同下载合并
+single_flight = SingleFlight()
+
+
+def update_task(task_id: str, **fields) -> Optional[DownloadTask]:
+    """更新任务并推送变更"""
+    task = task_store.update(task_id, **fields)
+    if task is not None:
+        event_broker.publish(task_id, **fields)
+        status = fields.get('status')
+        if task.batch_id and status in BATCH_SLOT_RELEASE_STATUSES:
+            batches.task_finished(task)
+        if task.attached_to and status in (TaskStatus.CANCELLED, TaskStatus.PAUSED):
+            single_flight.detach(task_id)
+        elif status not in (TaskStatus.CANCELLED, TaskStatus.PAUSED):
+            # 领头任务的状态与结果同步给跟随任务（取消/暂停只作用于领头任务本身）
+            mirrored = {k: v for k, v in fields.items() if k != 'attached_to'}
+            for follower_id in single_flight.followers(task_id) if mirrored else ():
+                update_task(follower_id, **mirrored)
+            if status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+                single_flight.finish(task_id)
+    return task
+
+
+def publish_progress(updates: Dict[str, Dict[str, Any]]):
+    """批量写入采样后的进度（同步给跟随任务）"""
+    for task_id in list(updates):
+        for follower_id in single_flight.followers(task_id):
+            updates[follower_id] = updates[task_id]
+    for task_id in task_store.update_many(updates):
+        event_broker.publish(task_id, **updates[task_id])
+
+
+# 下载进度聚合（hook 只记录，定期采样批量发布）
+progress = ProgressAggregator(publish_progress)
+
+
+async def run_downloader(task_id: str, **kwargs) -> Dict[str, Any]:
+    """执行 VideoDownloader.download（线程池或进程池）"""
+    hook = progress.hook(task_id)
+    with metrics.EXECUTOR_BUSY.labels('download').track_inprogress():
+        if process_pool:
+            # 子进程内自行检查取消标记
+            return await asyncio.wrap_future(process_pool.submit(task_id, hook, **kwargs))
+        from downloader import make_cancellable_hook
+        hook = make_cancellable_hook(task_id, scheduler.cancel_flags, hook)
+        return await scheduler.run_download(
+            lambda: get_downloader().download(progress_callback=hook, **kwargs)
+        )
 
 
 async def download_video_task(
@@ -109,58 +233,196 @@ async def download_video_task(
     format_pref: str,
     download_playlist: bool = False,
     max_videos: Optional[int] = None,
-    sort_order: str = "newest"
+    sort_order: str = "newest",
+    connections: Optional[int] = None
 ):
-    """后台下载任务"""
+    """后台下载任务（可重试的失败会重新入队）"""
+    downloader = await load_downloader()
+    ErrorKind, classify_error = downloader.ErrorKind, downloader.classify_error
+    started_at = datetime.now()
     try:
-        tasks[task_id].status = TaskStatus.DOWNLOADING
-
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            lambda: downloader.download(
-                url,
-                progress_callback=create_progress_callback(task_id),
-                format_preference=format_pref,
-                download_playlist=download_playlist,
-                max_videos=max_videos,
-                sort_order=sort_order
-            )
+        update_task(task_id, status=TaskStatus.DOWNLOADING, next_retry_at=None)
+
+        # 连接数在主进程选择和反馈（多进程模式下子进程之间共享调整结果）
+        result = await run_downloader(
+            task_id,
+            url=url,
+            format_preference=format_pref,
+            download_playlist=download_playlist,
+            max_videos=max_videos,
+            sort_order=sort_order,
+            connections=connections or connection_tuner.pick(site_key(url))
         )
+        progress.discard(task_id)
+        metrics.observe_download(result.get('timings'))
+        if not connections and result.get('connections'):
+            connection_tuner.record(site_key(url), result['connections'],
+                                    (result.get('timings') or {}).get('files'))
+
+        # 被取消/暂停：不重试，也不计入限流统计
+        if result.get('cancelled'):
+            paused = result.get('mode') == 'pause'
+            metrics.TASK_RESULTS.labels('paused' if paused else 'cancelled').inc()
+            update_task(
+                task_id,
+                status=TaskStatus.PAUSED if paused else TaskStatus.CANCELLED,
+                attempts=_append_attempt(task_id, started_at, error=result.get('error'))
+            )
+            handoff_single_flight(task_id)
+            return
+
+        # 反馈给站点限流器（AIMD）
+        retry_after = result.get('retry_after') or 0
+        if result.get('rate_limited'):
+            metrics.RATE_LIMIT_HITS.labels(site_key(url)).inc()
+            retry_after = max(retry_after, rate_limiter.on_throttle(site_key(url)))
+            connection_tuner.on_throttle(site_key(url))
+        elif result.get('success'):
+            rate_limiter.on_success(site_key(url))
 
         if result.get('success'):
-            tasks[task_id].status = TaskStatus.COMPLETED
-            tasks[task_id].title = result.get('title')
-            tasks[task_id].filename = result.get('filename')
-            tasks[task_id].type = result.get('type', 'video')
-            tasks[task_id].completed_at = datetime.now()
+            fields = {
+                'status': TaskStatus.COMPLETED,
+                'title': result.get('title'),
+                'filename': result.get('filename'),
+                'type': result.get('type', 'video'),
+                'completed_at': datetime.now(),
+            }
 
             # 播放列表额外信息
             if result.get('type') == 'playlist':
-                tasks[task_id].video_count = result.get('total', 0)
+                fields['video_count'] = result.get('total', 0)
 
             # 警告信息（如字幕下载失败）
             if result.get('warning'):
-                tasks[task_id].warning = result.get('warning')
+                fields['warning'] = result.get('warning')
 
             # 自动上传到 COS
             video_dir = result.get('video_dir')
-            if video_dir and get_cos_client():
+            if video_dir:
                 uploader = result.get('uploader', 'Unknown')
                 title = result.get('title', 'unknown')
                 try:
-                    cos_result = upload_video_folder(video_dir, uploader, title)
-                    if cos_result.get('success'):
-                        tasks[task_id].cos_uploaded = True
+                    cos_result = await scheduler.run_info(
+                        lambda: get_cos_client() and upload_folder_to_cos(video_dir, uploader, title)
+                    )
+                    if cos_result and cos_result.get('success'):
+                        fields['cos_uploaded'] = True
                 except Exception as e:
-                    tasks[task_id].warning = f"COS上传失败: {e}"
+                    fields['warning'] = f"COS上传失败: {e}"
+
+            fields['attempts'] = _append_attempt(task_id, started_at)
+            update_task(task_id, **fields)
+            metrics.TASK_RESULTS.labels('completed').inc()
         else:
-            tasks[task_id].status = TaskStatus.FAILED
-            tasks[task_id].error = result.get('error')
+            error = result.get('error')
+            error_kind = result.get('error_kind') or classify_error(error or '').value
+            handle_failure(task_id, started_at, error, ErrorKind(error_kind), retry_after)
 
     except Exception as e:
-        tasks[task_id].status = TaskStatus.FAILED
-        tasks[task_id].error = str(e)
+        progress.discard(task_id)
+        handle_failure(task_id, started_at, str(e), classify_error(str(e)))
+
+
+def _append_attempt(task_id: str, started_at: datetime, **fields) -> List[TaskAttempt]:
+    """在任务的尝试记录后追加一条"""
+    task = task_store.get(task_id)
+    attempts = list(task.attempts) if task else []
+    attempts.append(TaskAttempt(
+        attempt=len(attempts) + 1,
+        started_at=started_at,
+        finished_at=datetime.now(),
+        **fields
+    ))
+    return attempts
+
+
+def handle_failure(task_id: str, started_at: datetime, error: Optional[str],
+                   error_kind: 'ErrorKind', retry_after: float = 0):
+    """记录失败；可重试的错误按指数退避重新入队"""
+    from downloader import RETRYABLE_ERROR_KINDS
+    attempts = _append_attempt(task_id, started_at, error=error, error_kind=error_kind.value)
+    attempt = len(attempts)
+
+    if error_kind in RETRYABLE_ERROR_KINDS and attempt < RETRY_MAX_ATTEMPTS:
+        delay = backoff_delay(attempt, min_delay=retry_after)
+        if scheduler.retry_later(task_id, delay):
+            metrics.RETRIES.labels(error_kind.value).inc()
+            attempts[-1].retry_in = round(delay, 1)
+            update_task(
+                task_id,
+                status=TaskStatus.RETRYING,
+                error=error,
+                attempts=attempts,
+                next_retry_at=datetime.now() + timedelta(seconds=delay)
+            )
+            return
+
+    update_task(task_id, status=TaskStatus.FAILED, error=error, attempts=attempts, next_retry_at=None)
+    metrics.TASK_RESULTS.labels('failed').inc()
+
+
+# 下载调度器（有界并发 + 优先级队列）
+scheduler = DownloadScheduler(download_video_task)
+metrics.bind_scheduler(scheduler)
+
+
+# 正在计算合并键、尚未提交的任务（保持引用，避免 asyncio 任务被回收）
+_enqueueing: set = set()
+
+
+def enqueue_task(task: DownloadTask):
+    """
+    按任务保存的下载参数提交到调度器；相同下载进行中时合并到该任务
+    合并键要逐个匹配 yt-dlp 提取器的 URL 规则（约 1800 个，首次调用还会导入 yt-dlp），
+    在元数据线程池中计算，算好后回到事件循环登记与提交
+    """
+    job = asyncio.get_running_loop().create_task(_enqueue(task.id, task.url, dict(task.options)))
+    _enqueueing.add(job)
+    job.add_done_callback(_enqueueing.discard)
+
+
+async def _enqueue(task_id: str, url: str, options: Dict[str, Any]):
+    try:
+        key = await scheduler.run_info(lambda: download_key(url, options))
+    except Exception as e:
+        print(f"计算合并键失败，不合并 [{task_id}]: {e}")
+        key = None
+    # 计算期间任务可能已被取消/删除
+    task = task_store.get(task_id)
+    if task is None or task.status != TaskStatus.PENDING:
+        return
+    leader_id = single_flight.attach(key, task.id) if key is not None else None
+    if leader_id is None:
+        _submit_task(task)
+        return
+    leader = task_store.get(leader_id)
+    update_task(
+        task.id,
+        attached_to=leader_id,
+        status=leader.status if leader else task.status,
+        progress=leader.progress if leader else 0.0,
+    )
+
+
+def _submit_task(task: DownloadTask):
+    options = dict(task.options)
+    priority = options.pop('priority', 0)
+    scheduler.submit(task.id, priority=priority, url=task.url, **options)
+
+
+def handoff_single_flight(task_id: str):
+    """领头任务被取消/暂停/删除：由第一个跟随任务接手下载"""
+    new_leader = single_flight.promote(task_id)
+    if new_leader is None:
+        return
+    task = update_task(new_leader, attached_to=None)
+    if task is not None:
+        _submit_task(task)
+
+
+# 批量下载（每个批次按并发上限分发子任务）
+batches = BatchManager(task_store, enqueue_task)
 
 
 # ==================== API 端点 ====================
@@ -180,21 +442,34 @@ async def root():
             "download": "POST /api/download",
             "tasks": "/api/tasks",
             "task": "/api/tasks/{task_id}",
+            "events": "/api/tasks/events",
             "version": "/api/version",
+            "queue": "/api/queue",
+            "batches": "/api/batches",
+            "rate_limits": "/api/rate-limits",
+            "metrics": "/metrics",
         }
     }
 
 
 @app.get("/api/version")
 async def get_version():
-    """获取版本信息 - 用于确认代码是否更新"""
+    """获取版本信息 - 用于确认代码是否更新；startup 为启动各阶段耗时（秒）"""
     return {
         "version": APP_VERSION,
         "build_time": BUILD_TIME,
-        "server_time": datetime.now().isoformat()
+        "server_time": datetime.now().isoformat(),
+        "startup": startup_timings,
     }
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 指标"""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
 @app.get("/health")
 async def health():
     """健康检查"""
@@ -255,33 +530,76 @@ async def get_cos_url(key: str, expires: int = 3600):
 @app.post("/api/cos/upload/{task_id}")
 async def upload_to_cos(task_id: str):
     """上传已下载的视频到 COS"""
-    if task_id not in tasks:
+    task = task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="任务不存在")
 
-    task = tasks[task_id]
     if task.status != TaskStatus.COMPLETED:
         raise HTTPException(status_code=400, detail="任务未完成")
 
-    # 查找视频目录
-    for root, dirs, files in os.walk(DOWNLOAD_DIR):
-        for d in dirs:
-            if task.title and task.title[:30] in d:
-                video_dir = os.path.join(root, d)
-                uploader = os.path.basename(root)
-                result = upload_video_folder(video_dir, uploader, d)
-                return result
+    def find_video_dir() -> Optional[str]:
+        # 先查已下载登记表，旧记录没有目录信息时再遍历下载目录
+        extractor, video_id, _ = download_key(task.url)
+        record = get_downloader().registry.get(video_id, extractor)
+        if record and record.video_dir and os.path.isdir(record.video_dir):
+            return record.video_dir
+        for root, dirs, files in os.walk(DOWNLOAD_DIR):
+            for d in dirs:
+                if task.title and task.title[:30] in d:
+                    return os.path.join(root, d)
+        return None
+
+    # 登记表查询、目录遍历、上传都是阻塞操作，在 info 线程池中执行
+    video_dir = await scheduler.run_info(find_video_dir)
+    if video_dir is None:
+        raise HTTPException(status_code=404, detail="视频目录不存在")
+
+    uploader = os.path.basename(os.path.dirname(video_dir))
+    result = await scheduler.run_info(
+        lambda: upload_folder_to_cos(video_dir, uploader, os.path.basename(video_dir))
+    )
+    if result.get('success'):
+        update_task(task_id, cos_uploaded=True)
+    return result
+
+
+@app.get("/api/channels/sync")
+async def get_channel_sync(url: str):
+    """频道增量同步位置（上次同步时列表最前面的视频）"""
+    state = await scheduler.run_info(
+        lambda: get_downloader().registry.get_sync_state(url.strip().rstrip('/'))
+    )
+    if state is None:
+        raise HTTPException(status_code=404, detail="该频道尚未同步")
+    return {"url": url, **state}
+
+
+@app.delete("/api/channels/sync")
+async def reset_channel_sync(url: str):
+    """清除频道同步位置，下次下载重新从列表头部检查全部视频"""
+    deleted = await scheduler.run_info(
+        lambda: get_downloader().registry.delete_sync_state(url.strip().rstrip('/'))
+    )
+    if not deleted:
+        raise HTTPException(status_code=404, detail="该频道尚未同步")
+    return {"message": "已重置"}
+
 
-    raise HTTPException(status_code=404, detail="视频目录不存在")
+@app.get("/api/downloaded/{video_id}", response_model=VideoRecord)
+async def get_downloaded_video(video_id: str, extractor: Optional[str] = None):
+    """查询已下载视频的登记信息（目录、大小、格式、校验和、COS 上传状态）"""
+    record = await scheduler.run_info(lambda: get_downloader().registry.get(video_id, extractor))
+    if record is None:
+        raise HTTPException(status_code=404, detail="未下载过该视频")
+    return record
 
 
 @app.get("/api/info")
 async def get_video_info(url: str):
     """获取视频/播放列表信息"""
     try:
-        loop = asyncio.get_event_loop()
-        info = await loop.run_in_executor(
-            None,
-            lambda: downloader.get_video_info(url)
+        info = await scheduler.run_info(
+            lambda: get_downloader().get_video_info(url)
         )
         return info
     except Exception as e:
@@ -289,31 +607,31 @@ async def get_video_info(url: str):
 
 
 @app.post("/api/download", response_model=DownloadResponse)
-async def create_download(request: DownloadRequest, background_tasks: BackgroundTasks):
+async def create_download(request: DownloadRequest):
     """创建下载任务（支持单个视频、播放列表、频道）"""
     task_id = str(uuid.uuid4())[:8]
 
     # 检测 URL 类型
-    url_type = detect_url_type(request.url)
+    url_type = (await load_downloader()).detect_url_type(request.url)
 
     task = DownloadTask(
         id=task_id,
         url=request.url,
         status=TaskStatus.PENDING,
         type=url_type.value,  # 使用检测到的类型：video/channel/playlist
-        created_at=datetime.now()
-    )
-    tasks[task_id] = task
-
-    background_tasks.add_task(
-        download_video_task,
-        task_id,
-        request.url,
-        request.format,
-        request.download_playlist,
-        request.max_videos,
-        request.sort_order.value
+        created_at=datetime.now(),
+        options={
+            'format_pref': request.format,
+            'download_playlist': request.download_playlist,
+            'max_videos': request.max_videos,
+            'sort_order': request.sort_order.value,
+            'priority': request.priority,
+            'connections': request.connections,
+        }
     )
+    task_store.add(task)
+    event_broker.publish(task_id, **task.model_dump())
+    enqueue_task(task)
 
     type_msg = {
         'video': '',
@@ -329,84 +647,227 @@ async def create_download(request: DownloadRequest, background_tasks: Background
 
 
 @app.post("/api/download/batch")
-async def create_batch_download(request: BatchDownloadRequest, background_tasks: BackgroundTasks):
-    """批量下载"""
-    task_ids = []
+async def create_batch_download(request: BatchDownloadRequest):
+    """批量下载（创建批次，按 parallelism 限制同时下载数）"""
+    detect_url_type = (await load_downloader()).detect_url_type
+    batch_id = str(uuid.uuid4())[:8]
+    tasks = []
 
     for url in request.urls:
-        task_id = str(uuid.uuid4())[:8]
         task = DownloadTask(
-            id=task_id,
+            id=str(uuid.uuid4())[:8],
             url=url,
             status=TaskStatus.PENDING,
-            created_at=datetime.now()
+            type=detect_url_type(url).value,
+            created_at=datetime.now(),
+            batch_id=batch_id,
+            options={
+                'format_pref': request.format,
+                'download_playlist': request.download_playlist,
+                'max_videos': request.max_videos,
+                'sort_order': request.sort_order.value,
+                'priority': request.priority,
+                'connections': request.connections,
+            }
         )
-        tasks[task_id] = task
-        task_ids.append(task_id)
+        task_store.add(task)
+        event_broker.publish(task.id, **task.model_dump())
+        tasks.append(task)
 
-        background_tasks.add_task(
-            download_video_task,
-            task_id,
-            url,
-            request.format,
-            False,
-            None
-        )
+    batch = batches.create(batch_id, tasks, request.parallelism)
 
     return {
-        "task_ids": task_ids,
-        "total": len(task_ids),
-        "message": f"已创建 {len(task_ids)} 个下载任务"
+        "batch_id": batch_id,
+        "task_ids": batch.task_ids,
+        "total": len(tasks),
+        "parallelism": batch.parallelism,
+        "message": f"已创建 {len(tasks)} 个下载任务"
     }
 
 
+@app.get("/api/batches")
+async def list_batches():
+    """批次列表（汇总信息）"""
+    return {"batches": [batches.summary(b) for b in batches.list()]}
+
+
+@app.get("/api/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    """批次详情：汇总进度/字节数/ETA 与每个子任务状态"""
+    batch = batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="批次不存在")
+    return batches.summary(batch, with_items=True)
+
+
+@app.post("/api/batches/{batch_id}/retry")
+async def retry_batch(batch_id: str):
+    """只重试批次中失败的子任务"""
+    batch = batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="批次不存在")
+
+    failed = [
+        task_id for task_id in batch.task_ids
+        if (task := task_store.get(task_id)) is not None and task.status == TaskStatus.FAILED
+    ]
+    for task_id in failed:
+        # 手动重试开始新一轮自动重试计数
+        update_task(task_id, status=TaskStatus.PENDING, progress=0.0, error=None,
+                    attempts=[], next_retry_at=None)
+    batches.requeue(batch, failed)
+    return {"batch_id": batch_id, "retried": failed, "total": len(failed)}
+
+
+@app.get("/api/queue")
+async def get_queue():
+    """获取下载队列状态（运行中 + 排队中 + 合并到进行中下载的任务 + 本进程 yt-dlp 实例池）"""
+    return {**scheduler.snapshot(), "coalesced": single_flight.snapshot(), "ydl_pool": ydl_pool.snapshot()}
+
+
+@app.get("/api/rate-limits")
+async def get_rate_limits():
+    """各站点当前的自适应限流状态，以及单个视频的连接数（connections）与各连接数测得的吞吐量"""
+    sites = rate_limiter.snapshot()
+    for site, tuning in connection_tuner.snapshot().items():
+        sites.setdefault(site, {}).update(tuning)
+    return sites
+
+
 @app.get("/api/tasks", response_model=TaskListResponse)
 async def list_tasks(
     status: Optional[TaskStatus] = None,
     limit: int = 50,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    archived: bool = False
 ):
-    """获取任务列表"""
-    task_list = list(tasks.values())
+    """获取任务列表（翻页优先使用 next_cursor；archived=true 查询已淘汰的历史任务）"""
+    store = task_store
+    if archived:
+        if task_store.archive is None:
+            raise HTTPException(status_code=400, detail="未启用任务归档")
+        store = task_store.archive
+    try:
+        total, task_list, next_cursor = store.list(status, limit, offset, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    if status:
-        task_list = [t for t in task_list if t.status == status]
+    return TaskListResponse(
+        total=total,
+        tasks=task_list,
+        next_cursor=next_cursor
+    )
 
-    task_list.sort(key=lambda t: t.created_at, reverse=True)
 
-    return TaskListResponse(
-        total=len(task_list),
-        tasks=task_list[offset:offset + limit]
+@app.get("/api/tasks/events")
+async def task_events():
+    """任务变更推送（SSE），只推送增量字段"""
+    return StreamingResponse(
+        event_broker.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 
 @app.get("/api/tasks/{task_id}", response_model=DownloadTask)
 async def get_task(task_id: str):
-    """获取任务详情"""
-    if task_id not in tasks:
+    """获取任务详情（包括已归档的任务）"""
+    task = task_store.get(task_id)
+    if task is None and task_store.archive is not None:
+        task = task_store.archive.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return task
+
+
+@app.post("/api/tasks/{task_id}/cancel")
+async def cancel_task(task_id: str):
+    """取消任务（删除未完成文件）"""
+    return _stop_task(task_id, 'cancel')
+
+
+@app.post("/api/tasks/{task_id}/pause")
+async def pause_task(task_id: str):
+    """暂停任务（保留 .part 文件，继续时断点续传）"""
+    return _stop_task(task_id, 'pause')
+
+
+def _stop_task(task_id: str, mode: str) -> Dict[str, Any]:
+    task = task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="任务不存在")
-    return tasks[task_id]
+    if task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED):
+        raise HTTPException(status_code=400, detail="任务已结束")
+
+    stage = scheduler.cancel(task_id, mode)
+    status = TaskStatus.PAUSED if mode == 'pause' else TaskStatus.CANCELLED
+    if stage != 'running':
+        # 未在运行：直接更新状态；运行中的任务由下载线程中断后更新
+        update_task(task_id, status=status, next_retry_at=None)
+        if stage is not None:
+            handoff_single_flight(task_id)
+        return {"task_id": task_id, "status": status, "stage": stage}
+    # 运行中：协作式取消，下载在下一个检查点中断，任务状态届时才会变化
+    return {
+        "task_id": task_id,
+        "status": task.status,
+        "requested": status,
+        "stage": stage,
+        "message": "已请求停止，下载会在下一个检查点（传输进度、频道条目之间、后处理开始前）中断，"
+                   "解析元数据或后处理进行中时需等待其结束",
+    }
+
+
+@app.post("/api/tasks/{task_id}/resume")
+async def resume_task(task_id: str):
+    """继续已暂停/取消的任务"""
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if task.status not in (TaskStatus.PAUSED, TaskStatus.CANCELLED):
+        raise HTTPException(status_code=400, detail="只有已暂停或已取消的任务可以继续")
+
+    update_task(task_id, status=TaskStatus.PENDING, error=None)
+    batch = batches.get(task.batch_id) if task.batch_id else None
+    if batch is not None:
+        batches.requeue(batch, [task_id])
+    else:
+        enqueue_task(task)
+    return {"task_id": task_id, "status": TaskStatus.PENDING}
 
 
 @app.delete("/api/tasks/{task_id}")
 async def delete_task(task_id: str):
-    """删除任务"""
-    if task_id not in tasks:
+    """删除任务（运行中的下载会被取消）"""
+    task = task_store.get(task_id)
+    stage = scheduler.cancel(task_id, 'cancel')
+    deleted = task_store.delete(task_id)
+    if task_store.archive is not None:
+        deleted = task_store.archive.delete(task_id) or deleted
+    if not deleted:
         raise HTTPException(status_code=404, detail="任务不存在")
-    del tasks[task_id]
+    event_broker.publish_deleted(task_id)
+    if task and task.batch_id:
+        batches.task_finished(task)
+    # 运行中的领头任务在下载中断后再交接
+    if stage in ('queued', 'retrying'):
+        handoff_single_flight(task_id)
+    else:
+        single_flight.detach(task_id)
     return {"message": "任务已删除"}
 
 
 @app.delete("/api/tasks")
 async def clear_completed_tasks():
     """清除已完成的任务"""
-    to_delete = [
-        tid for tid, task in tasks.items()
-        if task.status in [TaskStatus.COMPLETED, TaskStatus.FAILED]
-    ]
-    for tid in to_delete:
-        del tasks[tid]
-    return {"message": f"已清除 {len(to_delete)} 个任务"}
+    count = task_store.delete_by_status([TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED])
+    event_broker.publish_resync()
+    return {"message": f"已清除 {count} 个任务"}
+
+
+# 模块导入耗时（含任务存储、调度器等模块级初始化）
+startup_timings["import"] = round(time.monotonic() - _import_started, 3)
 
 
 # ==================== 启动 ====================
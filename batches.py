@@ -0,0 +1,154 @@
+"""
+批量下载
+
+- 一个批次包含多个子任务（DownloadTask.batch_id 指向所属批次）
+- 批次最多同时向调度器提交 parallelism 个子任务，子任务结束（完成/失败/取消/暂停）后再补充下一个，
+  500 个 URL 的批次不会一次性占满下载队列，其他任务仍能插队执行
+- 汇总子任务的字节数、进度与 ETA；失败的子任务可以单独重试
+- 批次对象只保存在内存中（与调度器队列一致），重启后子任务仍保留在任务存储里
+"""
+import os
+import logging
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from models import DownloadTask, TaskStatus
+from task_store import TaskStore
+
+logger = logging.getLogger(__name__)
+
+BATCH_PARALLELISM = int(os.getenv('BATCH_PARALLELISM', '2'))   # 单个批次同时下载数
+
+# 子任务进入这些状态后释放批次名额
+BATCH_SLOT_RELEASE_STATUSES = (
+    TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED, TaskStatus.PAUSED
+)
+
+
+@dataclass
+class BatchJob:
+    """批次"""
+    id: str
+    task_ids: List[str]
+    parallelism: int
+    created_at: datetime = field(default_factory=datetime.now)
+    waiting: Deque[str] = field(default_factory=deque)   # 尚未提交到调度器
+    active: Set[str] = field(default_factory=set)        # 已提交、未结束
+
+
+class BatchManager:
+    """批次管理：按并发上限向调度器分发子任务"""
+
+    def __init__(self, store: TaskStore, submit: Callable[[DownloadTask], None]):
+        self._store = store
+        self._submit = submit
+        self._batches: Dict[str, BatchJob] = {}
+
+    def create(self, batch_id: str, tasks: List[DownloadTask],
+               parallelism: Optional[int] = None) -> BatchJob:
+        """创建批次（子任务需已写入任务存储）"""
+        batch = BatchJob(
+            id=batch_id,
+            task_ids=[t.id for t in tasks],
+            parallelism=max(1, parallelism or BATCH_PARALLELISM),
+        )
+        batch.waiting.extend(batch.task_ids)
+        self._batches[batch_id] = batch
+        self._fill(batch)
+        return batch
+
+    def get(self, batch_id: str) -> Optional[BatchJob]:
+        return self._batches.get(batch_id)
+
+    def list(self) -> List[BatchJob]:
+        return sorted(self._batches.values(), key=lambda b: b.created_at, reverse=True)
+
+    def task_finished(self, task: DownloadTask):
+        """子任务结束或被删除：释放名额并补充下一个"""
+        batch = self._batches.get(task.batch_id) if task.batch_id else None
+        if batch is None:
+            return
+        batch.active.discard(task.id)
+        try:
+            batch.waiting.remove(task.id)
+        except ValueError:
+            pass
+        self._fill(batch)
+
+    def requeue(self, batch: BatchJob, task_ids: Iterable[str]):
+        """把子任务重新排到批次队首（重试/继续下载）"""
+        for task_id in reversed(list(task_ids)):
+            if task_id not in batch.active and task_id not in batch.waiting:
+                batch.waiting.appendleft(task_id)
+        self._fill(batch)
+
+    def _fill(self, batch: BatchJob):
+        while batch.waiting and len(batch.active) < batch.parallelism:
+            task_id = batch.waiting.popleft()
+            task = self._store.get(task_id)
+            # 排队期间被取消/删除的子任务直接跳过
+            if task is None or task.status != TaskStatus.PENDING:
+                continue
+            batch.active.add(task_id)
+            self._submit(task)
+
+    def summary(self, batch: BatchJob, with_items: bool = False) -> Dict[str, Any]:
+        """批次汇总：状态计数、字节数、平均进度、ETA"""
+        tasks = [t for t in (self._store.get(tid) for tid in batch.task_ids) if t is not None]
+        counts = Counter(t.status.value for t in tasks)
+
+        known = [t for t in tasks if t.total_bytes]
+        total_bytes = sum(t.total_bytes for t in known)
+        downloaded_bytes = sum(
+            t.total_bytes if t.status == TaskStatus.COMPLETED else (t.downloaded_bytes or 0)
+            for t in known
+        )
+        speed = sum(t.speed or 0 for t in tasks if t.status == TaskStatus.DOWNLOADING)
+
+        # 未开始的子任务大小未知，按已知子任务的平均大小估算剩余字节
+        eta = None
+        unfinished = [t for t in tasks if t.status not in BATCH_SLOT_RELEASE_STATUSES]
+        if speed > 0 and known:
+            avg_size = total_bytes / len(known)
+            remaining = sum(
+                (t.total_bytes - (t.downloaded_bytes or 0)) if t.total_bytes else avg_size
+                for t in unfinished
+            )
+            eta = int(remaining / speed)
+
+        progress = 0.0
+        if tasks:
+            progress = sum(
+                100.0 if t.status == TaskStatus.COMPLETED else t.progress for t in tasks
+            ) / len(tasks)
+
+        result = {
+            'batch_id': batch.id,
+            'created_at': batch.created_at,
+            'parallelism': batch.parallelism,
+            'total': len(tasks),
+            'counts': dict(counts),
+            'running': len(batch.active),
+            'waiting': len(batch.waiting),
+            'done': not unfinished,
+            'progress': round(progress, 1),
+            'downloaded_bytes': downloaded_bytes,
+            'total_bytes': total_bytes,
+            'speed': round(speed, 1),
+            'eta': eta,
+        }
+        if with_items:
+            result['items'] = [
+                {
+                    'task_id': t.id,
+                    'url': t.url,
+                    'title': t.title,
+                    'status': t.status,
+                    'progress': t.progress,
+                    'error': t.error,
+                }
+                for t in tasks
+            ]
+        return result
@@ -0,0 +1,141 @@
+"""
+并行 Range 下载基准测试
+
+在本地启动一个支持 Range 的 HTTP 服务器（每个连接限速，模拟经代理时单连接的速度上限），
+用不同的连接数下载同一个文件，输出耗时/吞吐量并校验内容。
+
+用法:
+    python bench_download.py                       # 64MB 文件，单连接限速 8MB/s，连接数 1/2/4/8
+    python bench_download.py --size 256 --rate 4 --connections 1,4,16
+    python bench_download.py --rate 0              # 不限速（只看本机开销）
+"""
+import os
+import re
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yt_dlp
+
+import parallel_http
+
+
+def make_handler(path: str, rate: float):
+    size = os.path.getsize(path)
+
+    class RangeHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self._respond(head=True)
+
+        def do_GET(self):
+            self._respond(head=False)
+
+        def _respond(self, head: bool):
+            start, end = 0, size - 1
+            match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            else:
+                self.send_response(200)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            if head:
+                return
+            # 按单连接限速发送
+            sent, began = 0, time.monotonic()
+            with open(path, 'rb') as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    data = f.read(min(64 * 1024, remaining))
+                    try:
+                        self.wfile.write(data)
+                    except (BrokenPipeError, ConnectionResetError):
+                        return
+                    sent += len(data)
+                    remaining -= len(data)
+                    if rate:
+                        delay = sent / rate - (time.monotonic() - began)
+                        if delay > 0:
+                            time.sleep(delay)
+
+    return RangeHandler
+
+
+def sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='并行 Range 下载基准测试')
+    parser.add_argument('--size', type=int, default=64, help='测试文件大小（MB）')
+    parser.add_argument('--rate', type=float, default=8, help='服务器单连接限速（MB/s，0 不限速）')
+    parser.add_argument('--connections', default='1,2,4,8', help='要测试的连接数，逗号分隔')
+    args = parser.parse_args()
+    parallel_http.install()
+
+    workdir = tempfile.mkdtemp(prefix='bench_download_')
+    source = os.path.join(workdir, 'source.mp4')
+    with open(source, 'wb') as f:
+        for _ in range(args.size):
+            f.write(os.urandom(1024 * 1024))
+    expected = sha256(source)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(source, args.rate * 1024 * 1024))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/source.mp4'
+    print(f"文件 {args.size}MB，单连接限速 {args.rate or '不限'} MB/s，{url}")
+    print(f"{'连接数':>6} {'耗时(s)':>8} {'吞吐量(MB/s)':>12} {'加速':>6}  校验")
+
+    baseline = None
+    try:
+        for connections in [int(n) for n in args.connections.split(',')]:
+            target = os.path.join(workdir, f'out{connections}')
+            opts = {
+                'outtmpl': os.path.join(target, '%(id)s.%(ext)s'),
+                'quiet': True,
+                'noprogress': True,
+                'range_connections': connections,
+            }
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                started = time.monotonic()
+                info = ydl.extract_info(url, download=True)
+                elapsed = time.monotonic() - started
+            path = info['requested_downloads'][0]['filepath']
+            baseline = baseline or elapsed
+            ok = 'OK' if sha256(path) == expected else '内容不一致'
+            print(f"{connections:>6} {elapsed:>8.2f} {args.size / elapsed:>12.1f} {baseline / elapsed:>5.1f}x  {ok}")
+            shutil.rmtree(target)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
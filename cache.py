@@ -3,7 +3,6 @@ Redis 缓存模块 - COS 文件列表缓存
 """
 import os
 import json
-import redis
 import logging
 from typing import Optional
 from datetime import datetime
@@ -19,8 +18,9 @@ CACHE_TTL = int(os.getenv('CACHE_TTL', '300'))  # 5分钟过期
 _redis_pool = None
 
 
-def get_redis() -> redis.Redis:
-    """获取 Redis 连接"""
+def get_redis() -> 'redis.Redis':
+    """获取 Redis 连接（首次使用时才导入 redis）"""
+    import redis
     global _redis_pool
     if _redis_pool is None:
         _redis_pool = redis.ConnectionPool(
@@ -2,9 +2,12 @@
 腾讯云 COS 上传模块（带 Redis 缓存）
 """
 import os
+import time
+import hashlib
 import logging
-from qcloud_cos import CosConfig, CosS3Client
+from typing import Dict, Optional
 from cache import get_cos_cache, set_cos_cache, invalidate_cos_cache
+from metrics import PHASE_SECONDS, UPLOAD_BYTES, UPLOAD_FILES
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +16,8 @@ COS_SECRET_ID = os.getenv('COS_SECRET_ID', '')
 COS_SECRET_KEY = os.getenv('COS_SECRET_KEY', '')
 COS_BUCKET = os.getenv('COS_BUCKET', '')
 COS_REGION = os.getenv('COS_REGION', 'ap-beijing')
+# 上传时写入对象的内容摘要（登记表的 checksum，没有则为文件 sha256），之后据此判断对象是否已是相同内容
+CHECKSUM_META = 'x-cos-meta-sha256'
 
 
 def get_cos_client():
@@ -20,6 +25,8 @@ def get_cos_client():
     if not all([COS_SECRET_ID, COS_SECRET_KEY, COS_BUCKET]):
         return None
 
+    # 首次使用时才导入 SDK，未配置 COS 时不加载
+    from qcloud_cos import CosConfig, CosS3Client
     config = CosConfig(
         Region=COS_REGION,
         SecretId=COS_SECRET_ID,
@@ -28,8 +35,16 @@ def get_cos_client():
     return CosS3Client(config)
 
 
-def upload_file(local_path: str, cos_key: str) -> dict:
-    """上传单个文件到 COS"""
+def _file_digest(path: str, algorithm: str = 'sha256') -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def upload_file(local_path: str, cos_key: str, checksum: Optional[str] = None) -> dict:
+    """上传单个文件到 COS（checksum 为内容摘要，写入对象元数据；不传则计算文件 sha256）"""
     client = get_cos_client()
     if not client:
         return {'success': False, 'error': 'COS 未配置'}
@@ -39,12 +54,62 @@ def upload_file(local_path: str, cos_key: str) -> dict:
             Bucket=COS_BUCKET,
             Key=cos_key,
             LocalFilePath=local_path,
+            Metadata={CHECKSUM_META: checksum or _file_digest(local_path)},
         )
         url = f"https://{COS_BUCKET}.cos.{COS_REGION}.myqcloud.com/{cos_key}"
         logger.info(f"上传成功: {cos_key}")
+        UPLOAD_FILES.labels('success').inc()
+        UPLOAD_BYTES.inc(os.path.getsize(local_path))
         return {'success': True, 'url': url, 'etag': response.get('ETag')}
     except Exception as e:
         logger.error(f"上传失败: {e}")
+        UPLOAD_FILES.labels('failed').inc()
+        return {'success': False, 'error': str(e)}
+
+
+def _remote_head(client, cos_key: str) -> Optional[Dict[str, str]]:
+    """COS 上已有对象的头信息（大小、ETag、元数据），不存在返回 None"""
+    from qcloud_cos.cos_exception import CosServiceError
+    try:
+        return client.head_object(Bucket=COS_BUCKET, Key=cos_key)
+    except CosServiceError as e:
+        if e.get_status_code() != 404:
+            logger.warning(f"查询对象失败 {cos_key}: {e}")
+        return None
+
+
+def _same_content(head: Optional[Dict[str, str]], local_path: str, size: int, checksum: str) -> bool:
+    """
+    对象内容与本地文件相同：比较上传时写入的内容摘要元数据；
+    没有元数据的旧对象在简单上传时 ETag 为内容 MD5，分块上传的 ETag（带 -N）无法比较，视为不同
+    """
+    if head is None or int(head.get('Content-Length', -1)) != size:
+        return False
+    remote = head.get(CHECKSUM_META)
+    if remote:
+        return remote == checksum
+    etag = (head.get('ETag') or '').strip('"')
+    return bool(etag) and '-' not in etag and etag == _file_digest(local_path, 'md5')
+
+
+def copy_object(source_key: str, cos_key: str) -> dict:
+    """COS 服务端复制（内容已在 COS 上，不再上传）"""
+    client = get_cos_client()
+    if not client:
+        return {'success': False, 'error': 'COS 未配置'}
+
+    try:
+        client.copy(
+            Bucket=COS_BUCKET,
+            Key=cos_key,
+            CopySource={'Bucket': COS_BUCKET, 'Key': source_key, 'Region': COS_REGION},
+        )
+        logger.info(f"服务端复制: {source_key} -> {cos_key}")
+        UPLOAD_FILES.labels('copied').inc()
+        url = f"https://{COS_BUCKET}.cos.{COS_REGION}.myqcloud.com/{cos_key}"
+        return {'success': True, 'url': url, 'copied_from': source_key}
+    except Exception as e:
+        logger.warning(f"服务端复制失败 {source_key}: {e}")
         return {'success': False, 'error': str(e)}
 
 
@@ -195,14 +260,22 @@ def get_file_url(key: str, expires: int = 3600) -> dict:
         return {'success': False, 'error': str(e)}
 
 
-def upload_video_folder(video_dir: str, uploader: str, title: str) -> dict:
-    """上传整个视频文件夹到 COS"""
+def upload_video_folder(video_dir: str, uploader: str, title: str,
+                        copy_sources: Optional[Dict[str, str]] = None,
+                        checksums: Optional[Dict[str, str]] = None) -> dict:
+    """
+    上传整个视频文件夹到 COS
+    - 目标对象已是相同内容（内容摘要元数据或 ETag 与本地一致）：跳过
+    - copy_sources 中的文件（本地路径 -> 相同内容已有的 COS key）：服务端复制（元数据随之复制），失败再上传
+    - checksums 为登记表中下载时算好的内容摘要（本地路径 -> checksum），其余文件现算 sha256
+    """
     client = get_cos_client()
     if not client:
         return {'success': False, 'error': 'COS 未配置'}
 
     results = []
     base_cos_path = f"{uploader}/{title}"
+    started = time.monotonic()
 
     for root, dirs, files in os.walk(video_dir):
         for filename in files:
@@ -211,13 +284,25 @@ def upload_video_folder(video_dir: str, uploader: str, title: str) -> dict:
             rel_path = os.path.relpath(local_path, video_dir)
             cos_key = f"{base_cos_path}/{rel_path}"
 
-            result = upload_file(local_path, cos_key)
+            size = os.path.getsize(local_path)
+            checksum = (checksums or {}).get(local_path) or _file_digest(local_path)
+            if _same_content(_remote_head(client, cos_key), local_path, size, checksum):
+                UPLOAD_FILES.labels('skipped').inc()
+                result = {'success': True, 'skipped': True}
+            else:
+                result = None
+                source_key = (copy_sources or {}).get(local_path)
+                if source_key and _same_content(_remote_head(client, source_key), local_path, size, checksum):
+                    result = copy_object(source_key, cos_key)
+                if not result or not result.get('success'):
+                    result = upload_file(local_path, cos_key, checksum)
             results.append({
                 'file': rel_path,
                 **result
             })
 
     success_count = sum(1 for r in results if r.get('success'))
+    PHASE_SECONDS.labels('upload').observe(time.monotonic() - started)
 
     # 清除缓存
     if success_count > 0:
@@ -228,5 +313,6 @@ def upload_video_folder(video_dir: str, uploader: str, title: str) -> dict:
         'success': success_count == len(results),
         'total': len(results),
         'uploaded': success_count,
+        'cos_prefix': base_cos_path,
         'files': results
     }
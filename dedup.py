@@ -0,0 +1,936 @@
+"""
+已下载视频去重记录
+
+DEDUP_BACKEND=sqlite（默认）: SQLiteRegistry
+- 下载目录下的 .downloaded_videos.db，主键 (extractor, video_id)，另建 video_id / video_dir 索引，
+  百万级记录下查询仍是一次索引查找，不需要把全部 ID 读进内存
+- 每个视频一行：所在目录、主媒体文件、大小、格式、sha256、COS 上传状态和时间
+- WAL 模式，多进程共享同一下载目录；首次启动时导入旧版快照和日志中的 (提取器, ID)（没有提取器的旧记录记为空）
+- 登记表只增不删，查到的 ID 缓存在进程内（LRU，最多 DEDUP_CACHE_SIZE 条）无需失效，
+  频道定期检查时反复出现的已下载 ID 不再访问数据库；未命中的仍查库，其他进程新写入的记录立即可见
+
+DEDUP_BACKEND=journal: JournalRegistry，只记录 (提取器, ID)
+- 快照: .downloaded_videos.json（{"video_ids": [...], "videos": {提取器: [...]}}；
+  video_ids 为没有提取器的旧记录，旧版文件直接作为初始快照）
+- 日志: .downloaded_videos.journal，每完成一个视频追加一行 "提取器\tID"（旧版行只有 ID），不再整体重写 JSON
+- 提取器为空的旧记录与任意提取器匹配，与 SQLite/Redis 后端导入的旧 ID 相同
+- 内存中维护 ID -> 提取器集合；日志超过 DEDUP_COMPACT_THRESHOLD 行时合并进快照
+  （写临时文件后 rename 原子替换，再清空日志），写入中途崩溃不会损坏快照
+- 多进程（EXECUTION_MODE=process）共享同一下载目录：追加使用 O_APPEND 单次写入，
+  查询前增量读取其他进程追加的日志，快照被替换（inode 变化）时全量重新加载；
+  合并期间持有日志文件的排他锁，追加方持有共享锁
+
+DEDUP_BACKEND=redis: RedisRegistry，多台机器共享（REDIS_HOST/REDIS_PORT）
+- {prefix}:ids:{提取器} 集合 + 每个视频一个哈希记录，{prefix}:dir:{目录} 索引 COS 上传回写
+
+认领（claim）：决定下载某个视频前先原子地"检查未下载 + 登记下载中"，
+同一视频同一时间只有一个 worker 能认领成功；认领是租约（DEDUP_CLAIM_TTL 秒后过期，
+防止崩溃的 worker 永久占住），下载完成写入记录时清除，失败/中断时主动释放。
+- sqlite: claims 表，BEGIN IMMEDIATE 事务内检查并写入
+- journal: .downloaded_videos.claims（JSON），持有日志文件排他锁时读改写
+- redis: WATCH ID 集合与认领键，事务内 SET EX
+
+内容去重：记录的 checksum 是下载内容的摘要，由 StreamHasher 在下载过程中计算，登记时不再读取文件：
+StreamHasher 作为 progress hook 增量读取刚写入的数据（读的是页缓存）计算每个媒体流的 sha256，
+单个流时即为该流的 sha256，多个流（视频 + 音频合并）时为排序后各流摘要的 sha256（combine_digests）。
+下载过程中没有算出摘要的记录（文件已存在跳过下载等）checksum 为空，不参与内容去重。
+不同 URL 下载到相同内容时，新文件替换为已有文件的硬链接（DEDUP_HARDLINK），
+上传 COS 时从已上传的相同内容服务端复制（cos_sources）。
+
+频道同步状态（高水位）与登记表存放在同一后端，多进程/多机共享：
+sqlite 为 channel_sync 表，journal 为 .channel_sync.json，redis 为 {prefix}:sync 哈希。
+"""
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from models import VideoRecord
+
+logger = logging.getLogger(__name__)
+
+DEDUP_BACKEND = os.getenv('DEDUP_BACKEND', 'sqlite').lower()   # sqlite / journal / redis
+DEDUP_CHECKSUM = os.getenv('DEDUP_CHECKSUM', 'true').lower() == 'true'   # 下载过程中计算内容摘要
+DEDUP_COMPACT_THRESHOLD = int(os.getenv('DEDUP_COMPACT_THRESHOLD', '1000'))  # 日志合并阈值（行）
+DEDUP_REFRESH_INTERVAL = 1.0   # 检查其他进程写入的最小间隔（秒）
+DEDUP_CACHE_SIZE = int(os.getenv('DEDUP_CACHE_SIZE', '100000'))   # 进程内缓存的已下载 ID 数
+DEDUP_CLAIM_TTL = int(os.getenv('DEDUP_CLAIM_TTL', '21600'))   # 认领租约（秒），需长于单个视频下载时间
+DEDUP_REDIS_PREFIX = os.getenv('DEDUP_REDIS_PREFIX', 'vd:dedup')
+DEDUP_HARDLINK = os.getenv('DEDUP_HARDLINK', 'true').lower() == 'true'   # 相同内容的文件硬链接
+HASHER_READ_BYTES = 8 * 1024 * 1024   # 下载中新写入超过该字节数才读取一次
+HASHER_READ_INTERVAL = 2.0     # 或距上次读取超过该秒数（数据仍在页缓存中）
+HASHER_MAX_STREAMS = 256       # 同时跟踪的未完成媒体流（失败/取消的下载不会再结束，超出后丢弃最早的）
+LOOKUP_CHUNK = 500             # 批量查询每条 SQL 的 ID 数（低于 SQLite 参数上限）
+
+SNAPSHOT_FILE = '.downloaded_videos.json'
+JOURNAL_FILE = '.downloaded_videos.journal'
+CLAIMS_FILE = '.downloaded_videos.claims'
+SYNC_FILE = '.channel_sync.json'
+DB_FILE = '.downloaded_videos.db'
+
+
+def combine_digests(digests: List[str]) -> str:
+    """内容摘要：单个流为该流的 sha256，多个流为排序后各流摘要的 sha256（与合并顺序无关）"""
+    digests = sorted(digests)
+    if len(digests) == 1:
+        return digests[0]
+    return hashlib.sha256('\n'.join(digests).encode()).hexdigest()
+
+
+class StreamHasher:
+    """
+    下载过程中计算媒体流 sha256（progress hook）
+    - downloading: 新写入超过 HASHER_READ_BYTES 或距上次读取超过 HASHER_READ_INTERVAL 时，
+      从上次位置读取 .part 文件新写入的部分（文件变短说明重新下载，从头计算）；
+      分段并行下载时只读到 contiguous_bytes（文件开头已连续写入的部分）
+    - finished: 读完剩余部分（此时已重命名为最终文件名），摘要按最终文件名保存，由 pop() 取走
+    - 每个流一把锁，读文件时只持有该流的锁，并行下载的不同视频互不等待；_lock 只保护字典；
+      未到读取阈值的回调只查一次字典，不加锁、不碰文件
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # tmpfilename -> (sha256, 已读字节, 上次读取时间)
+        self._streams: 'OrderedDict[str, Tuple[Any, int, float]]' = OrderedDict()
+        self._stream_locks: Dict[str, threading.Lock] = {}
+        self._digests: 'OrderedDict[str, str]' = OrderedDict()  # 文件 -> sha256
+
+    def _trim(self, d: OrderedDict):
+        while len(d) > HASHER_MAX_STREAMS:
+            key, _ = d.popitem(last=False)
+            if d is self._streams:
+                self._stream_locks.pop(key, None)
+
+    def _stream_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._stream_locks.setdefault(key, threading.Lock())
+
+    def _due(self, key: str, available: Optional[int]) -> bool:
+        """距上次读取新写入的数据是否已够读一次"""
+        entry = self._streams.get(key)
+        if entry is None:
+            return True
+        _, offset, read_at = entry
+        if available is not None and available - offset >= HASHER_READ_BYTES:
+            return True
+        return time.monotonic() - read_at >= HASHER_READ_INTERVAL and (available is None or available > offset)
+
+    def _feed_file(self, key: str, path: str, limit: Optional[int] = None):
+        """读取 path 中 key 对应流尚未读取的部分，最多读到 limit（调用方持有该流的锁）"""
+        with self._lock:
+            digest, offset, _ = self._streams.get(key) or (hashlib.sha256(), 0, 0.0)
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < offset:
+                    digest, offset = hashlib.sha256(), 0
+                f.seek(offset)
+                while chunk := f.read(1024 * 1024 if limit is None else min(1024 * 1024, limit - offset)):
+                    digest.update(chunk)
+                    offset += len(chunk)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._streams[key] = (digest, offset, time.monotonic())
+            self._streams.move_to_end(key)
+            self._trim(self._streams)
+
+    def hook(self, d: Dict[str, Any]):
+        status = d.get('status')
+        filename = d.get('filename')
+        tmpfilename = d.get('tmpfilename') or filename
+        if not tmpfilename or tmpfilename == '-':
+            return
+        if status == 'downloading':
+            limit = d.get('contiguous_bytes')
+            if not self._due(tmpfilename, limit if limit is not None else d.get('downloaded_bytes')):
+                return
+            with self._stream_lock(tmpfilename):
+                self._feed_file(tmpfilename, tmpfilename, limit)
+        elif status == 'finished' and filename:
+            # 已存在的文件（跳过下载）也会收到 finished，此时整文件计算
+            with self._lock:
+                key = tmpfilename if tmpfilename in self._streams else f"{filename}.part"
+                if key not in self._streams:
+                    key = filename
+            with self._stream_lock(key):
+                self._feed_file(key, filename)
+                with self._lock:
+                    digest, _, _ = self._streams.pop(key)
+                    self._stream_locks.pop(key, None)
+                    self._digests[filename] = digest.hexdigest()
+                    self._trim(self._digests)
+
+    def pop(self, filename: str) -> Optional[str]:
+        """filename 下载内容的 sha256；没有算过返回 None"""
+        with self._lock:
+            return self._digests.pop(filename, None)
+
+
+class DownloadRegistry:
+    """去重记录接口"""
+
+    def __contains__(self, video_id: str) -> bool:
+        """任意提取器下载过该 ID"""
+        raise NotImplementedError
+
+    def known(self, extractor: str, video_ids: Iterable[str]) -> Set[str]:
+        """video_ids 中已下载过的 ID"""
+        raise NotImplementedError
+
+    def add(self, video_id: str, extractor: str = '', **fields):
+        """记录一个已下载的视频；fields 为 VideoRecord 的其余字段（只记录 ID 的实现忽略）"""
+        raise NotImplementedError
+
+    def get(self, video_id: str, extractor: Optional[str] = None) -> Optional[VideoRecord]:
+        return None
+
+    def mark_uploaded(self, video_dir: str, cos_prefix: str) -> int:
+        """视频目录已上传到 COS，返回更新的记录数"""
+        return 0
+
+    def find_by_dir(self, video_dir: str) -> List[VideoRecord]:
+        return []
+
+    def find_by_checksum(self, checksum: str) -> List[VideoRecord]:
+        """内容相同的视频"""
+        return []
+
+    def checksums(self, video_dir: str) -> Dict[str, str]:
+        """目录中已记录内容摘要的文件：本地路径 -> checksum（上传 COS 时判断对象是否已是相同内容）"""
+        return {r.filepath: r.checksum for r in self.find_by_dir(video_dir) if r.filepath and r.checksum}
+
+    def cos_sources(self, video_dir: str) -> Dict[str, str]:
+        """目录中已有相同内容上传到 COS 的文件：本地路径 -> 已有对象的 COS key"""
+        sources = {}
+        for record in self.find_by_dir(video_dir):
+            if not record.checksum or not record.filepath:
+                continue
+            for dup in self.find_by_checksum(record.checksum):
+                if (dup.cos_uploaded and dup.cos_prefix and dup.filepath and dup.video_dir
+                        and dup.video_dir != video_dir):
+                    rel_path = os.path.relpath(dup.filepath, dup.video_dir)
+                    sources[record.filepath] = f"{dup.cos_prefix}/{rel_path}"
+                    break
+        return sources
+
+    def claim(self, video_id: str, extractor: str, owner: str) -> bool:
+        """未下载且未被其他 worker 认领时认领成功（同一 owner 重复认领视为续约）"""
+        raise NotImplementedError
+
+    def release(self, video_id: str, extractor: str, owner: str):
+        """释放自己的认领（下载失败/中断）"""
+        raise NotImplementedError
+
+    def get_sync_state(self, channel: str) -> Optional[Dict[str, Any]]:
+        """频道同步状态（最近一次同步时列表最前面的视频 ID 等）"""
+        raise NotImplementedError
+
+    def set_sync_state(self, channel: str, state: Dict[str, Any]):
+        raise NotImplementedError
+
+    def delete_sync_state(self, channel: str) -> bool:
+        raise NotImplementedError
+
+
+class JournalRegistry(DownloadRegistry):
+    """快照 + 追加日志"""
+
+    def __init__(self, directory: str, compact_threshold: int = DEDUP_COMPACT_THRESHOLD):
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.claims_path = os.path.join(directory, CLAIMS_FILE)
+        self.sync_path = os.path.join(directory, SYNC_FILE)
+        self.compact_threshold = compact_threshold
+        self._lock = threading.Lock()
+        self._ids: Dict[str, Set[str]] = {}   # video_id -> 提取器集合（'' 为旧记录，匹配任意提取器）
+        self._snapshot_sig: Optional[Tuple[int, int]] = None
+        self._offset = 0            # 日志已读取到的位置
+        self._journal_lines = 0     # 日志中的行数（决定何时合并）
+        self._last_refresh = 0.0
+        with self._lock:
+            self._reload()
+        logger.info(f"去重记录: {len(self._ids)} 个视频")
+
+    # ==================== 读取 ====================
+
+    def _snapshot_signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.snapshot_path)
+            return st.st_ino, st.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _key(extractor: str, video_id: str) -> str:
+        """日志行 / 认领键：提取器\tID（没有提取器时只有 ID，与旧版相同）"""
+        return f"{extractor}\t{video_id}" if extractor else video_id
+
+    def _add_key(self, extractor: str, video_id: str):
+        self._ids.setdefault(video_id, set()).add(extractor)
+
+    def _has(self, extractor: str, video_id: str) -> bool:
+        """该提取器（或旧记录）下载过该 ID（调用方持有锁）"""
+        extractors = self._ids.get(video_id)
+        return bool(extractors) and (not extractor or '' in extractors or extractor in extractors)
+
+    def _reload(self):
+        """全量加载快照和日志（调用方持有锁）"""
+        self._ids = {}
+        sig = self._snapshot_signature()
+        if sig is not None:
+            try:
+                with open(self.snapshot_path, 'r') as f:
+                    data = json.load(f)
+                for video_id in data.get('video_ids', []):
+                    self._add_key('', video_id)
+                for extractor, video_ids in (data.get('videos') or {}).items():
+                    for video_id in video_ids:
+                        self._add_key(extractor, video_id)
+            except Exception as e:
+                logger.warning(f"加载去重快照失败: {e}")
+        self._snapshot_sig = sig
+        self._offset = 0
+        self._journal_lines = 0
+        self._read_journal()
+        self._last_refresh = time.monotonic()
+
+    def _read_journal(self):
+        """读取日志中新追加的完整行（写入中的最后一行留到下次）"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            extractor, _, video_id = line.decode('utf-8', 'replace').strip().rpartition('\t')
+            if video_id:
+                self._add_key(extractor, video_id)
+                self._journal_lines += 1
+        self._offset += end
+
+    def _refresh(self, force: bool = False):
+        """同步其他进程的写入（调用方持有锁）"""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < DEDUP_REFRESH_INTERVAL:
+            return
+        self._last_refresh = now
+        if self._snapshot_signature() != self._snapshot_sig:
+            self._reload()
+            return
+        try:
+            size = os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            size = 0
+        if size < self._offset:
+            self._reload()
+        elif size > self._offset:
+            self._read_journal()
+
+    def __contains__(self, video_id: str) -> bool:
+        with self._lock:
+            self._refresh()
+            return video_id in self._ids
+
+    def known(self, extractor: str, video_ids: Iterable[str]) -> Set[str]:
+        with self._lock:
+            self._refresh()
+            return {v for v in video_ids if self._has(extractor, v)}
+
+    def ids(self) -> Set[str]:
+        with self._lock:
+            self._refresh()
+            return set(self._ids)
+
+    def keys(self) -> Set[Tuple[str, str]]:
+        """全部 (提取器, ID)（导入其他后端用）"""
+        with self._lock:
+            self._refresh()
+            return {(e, v) for v, extractors in self._ids.items() for e in extractors}
+
+    # ==================== 写入 ====================
+
+    @contextmanager
+    def _journal_fd(self, lock_type: int) -> Iterator[int]:
+        fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, lock_type)
+            yield fd
+        finally:
+            os.close(fd)   # 关闭即释放锁
+
+    def add(self, video_id: str, extractor: str = '', **fields):
+        """记录一个已下载的视频（追加一行）"""
+        extractor = extractor or ''
+        with self._lock:
+            if extractor in self._ids.get(video_id, ()):
+                return
+            with self._journal_fd(fcntl.LOCK_SH) as fd:
+                os.write(fd, f"{self._key(extractor, video_id)}\n".encode())
+            self._add_key(extractor, video_id)
+            # 其他进程可能同时追加，从上次位置读到末尾（包括刚写入的这一行）
+            self._read_journal()
+            if self._journal_lines >= self.compact_threshold:
+                self._compact()
+
+    # ==================== 认领 ====================
+
+    def _load_claims(self) -> dict:
+        """未过期、未完成的认领（调用方持有日志排他锁）"""
+        try:
+            with open(self.claims_path, 'r') as f:
+                claims = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        now = time.time()
+        return {k: v for k, v in claims.items()
+                if v[1] > now and not self._has(*k.rpartition('\t')[::2])}
+
+    def _save_claims(self, claims: dict):
+        tmp = f"{self.claims_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(claims, f)
+        os.replace(tmp, self.claims_path)
+
+    def claim(self, video_id: str, extractor: str, owner: str) -> bool:
+        with self._lock, self._journal_fd(fcntl.LOCK_EX):
+            self._refresh(force=True)
+            if self._has(extractor, video_id):
+                return False
+            key = self._key(extractor, video_id)
+            claims = self._load_claims()
+            holder = claims.get(key)
+            if holder and holder[0] != owner:
+                return False
+            claims[key] = [owner, time.time() + DEDUP_CLAIM_TTL]
+            self._save_claims(claims)
+            return True
+
+    def release(self, video_id: str, extractor: str, owner: str):
+        with self._lock, self._journal_fd(fcntl.LOCK_EX):
+            key = self._key(extractor, video_id)
+            claims = self._load_claims()
+            holder = claims.get(key)
+            if holder and holder[0] == owner:
+                del claims[key]
+                self._save_claims(claims)
+
+    # ==================== 频道同步状态 ====================
+
+    def _load_sync(self) -> Dict[str, Any]:
+        try:
+            with open(self.sync_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_sync(self, states: Dict[str, Any]):
+        tmp = f"{self.sync_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(states, f, ensure_ascii=False)
+        os.replace(tmp, self.sync_path)
+
+    def get_sync_state(self, channel: str) -> Optional[Dict[str, Any]]:
+        return self._load_sync().get(channel)
+
+    def set_sync_state(self, channel: str, state: Dict[str, Any]):
+        with self._lock, self._journal_fd(fcntl.LOCK_EX):
+            states = self._load_sync()
+            states[channel] = state
+            self._save_sync(states)
+
+    def delete_sync_state(self, channel: str) -> bool:
+        with self._lock, self._journal_fd(fcntl.LOCK_EX):
+            states = self._load_sync()
+            if states.pop(channel, None) is None:
+                return False
+            self._save_sync(states)
+            return True
+
+    def compact(self):
+        """把日志合并进快照"""
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        with self._journal_fd(fcntl.LOCK_EX) as fd:
+            # 持有排他锁后读取最新内容，期间其他进程无法追加
+            self._refresh(force=True)
+            tmp = f"{self.snapshot_path}.tmp"
+            videos: Dict[str, List[str]] = {}
+            for video_id, extractors in self._ids.items():
+                for extractor in extractors:
+                    videos.setdefault(extractor, []).append(video_id)
+            with open(tmp, 'w') as f:
+                json.dump({'video_ids': sorted(videos.pop('', [])),
+                           'videos': {e: sorted(v) for e, v in videos.items()}}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.snapshot_path)
+            os.ftruncate(fd, 0)
+            self._snapshot_sig = self._snapshot_signature()
+            self._offset = 0
+            self._journal_lines = 0
+        logger.info(f"去重记录已合并: {len(self._ids)} 个视频")
+
+
+class SQLiteRegistry(DownloadRegistry):
+    """SQLite 登记表，每个视频一行"""
+
+    _COLUMNS = ('extractor', 'video_id', 'title', 'uploader', 'video_dir', 'filepath',
+                'file_size', 'format', 'checksum', 'cos_uploaded', 'cos_prefix',
+                'downloaded_at', 'uploaded_at')
+
+    def __init__(self, directory: str, path: Optional[str] = None):
+        self.directory = directory
+        self.path = path or os.path.join(directory, DB_FILE)
+        self._local = threading.local()
+        # (提取器, ID) -> None；提取器为 None 表示任意提取器
+        self._hits: 'OrderedDict[Tuple[Optional[str], str], None]' = OrderedDict()
+        self._hits_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS videos (
+                extractor TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                title TEXT,
+                uploader TEXT,
+                video_dir TEXT,
+                filepath TEXT,
+                file_size INTEGER,
+                format TEXT,
+                checksum TEXT,
+                cos_uploaded INTEGER NOT NULL DEFAULT 0,
+                cos_prefix TEXT,
+                downloaded_at REAL,
+                uploaded_at REAL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (extractor, video_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_videos_video_id ON videos (video_id);
+            CREATE INDEX IF NOT EXISTS idx_videos_dir ON videos (video_dir);
+            CREATE INDEX IF NOT EXISTS idx_videos_checksum ON videos (checksum);
+
+            CREATE TABLE IF NOT EXISTS claims (
+                extractor TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (extractor, video_id)
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS channel_sync (
+                channel TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+        self._import_legacy()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _import_legacy(self):
+        """登记表为空时导入旧版快照 + 日志中的 ID"""
+        conn = self._conn()
+        if conn.execute('SELECT 1 FROM videos LIMIT 1').fetchone():
+            return
+        legacy = [os.path.join(self.directory, f) for f in (SNAPSHOT_FILE, JOURNAL_FILE)]
+        if not any(os.path.exists(p) for p in legacy):
+            return
+        keys = JournalRegistry(self.directory).keys()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany(
+            "INSERT OR IGNORE INTO videos (extractor, video_id, updated_at) VALUES (?, ?, ?)",
+            ((extractor, video_id, now) for extractor, video_id in keys)
+        )
+        conn.execute('COMMIT')
+        logger.info(f"已从旧版去重记录导入 {len(keys)} 个视频 ID")
+
+    # ==================== 查询 ====================
+
+    def _cached(self, key: Tuple[Optional[str], str]) -> bool:
+        with self._hits_lock:
+            if key in self._hits:
+                self._hits.move_to_end(key)
+                return True
+            return False
+
+    def _remember(self, keys: Iterable[Tuple[Optional[str], str]]):
+        with self._hits_lock:
+            for key in keys:
+                self._hits[key] = None
+                self._hits.move_to_end(key)
+            while len(self._hits) > DEDUP_CACHE_SIZE:
+                self._hits.popitem(last=False)
+
+    def __contains__(self, video_id: str) -> bool:
+        if self._cached((None, video_id)):
+            return True
+        row = self._conn().execute(
+            'SELECT 1 FROM videos WHERE video_id = ? LIMIT 1', (video_id,)
+        ).fetchone()
+        if row is None:
+            return False
+        self._remember([(None, video_id)])
+        return True
+
+    def known(self, extractor: str, video_ids: Iterable[str]) -> Set[str]:
+        extractor = extractor or ''
+        found: Set[str] = set()
+        missing: List[str] = []
+        for video_id in dict.fromkeys(video_ids):
+            if self._cached((extractor, video_id)):
+                found.add(video_id)
+            else:
+                missing.append(video_id)
+        # 提取器为空的是旧版迁移记录，对任何提取器都算已下载
+        conn = self._conn()
+        for i in range(0, len(missing), LOOKUP_CHUNK):
+            chunk = missing[i:i + LOOKUP_CHUNK]
+            marks = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT video_id FROM videos WHERE extractor IN (?, '') AND video_id IN ({marks})",
+                (extractor, *chunk)
+            )
+            hits = [r[0] for r in rows]
+            found.update(hits)
+            self._remember((extractor, v) for v in hits)
+        return found
+
+    def get(self, video_id: str, extractor: Optional[str] = None) -> Optional[VideoRecord]:
+        """按 (提取器, ID) 查找；不指定提取器时取最近下载的一条"""
+        sql = f"SELECT {', '.join(self._COLUMNS)} FROM videos WHERE video_id = ?"
+        params: Tuple = (video_id,)
+        if extractor is not None:
+            sql += " AND extractor IN (?, '')"
+            params += (extractor,)
+        # 精确匹配提取器的优先于迁移记录
+        sql += " ORDER BY extractor = '', downloaded_at DESC LIMIT 1"
+        row = self._conn().execute(sql, params).fetchone()
+        return self._record(row) if row else None
+
+    def find_by_dir(self, video_dir: str) -> List[VideoRecord]:
+        rows = self._conn().execute(
+            f"SELECT {', '.join(self._COLUMNS)} FROM videos WHERE video_dir = ?", (video_dir,)
+        ).fetchall()
+        return [self._record(r) for r in rows]
+
+    def find_by_checksum(self, checksum: str) -> List[VideoRecord]:
+        rows = self._conn().execute(
+            f"SELECT {', '.join(self._COLUMNS)} FROM videos WHERE checksum = ?", (checksum,)
+        ).fetchall()
+        return [self._record(r) for r in rows]
+
+    def _record(self, row: Tuple) -> VideoRecord:
+        data = dict(zip(self._COLUMNS, row))
+        data['cos_uploaded'] = bool(data['cos_uploaded'])
+        for key in ('downloaded_at', 'uploaded_at'):
+            if data[key] is not None:
+                data[key] = datetime.fromtimestamp(data[key])
+        return VideoRecord(**data)
+
+    # ==================== 写入 ====================
+
+    def add(self, video_id: str, extractor: str = '', **fields):
+        """
+        记录（或覆盖）一个已下载的视频
+        传入 filepath 时补充文件大小；内容摘要（checksum）变化则 COS 上传状态清零
+        """
+        filepath = fields.get('filepath')
+        if filepath and os.path.isfile(filepath):
+            fields.setdefault('file_size', os.path.getsize(filepath))
+        now = time.time()
+        values = (
+            extractor or '', video_id,
+            fields.get('title'), fields.get('uploader'), fields.get('video_dir'), filepath,
+            fields.get('file_size'), fields.get('format'), fields.get('checksum'),
+            now, now,
+        )
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute("""
+                INSERT INTO videos (extractor, video_id, title, uploader, video_dir, filepath,
+                                    file_size, format, checksum, downloaded_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (extractor, video_id) DO UPDATE SET
+                    title = excluded.title,
+                    uploader = excluded.uploader,
+                    video_dir = excluded.video_dir,
+                    filepath = excluded.filepath,
+                    file_size = excluded.file_size,
+                    format = excluded.format,
+                    cos_uploaded = CASE WHEN excluded.checksum IS NULL
+                                          OR checksum IS excluded.checksum
+                                        THEN cos_uploaded ELSE 0 END,
+                    checksum = excluded.checksum,
+                    downloaded_at = excluded.downloaded_at,
+                    updated_at = excluded.updated_at
+            """, values)
+            if extractor:
+                # 重新下载后，同 ID 的迁移记录由完整记录取代
+                conn.execute("DELETE FROM videos WHERE extractor = '' AND video_id = ?", (video_id,))
+            conn.execute('DELETE FROM claims WHERE extractor = ? AND video_id = ?',
+                         (extractor or '', video_id))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._remember([(extractor or '', video_id), (None, video_id)])
+
+    def mark_uploaded(self, video_dir: str, cos_prefix: str) -> int:
+        now = time.time()
+        cur = self._conn().execute(
+            'UPDATE videos SET cos_uploaded = 1, cos_prefix = ?, uploaded_at = ?, updated_at = ? '
+            'WHERE video_dir = ?',
+            (cos_prefix, now, now, video_dir)
+        )
+        return cur.rowcount
+
+    def claim(self, video_id: str, extractor: str, owner: str) -> bool:
+        extractor = extractor or ''
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            done = conn.execute(
+                "SELECT 1 FROM videos WHERE extractor IN (?, '') AND video_id = ? LIMIT 1",
+                (extractor, video_id)
+            ).fetchone()
+            claimed = False
+            if done is None:
+                cur = conn.execute("""
+                    INSERT INTO claims (extractor, video_id, owner, expires_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (extractor, video_id) DO UPDATE SET
+                        owner = excluded.owner, expires_at = excluded.expires_at
+                    WHERE claims.owner = excluded.owner OR claims.expires_at <= ?
+                """, (extractor, video_id, owner, now + DEDUP_CLAIM_TTL, now))
+                claimed = cur.rowcount == 1
+            conn.execute('COMMIT')
+            return claimed
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def release(self, video_id: str, extractor: str, owner: str):
+        self._conn().execute(
+            'DELETE FROM claims WHERE extractor = ? AND video_id = ? AND owner = ?',
+            (extractor or '', video_id, owner)
+        )
+
+    def get_sync_state(self, channel: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            'SELECT state FROM channel_sync WHERE channel = ?', (channel,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_sync_state(self, channel: str, state: Dict[str, Any]):
+        self._conn().execute(
+            'INSERT INTO channel_sync (channel, state, updated_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (channel) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at',
+            (channel, json.dumps(state, ensure_ascii=False), time.time())
+        )
+
+    def delete_sync_state(self, channel: str) -> bool:
+        cur = self._conn().execute('DELETE FROM channel_sync WHERE channel = ?', (channel,))
+        return cur.rowcount > 0
+
+
+class RedisRegistry(DownloadRegistry):
+    """Redis 登记（多台机器共享）"""
+
+    def __init__(self, directory: str, prefix: str = DEDUP_REDIS_PREFIX):
+        from cache import get_redis
+        self.directory = directory
+        self.prefix = prefix
+        self._redis = get_redis
+        self._import_legacy()
+
+    def _ids_key(self, extractor: str) -> str:
+        return f"{self.prefix}:ids:{extractor}"
+
+    def _record_key(self, extractor: str, video_id: str) -> str:
+        return f"{self.prefix}:video:{extractor}:{video_id}"
+
+    def _claim_key(self, extractor: str, video_id: str) -> str:
+        return f"{self.prefix}:claim:{extractor}:{video_id}"
+
+    def _latest_key(self) -> str:
+        # video_id -> 最近一次下载的提取器
+        return f"{self.prefix}:latest"
+
+    def _import_legacy(self):
+        """首次使用时导入本机下载目录中旧版快照 + 日志的 ID"""
+        legacy = [os.path.join(self.directory, f) for f in (SNAPSHOT_FILE, JOURNAL_FILE)]
+        if not any(os.path.exists(p) for p in legacy):
+            return
+        r = self._redis()
+        if not r.set(f"{self.prefix}:imported:{os.path.abspath(self.directory)}", 1, nx=True):
+            return
+        keys = sorted(JournalRegistry(self.directory).keys())
+        pipe = r.pipeline(transaction=False)
+        for i in range(0, len(keys), LOOKUP_CHUNK):
+            for extractor, video_id in keys[i:i + LOOKUP_CHUNK]:
+                pipe.sadd(self._ids_key(extractor), video_id)
+                pipe.hsetnx(self._latest_key(), video_id, extractor)
+            pipe.execute()
+        logger.info(f"已从旧版去重记录导入 {len(keys)} 个视频 ID")
+
+    def __contains__(self, video_id: str) -> bool:
+        return bool(self._redis().hexists(self._latest_key(), video_id))
+
+    def known(self, extractor: str, video_ids: Iterable[str]) -> Set[str]:
+        ids = list(dict.fromkeys(video_ids))
+        if not ids:
+            return set()
+        pipe = self._redis().pipeline(transaction=False)
+        pipe.smismember(self._ids_key(extractor or ''), ids)
+        pipe.smismember(self._ids_key(''), ids)
+        exact, legacy = pipe.execute()
+        return {v for v, a, b in zip(ids, exact, legacy) if a or b}
+
+    def get(self, video_id: str, extractor: Optional[str] = None) -> Optional[VideoRecord]:
+        r = self._redis()
+        if extractor is None:
+            extractor = r.hget(self._latest_key(), video_id)
+            if extractor is None:
+                return None
+        data = r.hgetall(self._record_key(extractor, video_id))
+        if not data:
+            # 旧版迁移的 ID 没有详细记录
+            if r.sismember(self._ids_key(''), video_id):
+                return VideoRecord(extractor='', video_id=video_id)
+            return None
+        return self._record(data)
+
+    def _records(self, keys: Iterable[str]) -> List[VideoRecord]:
+        pipe = self._redis().pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        return [self._record(data) for data in pipe.execute() if data]
+
+    def find_by_dir(self, video_dir: str) -> List[VideoRecord]:
+        return self._records(self._redis().smembers(f"{self.prefix}:dir:{video_dir}"))
+
+    def find_by_checksum(self, checksum: str) -> List[VideoRecord]:
+        # 重新下载后内容变化的记录仍留在旧摘要的集合里，按当前摘要过滤
+        records = self._records(self._redis().smembers(f"{self.prefix}:sha:{checksum}"))
+        return [r for r in records if r.checksum == checksum]
+
+    @staticmethod
+    def _record(data: Dict[str, str]) -> VideoRecord:
+        data['cos_uploaded'] = data.get('cos_uploaded') == '1'
+        for key in ('downloaded_at', 'uploaded_at'):
+            if data.get(key):
+                data[key] = datetime.fromtimestamp(float(data[key]))
+        return VideoRecord(**data)
+
+    def add(self, video_id: str, extractor: str = '', **fields):
+        filepath = fields.get('filepath')
+        if filepath and os.path.isfile(filepath):
+            fields.setdefault('file_size', os.path.getsize(filepath))
+        extractor = extractor or ''
+        record = {k: v for k, v in fields.items() if v is not None}
+        record.update(extractor=extractor, video_id=video_id, downloaded_at=time.time())
+
+        r = self._redis()
+        key = self._record_key(extractor, video_id)
+        old_checksum = r.hget(key, 'checksum')
+        pipe = r.pipeline()
+        if record.get('checksum') and old_checksum and old_checksum != record['checksum']:
+            # 内容变化，已上传到 COS 的是旧文件
+            pipe.hset(key, 'cos_uploaded', '0')
+        pipe.hset(key, mapping=record)
+        pipe.sadd(self._ids_key(extractor), video_id)
+        pipe.hset(self._latest_key(), video_id, extractor)
+        if record.get('video_dir'):
+            pipe.sadd(f"{self.prefix}:dir:{record['video_dir']}", key)
+        if record.get('checksum'):
+            pipe.sadd(f"{self.prefix}:sha:{record['checksum']}", key)
+        pipe.delete(self._claim_key(extractor, video_id))
+        pipe.execute()
+
+    def mark_uploaded(self, video_dir: str, cos_prefix: str) -> int:
+        r = self._redis()
+        keys = r.smembers(f"{self.prefix}:dir:{video_dir}")
+        if keys:
+            pipe = r.pipeline()
+            for key in keys:
+                pipe.hset(key, mapping={
+                    'cos_uploaded': '1', 'cos_prefix': cos_prefix, 'uploaded_at': time.time(),
+                })
+            pipe.execute()
+        return len(keys)
+
+    def claim(self, video_id: str, extractor: str, owner: str) -> bool:
+        import redis
+        extractor = extractor or ''
+        ids_key, legacy_key = self._ids_key(extractor), self._ids_key('')
+        claim_key = self._claim_key(extractor, video_id)
+        with self._redis().pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(ids_key, legacy_key, claim_key)
+                    if pipe.sismember(ids_key, video_id) or pipe.sismember(legacy_key, video_id):
+                        return False
+                    holder = pipe.get(claim_key)
+                    if holder is not None and holder != owner:
+                        return False
+                    pipe.multi()
+                    pipe.set(claim_key, owner, ex=DEDUP_CLAIM_TTL)
+                    pipe.execute()
+                    return True
+                except redis.WatchError:
+                    continue
+
+    def release(self, video_id: str, extractor: str, owner: str):
+        import redis
+        claim_key = self._claim_key(extractor or '', video_id)
+        with self._redis().pipeline() as pipe:
+            try:
+                pipe.watch(claim_key)
+                if pipe.get(claim_key) == owner:
+                    pipe.multi()
+                    pipe.delete(claim_key)
+                    pipe.execute()
+            except redis.WatchError:
+                pass   # 认领已被他人接管（租约过期）
+
+    def get_sync_state(self, channel: str) -> Optional[Dict[str, Any]]:
+        data = self._redis().hget(f"{self.prefix}:sync", channel)
+        return json.loads(data) if data else None
+
+    def set_sync_state(self, channel: str, state: Dict[str, Any]):
+        self._redis().hset(f"{self.prefix}:sync", channel, json.dumps(state, ensure_ascii=False))
+
+    def delete_sync_state(self, channel: str) -> bool:
+        return bool(self._redis().hdel(f"{self.prefix}:sync", channel))
+
+
+def create_registry(directory: str) -> DownloadRegistry:
+    """根据 DEDUP_BACKEND 创建去重记录"""
+    if DEDUP_BACKEND == 'journal':
+        logger.info("去重记录: 快照 + 追加日志")
+        return JournalRegistry(directory)
+    if DEDUP_BACKEND == 'redis':
+        logger.info("去重记录: Redis")
+        return RedisRegistry(directory)
+    logger.info(f"去重记录: SQLite ({os.path.join(directory, DB_FILE)})")
+    return SQLiteRegistry(directory)
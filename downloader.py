@@ -20,32 +20,61 @@ downloads/
 │   │   └── output/
 │   │       └── final.zh.mp4        # 最终母语视频 (后续处理)
 
-去重记录:
-downloads/
-├── .downloaded_videos.json     # 已下载视频 ID 记录
+去重记录（dedup.create_registry 按 DEDUP_BACKEND 选择，接口相同，详见 dedup.py）:
+- sqlite（默认）: downloads/.downloaded_videos.db，每个视频一行（目录、文件、大小、格式、
+  内容摘要、COS 状态），另有认领表与频道同步状态表
+- redis: 多台机器共享的集合 + 哈希记录（REDIS_HOST/REDIS_PORT）
+- journal: downloads/.downloaded_videos.json 快照 + .downloaded_videos.journal 追加日志，只记录 ID
 """
 import os
 import re
 import time
+import uuid
+import socket
+import threading
 import yt_dlp
-from typing import Optional, Dict, Any, Callable, List, Set
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Optional, Dict, Any, Callable, Iterator, List, Set, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
 import logging
 import json
 
+from rate_limiter import rate_limiter, connection_tuner, site_key, SITE_MIN_INTERVAL, DOWNLOAD_CONNECTIONS_MAX
+from dedup import DEDUP_CHECKSUM, DEDUP_HARDLINK, StreamHasher, combine_digests, create_registry
+from single_flight import extractor_id
+from ydl_pool import ydl_pool
+import parallel_http
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # 限流保护配置
 RATE_LIMIT_CONFIG = {
-    'download_delay': 3,          # 每次下载前等待秒数
+    'download_delay': SITE_MIN_INTERVAL,  # 同站点下载间隔（由 rate_limiter 按站点执行）
     'retry_delay': 30,            # 被限流后等待秒数
     'max_retries': 10,            # 最大重试次数（增加到10次）
     'fragment_retries': 10,       # 片段重试次数
     'rate_limit': 0,              # 不限速，让代理决定速度
 }
 
+# 频道/播放列表任务内同时下载的视频数（不超过站点当前允许的并发）
+CHANNEL_WORKERS = int(os.getenv('CHANNEL_WORKERS', '2'))
+# 频道增量同步：记录每个频道上次同步时列表最前面的视频，之后只检查比它新的部分
+CHANNEL_SYNC = os.getenv('CHANNEL_SYNC', 'true').lower() == 'true'
+CHANNEL_SYNC_HEAD = 20   # 记录列表头部多少个视频 ID（最新视频被删除/设为私享时仍能定位）
+LIST_MAX_REDIRECTS = 3   # 惰性取列表时最多跟随几次跳转（如频道主页 -> 视频标签页）
+
+# 获取视频信息（不下载）的 yt-dlp 配置
+INFO_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': 'in_playlist',
+    'ignoreerrors': True,
+}
+
 
 class DownloadStatus(str, Enum):
     PENDING = "pending"
@@ -67,6 +96,128 @@ class DownloadTask:
     metadata: Dict[str, Any] = field(default_factory=dict)
 
 
+class ErrorKind(str, Enum):
+    """下载失败类型（决定是否自动重试）"""
+    NETWORK = "network"            # 网络抖动/超时，可重试
+    THROTTLE = "throttle"          # 被限流，退避后重试
+    UNAVAILABLE = "unavailable"    # 地区限制/私有/已删除，不重试
+    PERMANENT = "permanent"        # 不支持的链接/格式，不重试
+    UNKNOWN = "unknown"            # 无法判断，有限次重试
+
+
+RETRYABLE_ERROR_KINDS = {ErrorKind.NETWORK, ErrorKind.THROTTLE, ErrorKind.UNKNOWN}
+
+_ERROR_PATTERNS = [
+    (ErrorKind.UNAVAILABLE, [
+        'not available in your country', 'geo restrict', 'geo-restrict', 'video unavailable',
+        'this video is unavailable', 'private video', 'has been removed', 'members-only',
+        'copyright', 'account associated with this video has been terminated', 'confirm your age',
+    ]),
+    (ErrorKind.THROTTLE, ['403', '429', 'rate limit', 'too many requests', 'not a bot']),
+    (ErrorKind.PERMANENT, [
+        'unsupported url', 'is not a valid url', 'no video formats found',
+        'requested format is not available', 'invalid url',
+    ]),
+    (ErrorKind.NETWORK, [
+        'timed out', 'timeout', 'connection', 'temporary failure', 'name resolution',
+        'unable to download webpage', 'http error 5', 'incompleteread', 'ssl', 'eof occurred',
+        'network is unreachable',
+    ]),
+]
+
+
+def classify_error(error_msg: str) -> ErrorKind:
+    """按错误信息判断失败类型"""
+    msg = (error_msg or '').lower()
+    for kind, patterns in _ERROR_PATTERNS:
+        if any(p in msg for p in patterns):
+            return kind
+    return ErrorKind.UNKNOWN
+
+
+def is_rate_limited_error(error_msg: str) -> bool:
+    """错误信息是否表示被限流（403/429）"""
+    return classify_error(error_msg) == ErrorKind.THROTTLE
+
+
+class TaskCancelled(yt_dlp.utils.DownloadCancelled):
+    """任务被取消/暂停（从 progress hook 或检查点抛出，yt-dlp 会中断下载并向上抛出）"""
+
+    def __init__(self, mode: str = 'cancel', partial_file: Optional[str] = None):
+        super().__init__(f"任务已{'暂停' if mode == 'pause' else '取消'}")
+        self.mode = mode                  # cancel / pause
+        self.partial_file = partial_file  # 未完成的 .part 文件
+
+
+def make_cancellable_hook(task_id: str,
+                          flags: Dict[str, str],
+                          progress_callback: Optional[Callable] = None) -> Callable:
+    """
+    包装 progress hook：flags[task_id] 被设置为 cancel/pause 时中断下载
+    取消是协作式的：只在传输进度回调和 hook.check_cancelled 检查点（频道条目之间、后处理开始前）生效，
+    元数据解析、yt-dlp 的请求间隔、ffmpeg 后处理进行中不会被打断
+    """
+    def check_cancelled(partial_file: Optional[str] = None):
+        mode = flags.get(task_id)
+        if mode:
+            raise TaskCancelled(mode, partial_file)
+
+    def hook(d):
+        check_cancelled(d.get('tmpfilename'))
+        if progress_callback:
+            progress_callback(d)
+    hook.check_cancelled = check_cancelled
+    return hook
+
+
+def _cancel_checkpoint(cancel_check: Optional[Callable]) -> Optional[Callable]:
+    """后处理开始前检查取消标记的 postprocessor hook"""
+    if cancel_check is None:
+        return None
+
+    def hook(d):
+        if d['status'] == 'started':
+            cancel_check()
+    return hook
+
+
+def remove_partial_files(partial_file: Optional[str]):
+    """删除未完成的下载文件（.part 及分片临时文件）"""
+    if not partial_file:
+        return
+    directory = os.path.dirname(partial_file) or '.'
+    prefix = os.path.basename(partial_file)
+    try:
+        for name in os.listdir(directory):
+            if name.startswith(prefix):
+                os.remove(os.path.join(directory, name))
+    except OSError as e:
+        logger.warning(f"清理未完成文件失败: {e}")
+
+
+class _YdlLogger:
+    """yt-dlp 日志转发到 logging，同时收集错误信息用于失败分类"""
+
+    def __init__(self, error_log: List[str]):
+        self.error_log = error_log
+
+    def debug(self, msg):
+        # 跳过调试信息和逐行刷新的下载进度
+        if msg.startswith('[debug] ') or (msg.startswith('[download]') and ' ETA ' in msg):
+            return
+        logger.info(msg)
+
+    def info(self, msg):
+        logger.info(msg)
+
+    def warning(self, msg):
+        logger.warning(msg)
+
+    def error(self, msg):
+        self.error_log.append(msg)
+        logger.error(msg)
+
+
 def sanitize_filename(name: str, max_length: int = 100) -> str:
     """清理文件名，移除非法字符"""
     if not name:
@@ -105,38 +256,220 @@ def detect_url_type(url: str) -> UrlType:
     return UrlType.VIDEO
 
 
+# 扁平列表中不是单个视频的条目类型
+_CONTAINER_ENTRY_TYPES = ('playlist', 'multi_video')
+# 返回类型标注为 any（会跟随跳转到单个视频），但出现在频道列表中时都是播放列表/频道页的提取器
+_CONTAINER_EXTRACTORS = {'YoutubeTab'}
+
+
+@lru_cache(maxsize=256)
+def _extractor_return_type(ie_key: str) -> str:
+    """提取器声明的返回类型：video / playlist / any"""
+    try:
+        return yt_dlp.extractor.get_info_extractor(ie_key)._RETURN_TYPE or 'any'
+    except Exception:
+        return 'any'
+
+
+def classify_entry(entry: Dict[str, Any]) -> Optional[Tuple[str, str, str]]:
+    """
+    扁平列表（extract_flat）条目是单个视频时返回 (提取器, 视频 ID, URL)，
+    播放列表/频道/合集等返回 None；按 _type 和 ie_key 判断，适用于所有站点
+    """
+    if entry.get('_type') in _CONTAINER_ENTRY_TYPES:
+        return None
+    url = entry.get('url') or entry.get('webpage_url')
+    if not url:
+        return None
+    ie_key, video_id = entry.get('ie_key'), entry.get('id')
+    if not ie_key or not video_id:
+        guessed_key, guessed_id = extractor_id(url)
+        ie_key, video_id = ie_key or guessed_key, video_id or guessed_id
+    if ie_key in _CONTAINER_EXTRACTORS or _extractor_return_type(ie_key) == 'playlist':
+        return None
+    return ie_key, video_id, url
+
+
+def iter_playlist_lazily(ydl, url: str) -> Tuple[Optional[Dict[str, Any]], Iterator[Dict[str, Any]]]:
+    """
+    取列表页信息，逐条惰性产出条目（分页列表按需请求下一页）
+    extract_info(process=False) 不经过 yt-dlp 的播放列表处理（处理时会先把所有条目都取一遍），
+    条目是提取器给出的原始 url 结果；跳转（url / url_transparent）最多跟随几次
+    """
+    info = ydl.extract_info(url, download=False, process=False)
+    for _ in range(LIST_MAX_REDIRECTS):
+        if not info or info.get('_type') not in ('url', 'url_transparent'):
+            break
+        info = ydl.extract_info(info['url'], download=False, process=False, ie_key=info.get('ie_key'))
+    if not info or info.get('entries') is None:
+        return None, iter(())
+    entries = yt_dlp.utils.PlaylistEntries(ydl, info)
+    return info, (entry for _, entry in entries.get_requested_items())
+
+
+class PhaseTimer:
+    """
+    统计一次下载的阶段耗时：
+    - transfer: 媒体传输（progress hook 的 finished 事件自带 elapsed）
+    - postprocess: 后处理（postprocessor hook 的 started/finished，如合并、缩略图转换）
+    - extract: 其余时间（元数据解析、站点间隔等待）
+    频道并行下载时 transfer/postprocess 为各线程累加值
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._pp_started: Dict[tuple, float] = {}
+        self.transfer = 0.0
+        self.postprocess = 0.0
+        self.bytes = 0
+        self.files: List[tuple] = []   # (字节数, 传输秒数)
+
+    def wrap(self, progress_callback: Optional[Callable]) -> Callable:
+        def hook(d):
+            if d['status'] == 'finished' and d.get('elapsed') is not None:
+                # 已存在的文件也会触发 finished，但没有 elapsed，不计入传输
+                size = d.get('total_bytes') or d.get('downloaded_bytes') or 0
+                with self._lock:
+                    self.transfer += d['elapsed']
+                    self.bytes += size
+                    self.files.append((size, d['elapsed']))
+            if progress_callback:
+                progress_callback(d)
+        return hook
+
+    def postprocessor_hook(self, d):
+        key = (d.get('postprocessor'), (d.get('info_dict') or {}).get('id'), threading.get_ident())
+        now = time.monotonic()
+        with self._lock:
+            if d['status'] == 'started':
+                self._pp_started[key] = now
+            elif d['status'] == 'finished' and key in self._pp_started:
+                self.postprocess += now - self._pp_started.pop(key)
+
+    def result(self) -> Dict[str, Any]:
+        total = time.monotonic() - self._started
+        with self._lock:
+            return {
+                'total': round(total, 3),
+                'extract': round(max(0.0, total - self.transfer - self.postprocess), 3),
+                'transfer': round(self.transfer, 3),
+                'postprocess': round(self.postprocess, 3),
+                'bytes': self.bytes,
+                'files': list(self.files),
+            }
+
+
+class _ChannelProgress:
+    """
+    合并频道内并行下载的进度：已完成文件的字节数累加，加上正在下载的文件，
+    整个任务表现为一个持续增长的下载量，速度/ETA 不会因切换文件而重置
+    """
+
+    def __init__(self, progress_callback: Optional[Callable]):
+        self._callback = progress_callback
+        self._lock = threading.Lock()
+        self._active: Dict[str, tuple] = {}   # 文件名 -> (已下载, 总大小)
+        self._finished_bytes = 0
+
+    def hook(self, d: Dict[str, Any]):
+        if not self._callback:
+            return
+        filename = d.get('filename')
+        if d['status'] == 'downloading':
+            with self._lock:
+                self._active[filename] = (
+                    d.get('downloaded_bytes') or 0,
+                    d.get('total_bytes') or d.get('total_bytes_estimate') or 0,
+                )
+                downloaded = self._finished_bytes + sum(a for a, _ in self._active.values())
+                total = self._finished_bytes + sum(max(a, t) for a, t in self._active.values())
+            # tmpfilename 保留原值（取消时清理未完成文件）
+            d = {**d, 'downloaded_bytes': downloaded, 'total_bytes': total,
+                 'total_bytes_estimate': None, 'filename': None}
+        elif d['status'] == 'finished':
+            with self._lock:
+                done, size = self._active.pop(filename, (0, 0))
+                self._finished_bytes += max(done, size, d.get('total_bytes') or 0)
+        self._callback(d)
+
+
 class VideoDownloader:
     """视频下载器 - 基于 yt-dlp"""
 
     def __init__(self, download_dir: str = "./downloads"):
         self.download_dir = download_dir
         os.makedirs(download_dir, exist_ok=True)
-        self.downloaded_record_file = os.path.join(download_dir, '.downloaded_videos.json')
+        self.registry = create_registry(download_dir)
+        self.hasher = StreamHasher()
+        # 直链文件按 Range 分段并行下载（range_connections > 1 时）
+        parallel_http.install()
 
-    def _load_downloaded_ids(self) -> Set[str]:
-        """加载已下载的视频 ID 列表"""
-        if os.path.exists(self.downloaded_record_file):
+    def _content_checksum(self, info: Dict[str, Any], filepath: Optional[str]) -> Optional[str]:
+        """
+        下载内容的摘要：下载过程中算好的各媒体流 sha256 合并而成（combine_digests），不重新读取文件
+        有流没有算出摘要（文件已存在跳过下载等）时返回 None
+        """
+        formats = info.get('requested_formats')
+        paths = [f.get('filepath') for f in formats] if formats else [filepath]
+        # 取走全部流的摘要（合并后的各流文件已删除，摘要不再有用）
+        digests = [self.hasher.pop(p) if p else None for p in paths]
+        if not digests or None in digests:
+            return None
+        return combine_digests(digests)
+
+    def _link_duplicate(self, filepath: str, checksum: str):
+        """已有相同内容的文件时，用硬链接替换刚下载的副本"""
+        for record in self.registry.find_by_checksum(checksum):
+            source = record.filepath
+            if not source or source == filepath or not os.path.isfile(source):
+                continue
+            tmp = f"{filepath}.dedup"
             try:
-                with open(self.downloaded_record_file, 'r') as f:
-                    data = json.load(f)
-                    return set(data.get('video_ids', []))
-            except Exception as e:
-                logger.warning(f"加载已下载记录失败: {e}")
-        return set()
-
-    def _save_downloaded_id(self, video_id: str):
-        """保存已下载的视频 ID"""
-        ids = self._load_downloaded_ids()
-        ids.add(video_id)
+                if os.path.samefile(source, filepath):
+                    return
+                if os.path.getsize(source) != os.path.getsize(filepath):
+                    continue
+                os.link(source, tmp)
+                os.replace(tmp, filepath)
+                logger.info(f"内容与 {source} 相同，已替换为硬链接: {filepath}")
+                return
+            except OSError as e:
+                # 跨文件系统等情况无法硬链接，保留副本
+                logger.debug(f"硬链接失败 {source} -> {filepath}: {e}")
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    def _save_downloaded_id(self, info: Dict[str, Any], video_dir: str):
+        """登记已下载的视频（目录、文件、格式、内容摘要等）"""
+        video_id = info.get('id')
+        if not video_id:
+            return
+        downloads = info.get('requested_downloads') or []
+        filepath = downloads[0].get('filepath') if downloads else info.get('filepath')
         try:
-            with open(self.downloaded_record_file, 'w') as f:
-                json.dump({'video_ids': list(ids)}, f, indent=2)
+            checksum = self._content_checksum(info, filepath)
+            if checksum and filepath and DEDUP_HARDLINK and os.path.isfile(filepath):
+                self._link_duplicate(filepath, checksum)
+            self.registry.add(
+                video_id,
+                extractor=info.get('extractor_key') or info.get('ie_key') or '',
+                title=info.get('title'),
+                uploader=info.get('uploader') or info.get('channel'),
+                video_dir=video_dir,
+                filepath=filepath,
+                format=info.get('format_id'),
+                checksum=checksum,
+            )
         except Exception as e:
-            logger.warning(f"保存已下载记录失败: {e}")
+            # 登记失败不影响下载结果，最多下次重复下载
+            logger.warning(f"记录已下载视频失败 {video_id}: {e}")
 
-    def _is_video_downloaded(self, video_id: str) -> bool:
+    def _is_video_downloaded(self, video_id: str, extractor: Optional[str] = None) -> bool:
         """检查视频是否已下载"""
-        return video_id in self._load_downloaded_ids()
+        if extractor is None:
+            return video_id in self.registry
+        return bool(self.registry.known(extractor, [video_id]))
 
     def _get_output_template(self) -> str:
         """
@@ -169,7 +502,12 @@ class VideoDownloader:
                       progress_callback: Optional[Callable] = None,
                       format_preference: str = "best",
                       download_playlist: bool = False,
-                      sort_order: str = "newest") -> Dict[str, Any]:
+                      sort_order: str = "newest",
+                      site: Optional[str] = None,
+                      error_log: Optional[List[str]] = None,
+                      timer: Optional[PhaseTimer] = None,
+                      connections: int = 1,
+                      cancel_check: Optional[Callable] = None) -> Dict[str, Any]:
         """获取 yt-dlp 配置"""
 
         # 使用 yt-dlp 支持的模板语法
@@ -206,7 +544,6 @@ class VideoDownloader:
             'retries': RATE_LIMIT_CONFIG['max_retries'],
             'fragment_retries': RATE_LIMIT_CONFIG['max_retries'],
             'skip_unavailable_fragments': True,
-            'ratelimit': RATE_LIMIT_CONFIG['rate_limit'],  # 限速 5MB/s
             'sleep_interval': 2,                            # 片段间隔 2 秒
             'max_sleep_interval': 5,                        # 最大间隔 5 秒
             # 后处理 - 转换缩略图为 jpg
@@ -218,8 +555,31 @@ class VideoDownloader:
             'continuedl': True,
         }
 
+        # 限速（0 表示不限速；yt-dlp 的 ratelimit=0 会导致除零错误，不能直接传入）
+        if RATE_LIMIT_CONFIG['rate_limit']:
+            opts['ratelimit'] = RATE_LIMIT_CONFIG['rate_limit']
+
+        # 边下载边计算内容摘要，之后用于跨 URL 的内容去重
+        opts['progress_hooks'] = [self.hasher.hook] if DEDUP_CHECKSUM else []
         if progress_callback:
-            opts['progress_hooks'] = [progress_callback]
+            opts['progress_hooks'].append(progress_callback)
+
+        # 单个视频的并发连接数：DASH/HLS 分片并发下载，直链按 Range 分段并行（parallel_http）
+        if connections > 1:
+            opts['concurrent_fragment_downloads'] = connections
+            opts['range_connections'] = connections
+
+        # 按站点当前限流状态放大请求间隔
+        if site:
+            opts.update(rate_limiter.ydl_sleep_options(site))
+
+        # 收集 yt-dlp 错误信息（ignoreerrors 模式下异常不会抛出）
+        if error_log is not None:
+            opts['logger'] = _YdlLogger(error_log)
+
+        # 后处理（合并、转换）开始前检查取消标记，已取消的任务不再启动 ffmpeg
+        opts['postprocessor_hooks'] = [h for h in (_cancel_checkpoint(cancel_check),
+                                                   timer.postprocessor_hook if timer else None) if h]
 
         # 播放列表排序配置
         # YouTube 频道 /videos 页面默认按最新排序
@@ -234,15 +594,8 @@ class VideoDownloader:
 
     def get_video_info(self, url: str) -> Dict[str, Any]:
         """获取视频信息（不下载）"""
-        opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': 'in_playlist',
-            'ignoreerrors': True,
-        }
-
         try:
-            with yt_dlp.YoutubeDL(opts) as ydl:
+            with ydl_pool.acquire('info', INFO_OPTS) as ydl:
                 info = ydl.extract_info(url, download=False)
 
                 is_playlist = info.get('_type') == 'playlist' or 'entries' in info
@@ -283,14 +636,72 @@ class VideoDownloader:
             logger.error(f"获取视频信息失败: {e}")
             raise
 
+    def prewarm(self) -> Dict[str, float]:
+        """预热：加载提取器 URL 规则，创建信息查询用的 YoutubeDL 实例放入实例池，返回各步耗时"""
+        timings = {}
+        start = time.monotonic()
+        extractor_id('https://www.youtube.com/watch?v=jNQXAC9IVRw')
+        timings['extractors'] = time.monotonic() - start
+        start = time.monotonic()
+        with ydl_pool.acquire('info', INFO_OPTS):
+            pass
+        timings['ydl'] = time.monotonic() - start
+        return timings
+
     def download(self,
                  url: str,
                  progress_callback: Optional[Callable] = None,
                  format_preference: str = "best",
                  download_playlist: bool = False,
                  max_videos: Optional[int] = None,
-                 sort_order: str = "newest") -> Dict[str, Any]:
-        """下载视频或频道视频（支持去重）"""
+                 sort_order: str = "newest",
+                 connections: Optional[int] = None) -> Dict[str, Any]:
+        """
+        下载视频或频道视频（支持去重），失败时附带 error_kind
+        progress hook 抛出 TaskCancelled 时返回 cancelled=True；暂停会保留 .part 文件用于续传
+        progress_callback 带 check_cancelled 时（make_cancellable_hook），开始前、频道条目之间、
+        后处理开始前也会检查取消标记
+        connections 为单个视频的并发连接数，默认按站点自动调整（结果中带回实际使用的值）
+        """
+        error_log: List[str] = []
+        timer = PhaseTimer()
+        connections = max(1, min(connections or connection_tuner.pick(site_key(url)), DOWNLOAD_CONNECTIONS_MAX))
+        cancel_check = getattr(progress_callback, 'check_cancelled', None)
+        try:
+            if cancel_check:
+                cancel_check()
+            result = self._download(url, timer.wrap(progress_callback), format_preference,
+                                    download_playlist, max_videos, sort_order, error_log, timer,
+                                    connections, cancel_check)
+        except TaskCancelled as e:
+            logger.info(f"{e}: {url}")
+            if e.mode != 'pause':
+                remove_partial_files(e.partial_file)
+            return {'success': False, 'cancelled': True, 'mode': e.mode, 'error': str(e), 'url': url,
+                    'timings': timer.result()}
+
+        result['timings'] = timer.result()
+        result['connections'] = connections
+        if not result.get('success'):
+            kind = classify_error(' '.join([result.get('error') or ''] + error_log))
+            result['error_kind'] = kind.value
+            if kind == ErrorKind.THROTTLE and not result.get('rate_limited'):
+                result['rate_limited'] = True
+                result['retry_after'] = RATE_LIMIT_CONFIG['retry_delay']
+        return result
+
+    def _download(self,
+                  url: str,
+                  progress_callback: Optional[Callable],
+                  format_preference: str,
+                  download_playlist: bool,
+                  max_videos: Optional[int],
+                  sort_order: str,
+                  error_log: List[str],
+                  timer: Optional[PhaseTimer] = None,
+                  connections: int = 1,
+                  cancel_check: Optional[Callable] = None) -> Dict[str, Any]:
+        """下载实现"""
 
         # 检测 URL 类型
         url_type = detect_url_type(url)
@@ -308,20 +719,19 @@ class VideoDownloader:
                 url = url + '&view=0&sort=p'
             logger.info(f"热门排序，URL 已修改为: {url}")
 
-        # 下载前延迟，防止请求过快
-        delay = RATE_LIMIT_CONFIG['download_delay']
-        logger.info(f"等待 {delay} 秒后开始下载...")
-        time.sleep(delay)
+        # 下载前的站点间隔由调度器在队列中异步执行（rate_limiter），不再占用下载线程
 
         # 频道/播放列表模式：先获取列表，去重后逐个下载
         if url_type in (UrlType.CHANNEL, UrlType.PLAYLIST) and max_videos:
             return self._download_channel_with_dedup(
                 url, url_type, max_videos, sort_order,
-                progress_callback, format_preference
+                progress_callback, format_preference, error_log, timer, connections, cancel_check
             )
 
         # 单个视频或不限数量的下载
-        opts = self._get_ydl_opts(progress_callback, format_preference, download_playlist, sort_order)
+        opts = self._get_ydl_opts(progress_callback, format_preference, download_playlist, sort_order,
+                                  site=site_key(url), error_log=error_log, timer=timer,
+                                  connections=connections, cancel_check=cancel_check)
 
         # 限制下载数量（不再要求必须勾选播放列表模式）
         if max_videos:
@@ -343,17 +753,17 @@ class VideoDownloader:
                     if video_dir not in downloaded_dirs:
                         downloaded_dirs.append(video_dir)
 
-        opts['progress_hooks'] = [custom_hook]
+        opts['progress_hooks'] = [self.hasher.hook, custom_hook] if DEDUP_CHECKSUM else [custom_hook]
 
         try:
-            with yt_dlp.YoutubeDL(opts) as ydl:
+            with ydl_pool.acquire('download', opts) as ydl:
                 logger.info(f"开始下载: {url}")
                 info = ydl.extract_info(url, download=True)
 
                 if info is None:
                     return {
                         'success': False,
-                        'error': '无法获取视频信息',
+                        'error': error_log[-1] if error_log else '无法获取视频信息',
                         'url': url,
                     }
 
@@ -363,15 +773,12 @@ class VideoDownloader:
                     for entry in info['entries']:
                         if entry:
                             video_id = entry.get('id')
-                            # 记录已下载的视频 ID
-                            if video_id:
-                                self._save_downloaded_id(video_id)
-
                             uploader = sanitize_filename(
                                 entry.get('uploader') or entry.get('channel') or 'Unknown'
                             )
                             title = sanitize_filename(entry.get('title') or 'unknown')
                             video_dir = os.path.join(self.download_dir, uploader, title)
+                            self._save_downloaded_id(entry, video_dir)
 
                             results.append({
                                 'id': video_id,
@@ -391,16 +798,12 @@ class VideoDownloader:
                     }
                 else:
                     # 单个视频
-                    video_id = info.get('id')
-                    # 记录已下载的视频 ID
-                    if video_id:
-                        self._save_downloaded_id(video_id)
-
                     uploader = sanitize_filename(
                         info.get('uploader') or info.get('channel') or 'Unknown'
                     )
                     title = sanitize_filename(info.get('title') or 'unknown')
                     video_dir = os.path.join(self.download_dir, uploader, title)
+                    self._save_downloaded_id(info, video_dir)
 
                     # 创建处理目录结构
                     self._ensure_processing_dirs(video_dir)
@@ -419,13 +822,13 @@ class VideoDownloader:
                         'filesize': info.get('filesize') or info.get('filesize_approx'),
                     }
 
+        except TaskCancelled:
+            raise
         except yt_dlp.utils.DownloadError as e:
             error_msg = str(e)
 
             # 检测限流错误
-            is_rate_limited = any(code in error_msg for code in ['403', '429', 'rate limit', 'too many requests'])
-
-            if is_rate_limited:
+            if is_rate_limited_error(error_msg):
                 logger.warning(f"检测到限流，建议等待 {RATE_LIMIT_CONFIG['retry_delay']} 秒后重试")
                 return {
                     'success': False,
@@ -520,138 +923,293 @@ class VideoDownloader:
         max_videos: int,
         sort_order: str,
         progress_callback: Optional[Callable],
-        format_preference: str
+        format_preference: str,
+        error_log: Optional[List[str]] = None,
+        timer: Optional[PhaseTimer] = None,
+        connections: int = 1,
+        cancel_check: Optional[Callable] = None
     ) -> Dict[str, Any]:
         """频道/播放列表去重下载"""
         logger.info(f"开始去重下载，目标数量: {max_videos}")
 
-        # 第一步：获取视频列表（不下载）
+        # 第一步：逐页获取视频列表（不下载），边取边过滤
+        # 按顺序列出时惰性翻页（iter_playlist_lazily）：凑够 max_videos 个新视频或遇到上次同步时的
+        # 列表头部即停止，之后的页不再请求，不再为找几个新视频把整个频道列表取一遍
+        # 高水位只对按最新排序的频道列表有意义（播放列表顺序由作者决定，热门排序随时变化）
+        incremental = CHANNEL_SYNC and url_type == UrlType.CHANNEL and sort_order == 'newest'
+        sync_key = url.strip().rstrip('/')
+        sync_state = self.registry.get_sync_state(sync_key) if incremental else None
+        marks = set(sync_state.get('head', [])) if sync_state else set()
+
         list_opts = {
             'quiet': True,
             'no_warnings': True,
             'extract_flat': True,  # 只获取列表，不解析每个视频
             'ignoreerrors': True,
         }
-
-        # 处理排序
-        if sort_order == 'oldest':
+        if error_log is not None:
+            list_opts['logger'] = _YdlLogger(error_log)
+
+        # 处理排序（倒序需要完整列表，不能惰性翻页）
+        lazy = sort_order != 'oldest'
+        if lazy:
+            list_opts['lazy_playlist'] = True
+        else:
             list_opts['playlistreverse'] = True
 
+        # 第二步：过滤已下载的视频（登记表按 (提取器, 视频 ID) 查询），
+        # 认领要下载的视频：多个进程/容器同时检查同一频道时，每个视频只有一个 worker 下载
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        videos_to_download: List[Tuple[Dict[str, Any], str, str, str]] = []
+        head: List[str] = []          # 本次列表最前面的视频 ID（新的高水位）
+        scanned = 0
+        skipped_downloaded = 0
+        skipped_non_video = 0
+        skipped_claimed = 0
+        reached_mark = False
+        exhausted = True
+
         try:
-            with yt_dlp.YoutubeDL(list_opts) as ydl:
+            with ydl_pool.acquire('list', list_opts) as ydl:
                 logger.info("获取频道视频列表...")
-                info = ydl.extract_info(url, download=False)
+                if lazy:
+                    info, entries = iter_playlist_lazily(ydl, url)
+                else:
+                    info = ydl.extract_info(url, download=False)
+                    entries = info.get('entries') if info else None
 
-                if not info or 'entries' not in info:
+                if not info or entries is None:
                     return {
                         'success': False,
-                        'error': '无法获取视频列表',
+                        'error': error_log[-1] if error_log else '无法获取视频列表',
                         'url': url,
                     }
 
-                entries = list(info.get('entries', []))
-                logger.info(f"频道共有 {len(entries)} 个视频")
+                for entry in entries:
+                    if not entry:
+                        continue
+                    scanned += 1
+                    key = classify_entry(entry)
+                    if key is None:
+                        skipped_non_video += 1
+                        continue
+                    extractor, video_id, _ = key
+                    if len(head) < CHANNEL_SYNC_HEAD:
+                        head.append(video_id)
+                    if video_id in marks:
+                        # 之后的都是上次同步时已经处理过的视频
+                        reached_mark = True
+                        exhausted = False
+                        break
+                    if self.registry.known(extractor, [video_id]):
+                        skipped_downloaded += 1
+                        continue
+                    if not self.registry.claim(video_id, extractor, owner):
+                        skipped_claimed += 1
+                        continue
+                    videos_to_download.append((entry, *key))
+                    if len(videos_to_download) >= max_videos:
+                        exhausted = False
+                        break
+
+                logger.info(f"检查了 {scanned} 个列表条目"
+                            + ("（到达上次同步位置）" if reached_mark else ""))
 
         except Exception as e:
             logger.error(f"获取视频列表失败: {e}")
+            for _, extractor, video_id, _ in videos_to_download:
+                self.registry.release(video_id, extractor, owner)
             return {'success': False, 'error': str(e), 'url': url}
 
-        # 第二步：过滤已下载的视频
-        downloaded_ids = self._load_downloaded_ids()
-        videos_to_download = []
-        skipped_downloaded = 0
-        skipped_non_video = 0
-
-        for entry in entries:
-            if not entry:
-                continue
-
-            video_id = entry.get('id') or ''
-            url = entry.get('url') or ''
-
-            # 仅保留 YouTube 视频条目，过滤掉频道/播放列表条目
-            if len(video_id) != 11 or 'playlist?' in url:
-                skipped_non_video += 1
-                continue
-
-            if video_id in downloaded_ids:
-                skipped_downloaded += 1
-                continue
-
-            videos_to_download.append(entry)
-            if len(videos_to_download) >= max_videos:
-                break
-
         if skipped_non_video:
             logger.info(f"过滤掉 {skipped_non_video} 个非视频条目（频道/播放列表等）")
         if skipped_downloaded:
             logger.info(f"跳过 {skipped_downloaded} 个已下载的视频")
+        if skipped_claimed:
+            logger.info(f"跳过 {skipped_claimed} 个其他 worker 正在下载的视频")
 
         if not videos_to_download:
+            if incremental and not skipped_claimed:
+                self._update_sync_state(sync_key, sync_state, head, reached_mark or exhausted)
             return {
                 'success': True,
                 'type': url_type.value,
                 'title': info.get('title'),
                 'uploader': info.get('uploader') or info.get('channel'),
                 'total': 0,
-                'skipped': skipped,
-                'message': '所有视频都已下载过',
+                'skipped': skipped_downloaded,
+                'claimed_elsewhere': skipped_claimed,
+                'message': '所有视频都已下载过或正在由其他 worker 下载',
                 'videos': [],
             }
 
         logger.info(f"将下载 {len(videos_to_download)} 个新视频")
 
-        # 第三步：逐个下载
-        results = []
-        for i, entry in enumerate(videos_to_download):
-            video_id = entry.get('id')
-            video_url = entry.get('url') or f"https://www.youtube.com/watch?v={video_id}"
-            logger.info(f"下载 [{i+1}/{len(videos_to_download)}]: {entry.get('title', video_id)}")
+        # 第三步：并行下载（结果按原顺序返回）
+        site = site_key(url)
+        workers = max(1, min(CHANNEL_WORKERS, rate_limiter.current_concurrency(site),
+                             len(videos_to_download)))
+        logger.info(f"频道并行下载: {workers} 个线程")
 
-            # 下载单个视频
-            result = self._download_single_video(
-                video_url, progress_callback, format_preference
-            )
+        slots: List[Optional[Dict[str, Any]]] = [None] * len(videos_to_download)
+        channel_progress = _ChannelProgress(progress_callback)
+        stop = threading.Event()
+        rate_limited = False
 
-            if result.get('success'):
-                self._save_downloaded_id(video_id)
-                results.append({
-                    'id': video_id,
-                    'title': result.get('title'),
-                    'uploader': result.get('uploader'),
-                    'video_dir': result.get('video_dir'),
-                })
-
-            # 下载间隔
-            if i < len(videos_to_download) - 1:
-                time.sleep(RATE_LIMIT_CONFIG['download_delay'])
+        def download_entry(i: int, candidate: Tuple[Dict[str, Any], str, str, str], own_slot: bool):
+            nonlocal rate_limited
+            try:
+                if stop.is_set():
+                    return
+                entry, _, video_id, video_url = candidate
+                if cancel_check:
+                    cancel_check()
+                logger.info(f"下载 [{i+1}/{len(videos_to_download)}]: {entry.get('title', video_id)}")
+
+                result = self._download_single_video(
+                    video_url, channel_progress.hook, format_preference, error_log, timer,
+                    ie_key=entry.get('ie_key'), connections=connections, cancel_check=cancel_check
+                )
 
-        return {
+                if result.get('success'):
+                    slots[i] = {
+                        'id': video_id,
+                        'title': result.get('title'),
+                        'uploader': result.get('uploader'),
+                        'video_dir': result.get('video_dir'),
+                    }
+                elif result.get('rate_limited'):
+                    # 被限流后继续请求只会延长封禁，剩余视频留给下次
+                    rate_limited = True
+                    stop.set()
+            finally:
+                if own_slot:
+                    rate_limiter.release(site)
+
+        cancelled: Optional[TaskCancelled] = None
+        partial_files = []
+        pending = deque(enumerate(videos_to_download))
+        running = set()
+        first = True
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='channel') as pool:
+                while pending or running:
+                    # 启动视频：第一个用调度器为本任务占用的站点名额，其余每个视频按调度器的方式
+                    # 占用一个站点名额（try_acquire，结束时 release），占不到说明站点冷却中或并发已满
+                    while pending and len(running) < workers and not stop.is_set():
+                        if not first and not rate_limiter.try_acquire(site):
+                            break
+                        i, candidate = pending.popleft()
+                        running.add(pool.submit(download_entry, i, candidate, not first))
+                        first = False
+                    if stop.is_set():
+                        pending.clear()
+                    if not running and not pending:
+                        break
+
+                    # 冷却中的视频留在队列里，等有视频下载完成或到下一个令牌时再试，不占用下载线程
+                    timeout = None
+                    if pending and len(running) < workers:
+                        delay = rate_limiter.wait_time(site)
+                        if rate_limiter.is_saturated(site):
+                            delay = max(delay, 1.0)
+                        timeout = max(delay, 0.05)
+                    done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            future.result()
+                        except TaskCancelled as e:
+                            # 取消标记对所有线程生效，等其余线程中断后统一处理
+                            stop.set()
+                            cancelled = cancelled or e
+                            partial_files.append(e.partial_file)
+                    if cancel_check and pending and not stop.is_set():
+                        try:
+                            cancel_check()
+                        except TaskCancelled as e:
+                            stop.set()
+                            cancelled = cancelled or e
+        finally:
+            # 完成的视频写入记录时已清除认领，其余（失败/中断/未开始）释放给其他 worker
+            for _, extractor, video_id, _ in videos_to_download:
+                try:
+                    self.registry.release(video_id, extractor, owner)
+                except Exception as e:
+                    logger.warning(f"释放认领失败 {video_id}: {e}")
+
+        if cancelled is not None:
+            if cancelled.mode != 'pause':
+                for partial_file in partial_files:
+                    remove_partial_files(partial_file)
+            raise cancelled
+
+        results = [r for r in slots if r is not None]
+        if rate_limited:
+            logger.warning(f"频道下载被限流，已完成 {len(results)} 个，停止本轮下载")
+
+        # 本轮新视频全部处理完、且检查到了上次位置（或列表末尾）才推进高水位；
+        # 因 max_videos 提前停止时保持原位置（首次同步则不设位置），下次从列表头部重新检查，
+        # 已下载的被跳过，继续补下更早的视频，直到检查到原位置或列表末尾
+        if incremental and len(results) == len(videos_to_download) and not skipped_claimed:
+            self._update_sync_state(sync_key, sync_state, head, reached_mark or exhausted)
+
+        response = {
             'success': True,
             'type': url_type.value,
             'title': info.get('title'),
             'uploader': info.get('uploader') or info.get('channel'),
             'total': len(results),
             'skipped': skipped_downloaded,
+            'claimed_elsewhere': skipped_claimed,
             'videos': results,
             'download_dir': self.download_dir,
         }
+        if rate_limited:
+            response['rate_limited'] = True
+            response['warning'] = f"被限流，仅完成 {len(results)}/{len(videos_to_download)} 个视频"
+        return response
+
+    def _update_sync_state(self, sync_key: str, state: Optional[Dict[str, Any]],
+                           head: List[str], complete: bool):
+        """
+        记录频道同步位置
+        complete: 本轮检查到了上次的位置（或列表末尾），高水位可以前移到当前列表头部；
+        否则（包括首次同步只下载了 max_videos 个）不动，更早的视频还没有检查完
+        """
+        if not head or not complete:
+            return
+        # 新视频不多时补上旧的头部，保持 CHANNEL_SYNC_HEAD 个定位点
+        old_head = state.get('head', []) if state else []
+        head = (head + [v for v in old_head if v not in head])[:CHANNEL_SYNC_HEAD]
+        try:
+            self.registry.set_sync_state(sync_key, {'head': head, 'synced_at': time.time()})
+        except Exception as e:
+            logger.warning(f"保存频道同步状态失败: {e}")
 
     def _download_single_video(
         self,
         url: str,
         progress_callback: Optional[Callable],
-        format_preference: str
+        format_preference: str,
+        error_log: Optional[List[str]] = None,
+        timer: Optional[PhaseTimer] = None,
+        ie_key: Optional[str] = None,
+        connections: int = 1,
+        cancel_check: Optional[Callable] = None
     ) -> Dict[str, Any]:
-        """下载单个视频"""
-        opts = self._get_ydl_opts(progress_callback, format_preference, False, "newest")
+        """下载单个视频（ie_key 为列表条目给出的提取器，条目 URL 可能只是 ID）"""
+        errors: List[str] = []
+        opts = self._get_ydl_opts(progress_callback, format_preference, False, "newest",
+                                  site=site_key(url), error_log=errors, timer=timer,
+                                  connections=connections, cancel_check=cancel_check)
 
         try:
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+            with ydl_pool.acquire('download', opts) as ydl:
+                info = ydl.extract_info(url, download=True, ie_key=ie_key)
 
                 if not info:
-                    return {'success': False, 'error': '下载失败'}
+                    error = errors[-1] if errors else '下载失败'
+                    return {'success': False, 'error': error, 'rate_limited': is_rate_limited_error(error)}
 
                 uploader = sanitize_filename(
                     info.get('uploader') or info.get('channel') or 'Unknown'
@@ -661,6 +1219,8 @@ class VideoDownloader:
 
                 self._ensure_processing_dirs(video_dir)
                 self._write_status_file(video_dir, info)
+                # 每完成一个立即记录，任务中断也不会重复下载
+                self._save_downloaded_id(info, video_dir)
 
                 return {
                     'success': True,
@@ -669,9 +1229,14 @@ class VideoDownloader:
                     'uploader': uploader,
                     'video_dir': video_dir,
                 }
+        except TaskCancelled:
+            raise
         except Exception as e:
             logger.error(f"下载单个视频失败: {e}")
-            return {'success': False, 'error': str(e)}
+            return {'success': False, 'error': str(e), 'rate_limited': is_rate_limited_error(str(e))}
+        finally:
+            if error_log is not None:
+                error_log.extend(errors)
 
     def download_channel(self,
                          url: str,
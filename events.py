@@ -0,0 +1,109 @@
+"""
+任务事件推送 - Server-Sent Events
+
+- 下载线程/协程通过 publish() 提交任务字段变更（线程安全）
+- 同一任务在一个推送周期内的多次变更合并为一条增量
+- 每 EVENT_FLUSH_INTERVAL 秒批量推送给所有订阅者；无订阅者时直接丢弃
+"""
+import os
+import json
+import asyncio
+import threading
+import logging
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from fastapi.encoders import jsonable_encoder
+
+logger = logging.getLogger(__name__)
+
+EVENT_FLUSH_INTERVAL = float(os.getenv('EVENT_FLUSH_INTERVAL', '0.5'))  # 推送合并周期（秒）
+EVENT_KEEPALIVE = 15          # SSE 心跳间隔（秒）
+SUBSCRIBER_QUEUE_SIZE = 100   # 单个订阅者积压上限，超出后要求客户端全量刷新
+
+
+class TaskEventBroker:
+    """任务变更广播"""
+
+    def __init__(self, flush_interval: float = EVENT_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._resync = False
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+
+    def publish(self, task_id: str, **fields):
+        """提交任务变更（可在任意线程调用）"""
+        if not self._subscribers:
+            return
+        with self._lock:
+            self._pending.setdefault(task_id, {}).update(fields)
+
+    def publish_deleted(self, task_id: str):
+        """任务被删除"""
+        if not self._subscribers:
+            return
+        with self._lock:
+            self._pending[task_id] = {'deleted': True}
+
+    def publish_resync(self):
+        """批量变更（如清空任务），通知客户端重新拉取列表"""
+        with self._lock:
+            self._resync = True
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                resync, self._resync = self._resync, False
+            if not self._subscribers or not (pending or resync):
+                continue
+            messages = []
+            if pending:
+                deltas = [{'id': tid, **fields} for tid, fields in pending.items()]
+                messages.append(self._format('tasks', jsonable_encoder(deltas)))
+            if resync:
+                messages.append(self._format('resync', {}))
+            for queue in list(self._subscribers):
+                for msg in messages:
+                    self._offer(queue, msg)
+
+    def _offer(self, queue: asyncio.Queue, msg: str):
+        try:
+            queue.put_nowait(msg)
+        except asyncio.QueueFull:
+            # 客户端消费太慢：清空积压，让它全量刷新
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(self._format('resync', {}))
+
+    @staticmethod
+    def _format(event: str, data: Any) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def stream(self) -> AsyncIterator[str]:
+        """SSE 数据流（每个客户端一个）"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=EVENT_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self._subscribers.discard(queue)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
@@ -0,0 +1,78 @@
+"""
+Prometheus 指标（GET /metrics）
+
+- 下载各阶段耗时：排队等待、元数据解析、媒体传输、后处理（ffmpeg）、COS 上传
+- 下载/上传字节数、单文件吞吐量
+- 任务结果、自动重试、站点限流命中
+- 队列深度、运行中任务数、线程池占用
+
+多进程下载模式下阶段耗时由子进程随下载结果带回，在主进程统一记录。
+"""
+from typing import Any, Dict, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+PHASE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+THROUGHPUT_BUCKETS = tuple(2 ** i * 1024 for i in range(4, 18))   # 16KB/s ~ 128MB/s
+
+PHASE_SECONDS = Histogram(
+    'vd_phase_seconds', '下载任务各阶段耗时（秒）',
+    ['phase'],  # queue / extract / transfer / postprocess / upload
+    buckets=PHASE_BUCKETS,
+)
+TASK_SECONDS = Histogram(
+    'vd_task_seconds', '单次下载尝试总耗时（秒，不含排队）',
+    buckets=PHASE_BUCKETS,
+)
+DOWNLOAD_BYTES = Counter('vd_download_bytes_total', '下载的媒体字节数')
+DOWNLOAD_THROUGHPUT = Histogram(
+    'vd_download_throughput_bytes', '单个文件的传输速度（字节/秒）',
+    buckets=THROUGHPUT_BUCKETS,
+)
+UPLOAD_BYTES = Counter('vd_cos_upload_bytes_total', '上传到 COS 的字节数')
+UPLOAD_FILES = Counter(
+    'vd_cos_upload_files_total', '上传到 COS 的文件数',
+    ['result'],  # success / failed / skipped（已存在） / copied（服务端复制）
+)
+
+TASK_RESULTS = Counter(
+    'vd_tasks_total', '下载任务结果',
+    ['result'],  # completed / failed / cancelled / paused
+)
+RETRIES = Counter('vd_retries_total', '自动重试次数', ['error_kind'])
+RATE_LIMIT_HITS = Counter('vd_rate_limit_hits_total', '被站点限流的次数', ['site'])
+
+QUEUE_DEPTH = Gauge('vd_queue_depth', '调度器中排队的任务数')
+RUNNING_TASKS = Gauge('vd_running_tasks', '正在执行的下载任务数')
+RETRYING_TASKS = Gauge('vd_retrying_tasks', '等待自动重试的任务数')
+EXECUTOR_BUSY = Gauge('vd_executor_busy', '线程池/进程池中正在执行的任务数', ['pool'])
+EXECUTOR_SIZE = Gauge('vd_executor_size', '线程池/进程池大小', ['pool'])
+
+
+def bind_scheduler(scheduler) -> None:
+    """队列相关指标在抓取时从调度器读取"""
+    QUEUE_DEPTH.set_function(lambda: scheduler.counts()['queued'])
+    RUNNING_TASKS.set_function(lambda: scheduler.counts()['running'])
+    RETRYING_TASKS.set_function(lambda: scheduler.counts()['retrying'])
+    EXECUTOR_SIZE.labels('download').set(scheduler.max_concurrent)
+    EXECUTOR_SIZE.labels('info').set(scheduler.info_workers)
+
+
+def observe_download(timings: Dict[str, Any]) -> None:
+    """记录 VideoDownloader.download 返回的阶段耗时"""
+    if not timings:
+        return
+    for phase in ('extract', 'transfer', 'postprocess'):
+        if timings.get(phase) is not None:
+            PHASE_SECONDS.labels(phase).observe(timings[phase])
+    if timings.get('total') is not None:
+        TASK_SECONDS.observe(timings['total'])
+    DOWNLOAD_BYTES.inc(timings.get('bytes') or 0)
+    for size, seconds in timings.get('files') or ():
+        if seconds > 0:
+            DOWNLOAD_THROUGHPUT.observe(size / seconds)
+
+
+def render() -> Tuple[bytes, str]:
+    """Prometheus 文本格式"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -10,8 +10,11 @@ from datetime import datetime
 class TaskStatus(str, Enum):
     PENDING = "pending"
     DOWNLOADING = "downloading"
+    RETRYING = "retrying"      # 失败后等待自动重试
+    PAUSED = "paused"          # 已暂停（保留 .part 文件，可继续）
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 
 class SortOrder(str, Enum):
@@ -30,6 +33,8 @@ class DownloadRequest(BaseModel):
     download_playlist: bool = False  # 是否下载整个播放列表/频道
     max_videos: Optional[int] = None  # 最多下载几个视频
     sort_order: SortOrder = SortOrder.NEWEST  # 排序方式
+    priority: int = 0  # 队列优先级，数值越大越先执行
+    connections: Optional[int] = None  # 单个视频的并发连接数（分片并发 / Range 分段），默认按站点自动调整
 
 
 class BatchDownloadRequest(BaseModel):
@@ -37,6 +42,12 @@ class BatchDownloadRequest(BaseModel):
     urls: List[str]
     format: str = "best"
     download_subtitles: bool = True
+    download_playlist: bool = False
+    max_videos: Optional[int] = None
+    sort_order: SortOrder = SortOrder.NEWEST
+    priority: int = 0
+    parallelism: Optional[int] = None  # 批次内同时下载数，默认 BATCH_PARALLELISM
+    connections: Optional[int] = None  # 单个视频的并发连接数，默认按站点自动调整
 
 
 class VideoInfoBase(BaseModel):
@@ -65,12 +76,26 @@ class PlaylistInfo(VideoInfoBase):
     videos: List[Dict[str, Any]] = []
 
 
+class TaskAttempt(BaseModel):
+    """一次下载尝试"""
+    attempt: int
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    error_kind: Optional[str] = None  # network/throttle/unavailable/permanent/unknown
+    retry_in: Optional[float] = None  # 计划多少秒后重试
+
+
 class DownloadTask(BaseModel):
     """下载任务"""
     id: str
     url: str
     status: TaskStatus = TaskStatus.PENDING
     progress: float = 0.0
+    downloaded_bytes: Optional[int] = None  # 当前文件已下载字节
+    total_bytes: Optional[int] = None  # 当前文件总字节
+    speed: Optional[float] = None  # 下载速度（字节/秒，EMA 平滑）
+    eta: Optional[int] = None  # 预计剩余秒数
     title: Optional[str] = None
     filename: Optional[str] = None
     error: Optional[str] = None
@@ -78,10 +103,32 @@ class DownloadTask(BaseModel):
     type: str = "video"  # video 或 playlist
     video_count: Optional[int] = None  # 播放列表视频数
     cos_uploaded: bool = False  # 是否已上传到 COS
+    options: Dict[str, Any] = {}  # 下载参数（重试/继续下载时复用）
+    batch_id: Optional[str] = None  # 所属批次
+    attached_to: Optional[str] = None  # 合并到的进行中任务（相同视频只下载一次）
+    attempts: List[TaskAttempt] = []  # 尝试记录
+    next_retry_at: Optional[datetime] = None  # 下次自动重试时间
     created_at: datetime = datetime.now()
     completed_at: Optional[datetime] = None
 
 
+class VideoRecord(BaseModel):
+    """已下载视频记录（去重登记表）"""
+    extractor: str  # yt-dlp 提取器，如 Youtube；旧版记录迁移时为空
+    video_id: str
+    title: Optional[str] = None
+    uploader: Optional[str] = None
+    video_dir: Optional[str] = None
+    filepath: Optional[str] = None  # 主媒体文件
+    file_size: Optional[int] = None
+    format: Optional[str] = None  # yt-dlp format_id
+    checksum: Optional[str] = None  # 媒体内容 sha256（多流合并时为各流摘要的组合）
+    cos_uploaded: bool = False
+    cos_prefix: Optional[str] = None
+    downloaded_at: Optional[datetime] = None
+    uploaded_at: Optional[datetime] = None
+
+
 class DownloadResponse(BaseModel):
     """下载响应"""
     task_id: str
@@ -93,3 +140,4 @@ class TaskListResponse(BaseModel):
     """任务列表响应"""
     total: int
     tasks: List[DownloadTask]
+    next_cursor: Optional[str] = None  # 下一页游标，为空表示没有更多
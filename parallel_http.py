@@ -0,0 +1,296 @@
+"""
+单文件格式的并行 Range 下载
+
+yt-dlp 对 http/https 直链（非 DASH/HLS）只用一个连接顺序下载，经代理时单连接速度远低于带宽。
+RangeHttpFD 把文件切成若干段，用 range_connections 个连接并行请求 Range，
+按偏移直接写入预分配的 .part 文件（原地拼接，不需要合并步骤），完成后重命名。
+
+- 只在参数 range_connections > 1 时启用；服务器不支持 Range、文件较小、
+  限速/测试/模拟浏览器请求等情况回退到 yt-dlp 原有的 HttpFD
+- 已完成的分段记录在 {.part}.ranges，暂停后继续下载只请求剩余分段；
+  只有 .part 没有分段记录（之前是顺序下载）时交给 HttpFD 续传
+- 下载中途服务器不再返回 Range 响应时，.part 截到开头已连续写入的部分，交给 HttpFD 单连接继续
+- 进度中的 contiguous_bytes 为文件开头已连续写入的字节数，StreamHasher 只读到这里
+- install() 替换 yt-dlp 对 http/https 协议使用的下载器（创建下载器时调用，导入本模块没有副作用）
+"""
+import os
+import re
+import json
+import time
+import threading
+import logging
+from typing import List, Optional, Tuple
+
+from yt_dlp.downloader import PROTOCOL_MAP
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.utils.networking import HTTPHeaderDict
+
+logger = logging.getLogger(__name__)
+
+RANGE_MIN_SIZE = 8 * 1024 * 1024     # 小于此大小的文件单连接下载
+RANGE_PIECE_MIN = 1024 * 1024        # 分段大小下限
+RANGE_PIECE_MAX = 16 * 1024 * 1024   # 分段大小上限（站点给出 http_chunk_size 时取较小值）
+RANGE_PIECES_PER_CONNECTION = 4      # 每个连接平均分到的段数（快的连接多下载几段）
+RANGE_READ_SIZE = 256 * 1024
+PROGRESS_INTERVAL = 0.2              # 进度回调间隔（秒）
+
+_CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+)')
+
+
+class _RangeUnsupported(Exception):
+    """服务器不支持 Range 或响应与请求不符"""
+
+
+class RangeHttpFD(HttpFD):
+    """http/https 直链：range_connections > 1 时分段并行下载"""
+
+    def real_download(self, filename, info_dict):
+        connections = int(self.params.get('range_connections') or 1)
+        if connections <= 1 or not self._range_applicable(filename, info_dict):
+            return super().real_download(filename, info_dict)
+
+        tmpfilename = self.temp_name(filename)
+        headers = HTTPHeaderDict({'Accept-Encoding': 'identity'}, info_dict.get('http_headers'))
+        try:
+            total = self._probe(info_dict['url'], headers)
+        except Exception as e:
+            logger.debug(f"Range 探测失败，单连接下载: {e}")
+            return super().real_download(filename, info_dict)
+        if total < RANGE_MIN_SIZE:
+            return super().real_download(filename, info_dict)
+
+        chunk_size = info_dict.get('downloader_options', {}).get('http_chunk_size') or RANGE_PIECE_MAX
+        piece_size = max(RANGE_PIECE_MIN, min(chunk_size, RANGE_PIECE_MAX,
+                                              -(-total // (connections * RANGE_PIECES_PER_CONNECTION))))
+        pieces = [(start, min(start + piece_size, total)) for start in range(0, total, piece_size)]
+
+        done = self._load_state(tmpfilename, total, piece_size)
+        if done is None:
+            # 之前是单连接顺序下载留下的 .part，交给 HttpFD 续传
+            return super().real_download(filename, info_dict)
+
+        self.report_destination(filename)
+        try:
+            return _RangeDownload(self, info_dict, headers, filename, tmpfilename,
+                                  total, pieces, done, connections).run()
+        except _RangeUnsupported as e:
+            logger.info(f"服务器中途不再支持 Range，改为单连接继续下载: {e}")
+            return super().real_download(filename, info_dict)
+
+    def _range_applicable(self, filename, info_dict) -> bool:
+        if filename == '-' or self.params.get('test') or self.params.get('nopart'):
+            return False
+        if self.params.get('ratelimit') or info_dict.get('request_data') is not None:
+            return False
+        if self._get_impersonate_target(info_dict) is not None:
+            return False
+        # 字幕等附属文件没有 format_id；已知大小的小文件不必探测
+        if not info_dict.get('format_id'):
+            return False
+        size = info_dict.get('filesize') or info_dict.get('filesize_approx')
+        return not size or size >= RANGE_MIN_SIZE
+
+    def _probe(self, url: str, headers: HTTPHeaderDict) -> int:
+        """请求第一个字节，确认支持 Range 并取得文件总大小"""
+        response = self.ydl.urlopen(Request(url, None, HTTPHeaderDict(headers, {'Range': 'bytes=0-0'})))
+        try:
+            match = _CONTENT_RANGE_RE.match(response.headers.get('Content-Range') or '')
+            if response.status != 206 or not match:
+                raise _RangeUnsupported(f"HTTP {response.status}")
+            return int(match.group(3))
+        finally:
+            response.close()
+
+    def _load_state(self, tmpfilename: str, total: int, piece_size: int) -> Optional[List[int]]:
+        """已完成的分段序号；.part 存在但不是分段下载留下的返回 None"""
+        state_file = f"{tmpfilename}.ranges"
+        if not self.params.get('continuedl', True):
+            for path in (tmpfilename, state_file):
+                if os.path.exists(path):
+                    os.remove(path)
+            return []
+        if not os.path.exists(state_file):
+            return None if os.path.exists(tmpfilename) else []
+        try:
+            with open(state_file, 'r') as f:
+                state = json.load(f)
+            if (state.get('total'), state.get('piece_size')) == (total, piece_size) and os.path.exists(tmpfilename):
+                return list(state.get('done', []))
+        except (OSError, ValueError):
+            pass
+        # 分段记录与当前文件不符（文件变了或参数不同）：重新下载
+        for path in (tmpfilename, state_file):
+            if os.path.exists(path):
+                os.remove(path)
+        return []
+
+
+class _RangeDownload:
+    """一次分段下载：工作线程取下一个未完成分段下载写入，主线程汇报进度（progress hook 可能抛出取消）"""
+
+    def __init__(self, fd: RangeHttpFD, info_dict, headers, filename, tmpfilename,
+                 total, pieces: List[Tuple[int, int]], done: List[int], connections: int):
+        self.fd = fd
+        self.info_dict = info_dict
+        self.url = info_dict['url']
+        self.headers = headers
+        self.filename = filename
+        self.tmpfilename = tmpfilename
+        self.state_file = f"{tmpfilename}.ranges"
+        self.total = total
+        self.pieces = pieces
+        self.piece_size = pieces[0][1] - pieces[0][0]
+        self.done = set(done)
+        self.pending = [i for i in range(len(pieces)) if i not in self.done]
+        self.connections = min(connections, len(self.pending)) or 1
+        self.resumed = sum(pieces[i][1] - pieces[i][0] for i in self.done)
+        self.downloaded = self.resumed
+        self.errors: List[Exception] = []
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.stop = threading.Event()
+
+    def run(self) -> bool:
+        start = time.time()
+        fd_num = os.open(self.tmpfilename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd_num, self.total)
+            self._save_state()
+            workers = [threading.Thread(target=self._worker, args=(fd_num,), daemon=True)
+                       for _ in range(self.connections)]
+            for w in workers:
+                w.start()
+            try:
+                while alive := [w for w in workers if w.is_alive()]:
+                    alive[0].join(PROGRESS_INTERVAL)
+                    self._report(start)
+            finally:
+                self.stop.set()
+                for w in workers:
+                    w.join()
+                self._save_state()
+        finally:
+            os.close(fd_num)
+
+        unsupported = [e for e in self.errors if isinstance(e, _RangeUnsupported)]
+        if unsupported:
+            # 只保留开头连续的部分，HttpFD 从这里续传（服务器不支持续传时它会从头下载）
+            os.truncate(self.tmpfilename, self._contiguous())
+            os.remove(self.state_file)
+            raise unsupported[0]
+        if self.errors or len(self.done) < len(self.pieces):
+            error = self.errors[0] if self.errors else '部分分段未完成'
+            self.fd.report_error(f"分段下载失败: {error}")
+            return False
+
+        os.remove(self.state_file)
+        self.fd.try_rename(self.tmpfilename, self.filename)
+        self.fd._hook_progress({
+            'downloaded_bytes': self.total,
+            'total_bytes': self.total,
+            'filename': self.filename,
+            'status': 'finished',
+            'elapsed': time.time() - start,
+            'ctx_id': self.info_dict.get('ctx_id'),
+        }, self.info_dict)
+        return True
+
+    def _contiguous(self) -> int:
+        """文件开头已连续写入的字节数（调用方持有 self.lock 或工作线程已结束）"""
+        contiguous = 0
+        for i, (begin, end) in enumerate(self.pieces):
+            if i not in self.done:
+                break
+            contiguous = end
+        return contiguous
+
+    def _report(self, start: float):
+        now = time.time()
+        with self.lock:
+            downloaded = self.downloaded
+            contiguous = self._contiguous()
+        self.fd._hook_progress({
+            'status': 'downloading',
+            'downloaded_bytes': downloaded,
+            'total_bytes': self.total,
+            'contiguous_bytes': contiguous,
+            'tmpfilename': self.tmpfilename,
+            'filename': self.filename,
+            'eta': self.fd.calc_eta(start, now, self.total - self.resumed, downloaded - self.resumed),
+            'speed': self.fd.calc_speed(start, now, downloaded - self.resumed),
+            'elapsed': now - start,
+            'ctx_id': self.info_dict.get('ctx_id'),
+        }, self.info_dict)
+
+    def _next_piece(self) -> Optional[int]:
+        with self.lock:
+            if self.stop.is_set() or not self.pending:
+                return None
+            return self.pending.pop(0)
+
+    def _worker(self, fd_num: int):
+        retries = self.fd.params.get('retries', 10)
+        while (index := self._next_piece()) is not None:
+            begin, end = self.pieces[index]
+            position, attempt = begin, 0
+            while position < end and not self.stop.is_set():
+                try:
+                    position = self._fetch(fd_num, position, end)
+                except _RangeUnsupported as e:
+                    self._fail(e)
+                    return
+                except Exception as e:
+                    attempt += 1
+                    if attempt > retries:
+                        self._fail(e)
+                        return
+                    logger.debug(f"分段 {begin}-{end} 下载出错，第 {attempt} 次重试: {e}")
+                    self.stop.wait(min(attempt, 5))
+            if position < end:
+                return
+            with self.lock:
+                self.done.add(index)
+            self._save_state()
+
+    def _fetch(self, fd_num: int, position: int, end: int) -> int:
+        """请求 [position, end) 写入文件，返回写到的位置（连接中断时小于 end）"""
+        headers = HTTPHeaderDict(self.headers, {'Range': f'bytes={position}-{end - 1}'})
+        response = self.fd.ydl.urlopen(Request(self.url, None, headers))
+        try:
+            match = _CONTENT_RANGE_RE.match(response.headers.get('Content-Range') or '')
+            if response.status != 206 or not match or int(match.group(1)) != position:
+                raise _RangeUnsupported(f"HTTP {response.status} {response.headers.get('Content-Range')}")
+            while position < end and not self.stop.is_set():
+                data = response.read(min(RANGE_READ_SIZE, end - position))
+                if not data:
+                    break
+                os.pwrite(fd_num, data, position)
+                position += len(data)
+                with self.lock:
+                    self.downloaded += len(data)
+        finally:
+            response.close()
+        if position < end and not self.stop.is_set():
+            raise ConnectionError(f"连接提前关闭: {position}/{end}")
+        return position
+
+    def _fail(self, error: Exception):
+        with self.lock:
+            self.errors.append(error)
+        self.stop.set()
+
+    def _save_state(self):
+        with self.lock:
+            state = {'total': self.total, 'piece_size': self.piece_size, 'done': sorted(self.done)}
+        tmp = f"{self.state_file}.tmp"
+        with self.save_lock:
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_file)
+
+
+def install():
+    """替换 http/https 协议的默认下载器（可重复调用；range_connections <= 1 时行为与 HttpFD 相同）"""
+    PROTOCOL_MAP['http'] = RangeHttpFD
+    PROTOCOL_MAP['https'] = RangeHttpFD
@@ -0,0 +1,241 @@
+"""
+多进程下载模式（EXECUTION_MODE=process）
+
+yt-dlp 的解析、格式排序、分片记录都是纯 Python，放在线程里会与 FastAPI
+事件循环争抢 GIL。该模式下 VideoDownloader.download 在独立进程中执行：
+- 进度通过 IPC 队列回传，由主进程的读取线程交给对应任务的 hook
+- 每个工作进程处理 PROCESS_MAX_JOBS 个任务后自动回收，限制内存增长
+- multiprocessing.Pool 的工作进程被杀死（OOM、ffmpeg/原生扩展崩溃）时对应任务的结果永远不会返回：
+  子进程开始执行时回报 pid，看门狗线程发现进程已退出或任务超过 PROCESS_TASK_TIMEOUT
+  即让任务失败（可重试），超时的进程会被杀掉，调度器名额随之释放
+- 取消标记在 Manager 进程中，每次写入是一次 IPC：主进程的写入交给后台线程，不阻塞事件循环
+"""
+import os
+import time
+import signal
+import threading
+import logging
+import multiprocessing as mp
+from collections.abc import MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_MODE = os.getenv('EXECUTION_MODE', 'thread')            # thread / process
+PROCESS_MAX_JOBS = int(os.getenv('PROCESS_MAX_JOBS', '20'))       # 单进程最多处理任务数
+PROGRESS_IPC_INTERVAL = 0.2   # 子进程回传进度的最小间隔（秒）
+CANCEL_CHECK_INTERVAL = 0.5   # 子进程检查取消标记的最小间隔（秒）
+PROCESS_TASK_TIMEOUT = float(os.getenv('PROCESS_TASK_TIMEOUT', '21600'))   # 单个任务最长运行秒数（0 不限）
+WATCHDOG_INTERVAL = 2.0       # 检查工作进程存活的间隔（秒）
+
+# 回传给主进程的 hook 字段
+_HOOK_FIELDS = ('status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'filename')
+
+# ==================== 子进程 ====================
+
+_worker_downloader = None
+_worker_queue = None
+_worker_cancel_flags = None
+
+
+def _init_worker(download_dir: str, queue, cancel_flags):
+    """子进程初始化：每个进程一个 VideoDownloader"""
+    global _worker_downloader, _worker_queue, _worker_cancel_flags
+    from downloader import VideoDownloader
+    _worker_downloader = VideoDownloader(download_dir)
+    _worker_queue = queue
+    _worker_cancel_flags = cancel_flags
+
+
+def _run_download(task_id: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """子进程中执行下载"""
+    from downloader import TaskCancelled
+    # 告诉主进程由哪个进程执行，进程意外退出时主进程据此让任务失败
+    _worker_queue.put((task_id, {'_pid': os.getpid()}))
+    last_sent = 0.0
+    last_check = 0.0
+
+    def check_cancelled(partial_file: Optional[str] = None):
+        mode = _worker_cancel_flags.get(task_id)
+        if mode:
+            raise TaskCancelled(mode, partial_file)
+
+    def hook(d):
+        nonlocal last_sent, last_check
+        now = time.monotonic()
+        # 取消标记在 Manager 进程中，查询是一次 IPC，按间隔检查
+        if now - last_check >= CANCEL_CHECK_INTERVAL:
+            last_check = now
+            check_cancelled(d.get('tmpfilename'))
+        # downloading 事件节流，其余（finished 等）立即回传
+        if d['status'] == 'downloading' and now - last_sent < PROGRESS_IPC_INTERVAL:
+            return
+        last_sent = now
+        _worker_queue.put((task_id, {k: d.get(k) for k in _HOOK_FIELDS}))
+
+    # 频道条目之间、后处理开始前的检查点（见 make_cancellable_hook）
+    hook.check_cancelled = check_cancelled
+    return _worker_downloader.download(progress_callback=hook, **kwargs)
+
+
+# ==================== 主进程 ====================
+
+class WorkerDied(RuntimeError):
+    """执行任务的工作进程异常退出或任务超时"""
+
+
+class _CancelFlags(MutableMapping):
+    """
+    取消标记：本地副本供主进程读取，写入 Manager 字典由单个后台线程按顺序完成
+    （调度器在事件循环中调用 cancel，不等待 IPC）
+    """
+
+    def __init__(self, shared):
+        self._shared = shared
+        self._local: Dict[str, str] = {}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cancel-flags')
+
+    def _write(self, fn, *args):
+        def run():
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.warning(f"写入取消标记失败: {e}")
+        self._writer.submit(run)
+
+    def __getitem__(self, task_id: str) -> str:
+        return self._local[task_id]
+
+    def __setitem__(self, task_id: str, mode: str):
+        self._local[task_id] = mode
+        self._write(self._shared.__setitem__, task_id, mode)
+
+    def __delitem__(self, task_id: str):
+        del self._local[task_id]
+        self._write(self._shared.pop, task_id, None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._local)
+
+    def __len__(self) -> int:
+        return len(self._local)
+
+    def close(self):
+        self._writer.shutdown(wait=False)
+
+
+class ProcessDownloadPool:
+    """下载进程池"""
+
+    def __init__(self, download_dir: str, max_workers: int,
+                 max_jobs_per_worker: int = PROCESS_MAX_JOBS):
+        ctx = mp.get_context('spawn')
+        self._queue = ctx.Queue()
+        self._manager = ctx.Manager()
+        shared_flags = self._manager.dict()
+        self.cancel_flags = _CancelFlags(shared_flags)
+        # 使用 multiprocessing.Pool 而非 ProcessPoolExecutor：
+        # 后者在 Python 3.11 下 max_tasks_per_child 回收进程时可能死锁
+        self._pool = ctx.Pool(
+            processes=max_workers,
+            initializer=_init_worker,
+            initargs=(download_dir, self._queue, shared_flags),
+            maxtasksperchild=max_jobs_per_worker,
+        )
+        self._hooks: Dict[str, Callable] = {}
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Tuple[Future, float]] = {}   # task_id -> (Future, 提交时间)
+        self._pids: Dict[str, int] = {}
+        self._stopped = threading.Event()
+        self._reader = threading.Thread(target=self._drain, name='progress-ipc', daemon=True)
+        self._reader.start()
+        self._watchdog = threading.Thread(target=self._watch, name='process-watchdog', daemon=True)
+        self._watchdog.start()
+        logger.info(f"多进程下载模式: {max_workers} 进程，每进程 {max_jobs_per_worker} 个任务后回收")
+
+    def submit(self, task_id: str, progress_callback: Optional[Callable], **kwargs) -> Future:
+        """提交下载，返回 concurrent.futures.Future"""
+        if progress_callback:
+            self._hooks[task_id] = progress_callback
+        future: Future = Future()
+        with self._lock:
+            self._futures[task_id] = (future, time.monotonic())
+
+        def on_result(result):
+            self._finish(task_id, future, result=result)
+
+        def on_error(exc):
+            self._finish(task_id, future, error=exc)
+
+        self._pool.apply_async(
+            _run_download, (task_id, kwargs),
+            callback=on_result, error_callback=on_error
+        )
+        return future
+
+    def _finish(self, task_id: str, future: Future, result=None, error: Optional[BaseException] = None) -> bool:
+        """结束任务（结果回调与看门狗可能竞争，只有第一次生效）"""
+        with self._lock:
+            if self._futures.get(task_id, (None,))[0] is not future:
+                return False
+            del self._futures[task_id]
+            self._pids.pop(task_id, None)
+            self._hooks.pop(task_id, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        return True
+
+    def _watch(self):
+        """看门狗：执行任务的进程已退出，或任务超时（杀掉进程，由进程池补充新进程）"""
+        # 进程正常回收时结果可能还在结果队列里：连续两轮检查都已退出才判定异常
+        suspects: set = set()
+        while not self._stopped.wait(WATCHDOG_INTERVAL):
+            alive = {p.pid for p in mp.active_children()}
+            now = time.monotonic()
+            with self._lock:
+                running = [(task_id, future, started, self._pids.get(task_id))
+                           for task_id, (future, started) in self._futures.items()]
+            dead = {task_id for task_id, _, _, pid in running if pid is not None and pid not in alive}
+            confirmed, suspects = dead & suspects, dead
+            for task_id, future, started, pid in running:
+                if task_id in confirmed:
+                    error = WorkerDied(f"下载进程 {pid} 异常退出")
+                elif PROCESS_TASK_TIMEOUT and now - started > PROCESS_TASK_TIMEOUT:
+                    error = WorkerDied(f"下载超时（{PROCESS_TASK_TIMEOUT:.0f} 秒）")
+                    if pid is not None:
+                        try:
+                            os.kill(pid, signal.SIGKILL)
+                        except OSError:
+                            pass
+                else:
+                    continue
+                if self._finish(task_id, future, error=error):
+                    logger.error(f"任务 {task_id}: {error}")
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            task_id, d = item
+            if '_pid' in d:
+                with self._lock:
+                    if task_id in self._futures:
+                        self._pids[task_id] = d['_pid']
+                continue
+            hook = self._hooks.get(task_id)
+            if hook:
+                try:
+                    hook(d)
+                except Exception as e:
+                    logger.error(f"进度回调失败 [{task_id}]: {e}")
+
+    def shutdown(self):
+        self._stopped.set()
+        self.cancel_flags.close()
+        self._pool.terminate()
+        self._queue.put(None)
+        self._manager.shutdown()
@@ -0,0 +1,141 @@
+"""
+下载进度聚合
+
+yt-dlp 的 progress hook 每个分片都会触发多次。这里 hook 只记录最新的原始数值
+（几次属性赋值），由后台协程按 PROGRESS_SAMPLE_INTERVAL 统一采样：
+计算进度、EMA 平滑的速度与剩余时间，再批量写入任务存储。
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_SAMPLE_INTERVAL = float(os.getenv('PROGRESS_SAMPLE_INTERVAL', '1.0'))  # 采样周期（秒）
+PROGRESS_EMA_ALPHA = float(os.getenv('PROGRESS_EMA_ALPHA', '0.3'))              # 速度平滑系数
+MIN_VIDEO_BYTES = 1024 * 1024      # 大于 1MB 才认为是视频（排除字幕、缩略图等小文件）
+VIDEO_EXTS = ('.mp4', '.webm', '.mkv')
+
+
+class _TaskProgress:
+    """单个任务的进度状态（hook 线程写，采样协程读）"""
+    __slots__ = (
+        'downloaded', 'total', 'current_file', 'finished_file', 'dirty',
+        'sample_file', 'sample_bytes', 'sample_time', 'speed',
+    )
+
+    def __init__(self):
+        self.downloaded: Any = 0
+        self.total: Any = 0
+        self.current_file: Optional[str] = None
+        self.finished_file: Optional[str] = None
+        self.dirty = False
+        self.sample_file: Optional[str] = None
+        self.sample_bytes = 0.0
+        self.sample_time = 0.0
+        self.speed: Optional[float] = None
+
+
+class ProgressAggregator:
+    """进度聚合器"""
+
+    def __init__(self,
+                 publish: Callable[[Dict[str, Dict[str, Any]]], None],
+                 interval: float = PROGRESS_SAMPLE_INTERVAL,
+                 alpha: float = PROGRESS_EMA_ALPHA):
+        self._publish = publish
+        self.interval = interval
+        self.alpha = alpha
+        self._entries: Dict[str, _TaskProgress] = {}
+        self._sampler: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._sampler = asyncio.create_task(self._sample_loop())
+
+    async def stop(self):
+        if self._sampler:
+            self._sampler.cancel()
+            await asyncio.gather(self._sampler, return_exceptions=True)
+
+    def hook(self, task_id: str) -> Callable[[Dict[str, Any]], None]:
+        """创建 yt-dlp progress hook"""
+        entry = self._entries.setdefault(task_id, _TaskProgress())
+
+        def callback(d):
+            status = d['status']
+            if status == 'downloading':
+                entry.downloaded = d.get('downloaded_bytes')
+                entry.total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                entry.current_file = d.get('filename')
+                entry.dirty = True
+            elif status == 'finished':
+                entry.finished_file = d.get('filename')
+                entry.dirty = True
+        return callback
+
+    def discard(self, task_id: str):
+        """任务结束，丢弃未发布的进度"""
+        self._entries.pop(task_id, None)
+
+    async def _sample_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"进度采样失败: {e}")
+
+    def flush(self):
+        """采样所有有变化的任务，批量发布"""
+        now = time.monotonic()
+        updates: Dict[str, Dict[str, Any]] = {}
+        for task_id, entry in list(self._entries.items()):
+            if not entry.dirty:
+                continue
+            entry.dirty = False
+            fields = self._sample(entry, now)
+            if fields:
+                updates[task_id] = fields
+        if updates:
+            self._publish(updates)
+
+    def _sample(self, entry: _TaskProgress, now: float) -> Dict[str, Any]:
+        fields: Dict[str, Any] = {}
+
+        filename = entry.finished_file
+        if filename and filename.endswith(VIDEO_EXTS):
+            fields['filename'] = filename
+
+        try:
+            downloaded = float(entry.downloaded or 0)
+            total = float(entry.total or 0)
+        except (ValueError, TypeError):
+            return fields
+
+        # 换文件（视频/音频/字幕）或回退时重置速度基线
+        if entry.current_file != entry.sample_file or downloaded < entry.sample_bytes:
+            entry.sample_file = entry.current_file
+            entry.sample_bytes = downloaded
+            entry.sample_time = now
+            return fields
+
+        elapsed = now - entry.sample_time
+        if elapsed > 0:
+            instant = (downloaded - entry.sample_bytes) / elapsed
+            if entry.speed is None:
+                entry.speed = instant
+            else:
+                entry.speed = self.alpha * instant + (1 - self.alpha) * entry.speed
+            entry.sample_bytes = downloaded
+            entry.sample_time = now
+
+        if total > MIN_VIDEO_BYTES:
+            fields['progress'] = min(downloaded / total * 100, 99)
+            fields['downloaded_bytes'] = int(downloaded)
+            fields['total_bytes'] = int(total)
+            if entry.speed is not None:
+                fields['speed'] = round(entry.speed, 1)
+                fields['eta'] = int((total - downloaded) / entry.speed) if entry.speed > 0 else None
+        return fields
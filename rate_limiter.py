@@ -0,0 +1,405 @@
+"""
+按站点自适应限流（令牌桶 + AIMD）
+
+- 每个站点一个令牌桶，调度器先查询站点是否可用，
+  冷却中的任务放回定时器，worker 继续处理其他站点的任务
+- 下载成功：加性增大并发、缩短间隔；遇到 403/429：并发减半、间隔翻倍
+- 状态持久化到 RATE_STATE_FILE，重启后不会立刻以满速度再次触发封禁；
+  多进程模式下 AIMD 由主进程调整，子进程每 STATE_REFRESH_INTERVAL 秒检查该文件，
+  有变化时同步各站点的间隔和并发（新的限流记录同时清空令牌）
+- 单个视频的连接数（分片并发 / Range 分段）按站点测得的吞吐量爬山调整
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+import logging
+from urllib.parse import urlparse
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+SITE_MIN_INTERVAL = float(os.getenv('SITE_MIN_INTERVAL', '3'))       # 初始下载间隔（秒）
+SITE_INTERVAL_FLOOR = float(os.getenv('SITE_INTERVAL_FLOOR', '1'))   # 间隔下限
+SITE_INTERVAL_MAX = float(os.getenv('SITE_INTERVAL_MAX', '300'))     # 间隔上限
+SITE_INTERVAL_STEP = 0.5                                             # 每次成功缩短的秒数
+SITE_BURST = int(os.getenv('SITE_BURST', '1'))                       # 允许的突发次数
+SITE_CONCURRENCY = int(os.getenv('SITE_CONCURRENCY', '2'))           # 初始同站点并发
+SITE_MAX_CONCURRENCY = int(os.getenv('SITE_MAX_CONCURRENCY', '4'))   # 同站点并发上限
+RATE_STATE_FILE = os.getenv('RATE_STATE_FILE', './rate_limits.json')
+STATE_SAVE_INTERVAL = 30   # 成功时最多每 30 秒落盘一次
+STATE_REFRESH_INTERVAL = 5   # 检查其他进程写入的状态文件的间隔（秒）
+
+# 单个视频的并发连接数：auto 按站点自动调整，或固定数值（1 为单连接）
+DOWNLOAD_CONNECTIONS = os.getenv('DOWNLOAD_CONNECTIONS', 'auto').lower()
+DOWNLOAD_CONNECTIONS_MAX = int(os.getenv('DOWNLOAD_CONNECTIONS_MAX', '16'))
+# auto 时允许增加连接数的站点（逗号分隔，* 为全部）；其余站点单连接：
+# YouTube 等对同一媒体 URL 的多个并行 Range 请求会限速甚至返回 403
+DOWNLOAD_CONNECTIONS_SITES = {s.strip() for s in os.getenv('DOWNLOAD_CONNECTIONS_SITES', '').split(',') if s.strip()}
+TUNER_INITIAL = 1                       # 自动调整的初始连接数（测得提速才继续增加）
+TUNER_MIN_BYTES = 8 * 1024 * 1024       # 小文件的吞吐量不参与调整
+TUNER_SAMPLES = 2                       # 每个连接数测几个文件再决定
+TUNER_GAIN = 0.1                        # 连接数翻倍至少要带来 10% 提升
+TUNER_CEILING_TTL = 1800                # 探到的上限多久后重新尝试（秒）
+
+# yt-dlp 请求间隔基准（随站点间隔放大，最多 SLEEP_FACTOR_MAX 倍）
+BASE_SLEEP_INTERVAL = 2
+BASE_MAX_SLEEP_INTERVAL = 5
+# yt-dlp 的 sleep 不可取消且占着 worker 名额，站点间隔已由调度器的令牌桶执行，这里只轻微放大
+SLEEP_FACTOR_MAX = 2.0
+
+# 同一站点的不同域名
+_SITE_ALIASES = {
+    'youtu.be': 'youtube.com',
+    'youtube-nocookie.com': 'youtube.com',
+}
+
+
+def site_key(url: str) -> str:
+    """URL 对应的站点标识（去掉 www./m. 前缀）"""
+    host = (urlparse(url).hostname or '').lower()
+    for prefix in ('www.', 'm.', 'music.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    return _SITE_ALIASES.get(host, host) or 'unknown'
+
+
+class _SiteState:
+    __slots__ = ('tokens', 'updated', 'interval', 'concurrency', 'running',
+                 'successes', 'throttles', 'last_throttle')
+
+    def __init__(self, interval: float, concurrency: int, burst: int):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.interval = interval
+        self.concurrency = concurrency
+        self.running = 0
+        self.successes = 0
+        self.throttles = 0
+        self.last_throttle = None
+
+
+class SiteRateLimiter:
+    """每个站点一个令牌桶：每 interval 秒补充一个令牌，最多 burst 个；同时运行数不超过 concurrency"""
+
+    def __init__(self,
+                 interval: float = SITE_MIN_INTERVAL,
+                 burst: int = SITE_BURST,
+                 concurrency: int = SITE_CONCURRENCY,
+                 state_file: str = RATE_STATE_FILE):
+        self.interval = interval
+        self.burst = max(1, burst)
+        self.concurrency = max(1, concurrency)
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._sites: Dict[str, _SiteState] = {}
+        self._last_save = 0.0
+        self._last_refresh = time.monotonic()
+        self._file_mtime: Optional[int] = None   # 最近一次读取或写入的状态文件 mtime
+        self._load()
+
+    # ==================== 令牌桶 ====================
+
+    def _state(self, site: str) -> _SiteState:
+        """取站点状态并补充令牌（调用方持有锁）"""
+        now = time.monotonic()
+        if now - self._last_refresh >= STATE_REFRESH_INTERVAL:
+            self._last_refresh = now
+            self._refresh()
+        st = self._sites.get(site)
+        if st is None:
+            st = self._sites[site] = _SiteState(self.interval, self.concurrency, self.burst)
+        elif st.interval > 0:
+            st.tokens = min(self.burst, st.tokens + (now - st.updated) / st.interval)
+        else:
+            st.tokens = self.burst
+        st.updated = now
+        return st
+
+    def wait_time(self, site: str) -> float:
+        """距离下一个可用令牌还有多少秒（不消耗令牌）"""
+        with self._lock:
+            st = self._state(site)
+            if st.tokens >= 1:
+                return 0.0
+            return (1 - st.tokens) * st.interval
+
+    def try_acquire(self, site: str) -> bool:
+        """有令牌且并发未满则占用一个名额，之后需调用 release()"""
+        with self._lock:
+            st = self._state(site)
+            if st.tokens >= 1 and st.running < st.concurrency:
+                st.tokens -= 1
+                st.running += 1
+                return True
+            return False
+
+    def is_saturated(self, site: str) -> bool:
+        with self._lock:
+            st = self._state(site)
+            return st.running >= st.concurrency
+
+    def current_concurrency(self, site: str) -> int:
+        """站点当前允许的并发数（AIMD 调整后）"""
+        with self._lock:
+            return self._state(site).concurrency
+
+    def release(self, site: str):
+        with self._lock:
+            st = self._sites.get(site)
+            if st and st.running > 0:
+                st.running -= 1
+
+    def reserve(self, site: str) -> float:
+        """预约一个令牌（可透支），返回调用方需要等待的秒数"""
+        with self._lock:
+            st = self._state(site)
+            st.tokens -= 1
+            if st.tokens >= 0:
+                return 0.0
+            return -st.tokens * st.interval
+
+    async def acquire(self, site: str):
+        """异步等待令牌，不占用线程"""
+        wait = self.reserve(site)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    # ==================== AIMD ====================
+
+    def on_success(self, site: str):
+        """成功：每完成一轮（= 当前并发数）次成功，并发 +1；间隔缩短一步"""
+        with self._lock:
+            st = self._state(site)
+            st.successes += 1
+            if st.successes >= st.concurrency:
+                st.successes = 0
+                st.concurrency = min(SITE_MAX_CONCURRENCY, st.concurrency + 1)
+            st.interval = max(SITE_INTERVAL_FLOOR, st.interval - SITE_INTERVAL_STEP)
+            save = time.monotonic() - self._last_save > STATE_SAVE_INTERVAL
+        if save:
+            self._save()
+
+    def on_throttle(self, site: str) -> float:
+        """被限流：并发减半、间隔翻倍并清空令牌，返回建议的重试等待秒数"""
+        with self._lock:
+            st = self._state(site)
+            st.successes = 0
+            st.throttles += 1
+            st.last_throttle = time.time()
+            st.concurrency = max(1, st.concurrency // 2)
+            st.interval = min(SITE_INTERVAL_MAX, max(st.interval * 2, self.interval))
+            st.tokens = min(st.tokens, 0.0)
+            interval, concurrency = st.interval, st.concurrency
+        logger.warning(f"站点 {site} 被限流，并发降为 {concurrency}，间隔 {interval:.1f}s")
+        self._save()
+        return interval
+
+    def ydl_sleep_options(self, site: str) -> Dict[str, float]:
+        """按当前站点间隔放大 yt-dlp 的请求间隔（最多 SLEEP_FACTOR_MAX 倍，节奏主要由调度器控制）"""
+        with self._lock:
+            st = self._state(site)
+            factor = max(1.0, st.interval / self.interval) if self.interval > 0 else 1.0
+        factor = min(factor, SLEEP_FACTOR_MAX)
+        return {
+            'sleep_interval': BASE_SLEEP_INTERVAL * factor,
+            'max_sleep_interval': BASE_MAX_SLEEP_INTERVAL * factor,
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """各站点当前限制（供 API 展示）"""
+        with self._lock:
+            return {
+                site: {
+                    'interval': round(st.interval, 2),
+                    'concurrency': st.concurrency,
+                    'running': st.running,
+                    'throttles': st.throttles,
+                    'last_throttle': st.last_throttle,
+                }
+                for site, st in self._sites.items()
+            }
+
+    # ==================== 持久化 ====================
+
+    def _read_file(self) -> Optional[Dict[str, Any]]:
+        """状态文件内容；与上次读取或写入时相同（mtime 未变）返回 None"""
+        try:
+            mtime = os.stat(self.state_file).st_mtime_ns
+        except OSError:
+            return None
+        if mtime == self._file_mtime:
+            return None
+        with open(self.state_file, 'r') as f:
+            data = json.load(f)
+        self._file_mtime = mtime
+        return data
+
+    def _refresh(self):
+        """同步其他进程（多进程模式下的主进程）写入的站点状态（调用方持有锁）"""
+        if not self.state_file:
+            return
+        try:
+            data = self._read_file()
+        except Exception as e:
+            logger.debug(f"读取限流状态失败: {e}")
+            return
+        for site, saved in (data or {}).get('sites', {}).items():
+            st = self._sites.get(site)
+            if st is None:
+                st = self._sites[site] = _SiteState(self.interval, self.concurrency, self.burst)
+            if saved.get('throttles', 0) > st.throttles:
+                st.tokens = min(st.tokens, 0.0)
+            st.interval = saved.get('interval', st.interval)
+            st.concurrency = saved.get('concurrency', st.concurrency)
+            st.throttles = saved.get('throttles', st.throttles)
+            st.last_throttle = saved.get('last_throttle')
+
+    def _load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            data = self._read_file() or {}
+            for site, saved in data.get('sites', {}).items():
+                st = _SiteState(saved.get('interval', self.interval),
+                                saved.get('concurrency', self.concurrency), self.burst)
+                st.throttles = saved.get('throttles', 0)
+                st.last_throttle = saved.get('last_throttle')
+                self._sites[site] = st
+            logger.info(f"已加载 {len(self._sites)} 个站点的限流状态")
+        except Exception as e:
+            logger.warning(f"加载限流状态失败: {e}")
+
+    def _save(self):
+        if not self.state_file:
+            return
+        with self._lock:
+            self._last_save = time.monotonic()
+            data = {'sites': {
+                site: {
+                    'interval': st.interval,
+                    'concurrency': st.concurrency,
+                    'throttles': st.throttles,
+                    'last_throttle': st.last_throttle,
+                }
+                for site, st in self._sites.items()
+            }}
+        tmp = f"{self.state_file}.tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.state_file)
+            # 自己写入的不需要再读回
+            with self._lock:
+                self._file_mtime = os.stat(self.state_file).st_mtime_ns
+        except Exception as e:
+            logger.warning(f"保存限流状态失败: {e}")
+
+
+class _TunerState:
+    __slots__ = ('connections', 'previous', 'ceiling', 'ceiling_until', 'throughput', 'samples')
+
+    def __init__(self, connections: int):
+        self.connections = connections
+        self.previous = None          # 翻倍前的连接数
+        self.ceiling = None           # 再加连接没有提升时的上限
+        self.ceiling_until = 0.0
+        self.throughput: Dict[int, float] = {}   # 连接数 -> 平均吞吐量（字节/秒）
+        self.samples = 0
+
+
+class ConnectionTuner:
+    """
+    按站点选择单个视频的连接数（爬山法）
+    - 只调整 DOWNLOAD_CONNECTIONS_SITES 中的站点，从 TUNER_INITIAL 开始；其余站点固定单连接
+    - 当前连接数测满 TUNER_SAMPLES 个文件后翻倍；翻倍后吞吐量提升不足 TUNER_GAIN 则退回并记为上限
+    - 被限流时连接数减半，并以此为上限
+    """
+
+    def __init__(self, initial: int = TUNER_INITIAL, maximum: int = DOWNLOAD_CONNECTIONS_MAX,
+                 sites: Optional[Set[str]] = None):
+        self.maximum = max(1, maximum)
+        self.initial = min(max(1, initial), self.maximum)
+        self.fixed = int(DOWNLOAD_CONNECTIONS) if DOWNLOAD_CONNECTIONS.isdigit() else None
+        self.sites = DOWNLOAD_CONNECTIONS_SITES if sites is None else sites
+        self._lock = threading.Lock()
+        self._sites: Dict[str, _TunerState] = {}
+
+    def _state(self, site: str) -> _TunerState:
+        st = self._sites.get(site)
+        if st is None:
+            st = self._sites[site] = _TunerState(self.initial)
+        elif st.ceiling is not None and time.monotonic() > st.ceiling_until:
+            st.ceiling = None
+        return st
+
+    def _tunable(self, site: str) -> bool:
+        return '*' in self.sites or site in self.sites
+
+    def pick(self, site: str) -> int:
+        if self.fixed is not None:
+            return max(1, min(self.fixed, self.maximum))
+        if not self._tunable(site):
+            return 1
+        with self._lock:
+            return self._state(site).connections
+
+    def record(self, site: str, connections: int, files) -> None:
+        """记录一次下载各文件的 (字节数, 传输秒数)"""
+        if self.fixed is not None or not self._tunable(site):
+            return
+        with self._lock:
+            st = self._state(site)
+            if connections != st.connections:
+                return
+            for size, seconds in files or ():
+                if size < TUNER_MIN_BYTES or seconds <= 0:
+                    continue
+                rate = size / seconds
+                old = st.throughput.get(connections)
+                st.throughput[connections] = rate if old is None else (old + rate) / 2
+                st.samples += 1
+            if st.samples < TUNER_SAMPLES:
+                return
+            st.samples = 0
+            previous = st.previous
+            if previous is not None and \
+                    st.throughput[connections] < st.throughput.get(previous, 0) * (1 + TUNER_GAIN):
+                self._cap(st, previous)
+                logger.info(f"站点 {site} 连接数 {connections} 没有明显提速，退回 {previous}")
+            elif connections * 2 <= min(self.maximum, st.ceiling or self.maximum):
+                st.previous = connections
+                st.connections = connections * 2
+
+    def on_throttle(self, site: str) -> None:
+        if self.fixed is not None or not self._tunable(site):
+            return
+        with self._lock:
+            st = self._state(site)
+            self._cap(st, max(1, st.connections // 2))
+
+    @staticmethod
+    def _cap(st: _TunerState, connections: int):
+        st.connections = connections
+        st.previous = None
+        st.samples = 0
+        st.ceiling = connections
+        st.ceiling_until = time.monotonic() + TUNER_CEILING_TTL
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                site: {
+                    'connections': self.fixed or st.connections,
+                    'throughput': {n: round(v) for n, v in sorted(st.throughput.items())},
+                }
+                for site, st in self._sites.items()
+            }
+
+
+# 进程内共享的限流器
+rate_limiter = SiteRateLimiter()
+# 进程内共享的连接数调整器
+connection_tuner = ConnectionTuner()
@@ -0,0 +1,236 @@
+"""
+下载调度器 - 有界并发的下载队列
+
+- 下载任务进入优先级队列（同优先级按提交顺序 FIFO）
+- 固定数量的 worker 协程从队列取任务，并发上限 = MAX_CONCURRENT_DOWNLOADS
+- 媒体下载与元数据获取使用独立线程池，频道大任务不会拖慢 /api/info
+- 按站点限流：站点冷却中的任务挂到定时器上，worker 先处理其他任务
+"""
+import os
+import asyncio
+import random
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, MutableMapping, Optional
+
+from rate_limiter import SiteRateLimiter, rate_limiter, site_key
+from metrics import EXECUTOR_BUSY, PHASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 调度配置
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '3'))  # 同时下载数
+INFO_WORKERS = int(os.getenv('INFO_WORKERS', '4'))                          # 元数据线程数
+
+# 自动重试配置
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '4'))       # 总尝试次数（含首次）
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '30'))        # 首次重试基准等待（秒）
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '1800'))        # 重试等待上限（秒）
+
+
+def backoff_delay(attempt: int, min_delay: float = 0,
+                  base: float = RETRY_BASE_DELAY, cap: float = RETRY_MAX_DELAY) -> float:
+    """第 attempt 次失败后的重试等待：指数退避 + 抖动（0.5x ~ 1.5x），不少于 min_delay"""
+    delay = min(cap, base * (2 ** (attempt - 1)))
+    delay *= random.uniform(0.5, 1.5)
+    return max(delay, min_delay)
+
+
+@dataclass(order=True)
+class QueuedJob:
+    """队列中的任务（按 sort_key 排序：优先级高的先出，同级 FIFO）"""
+    sort_key: tuple
+    task_id: str = field(compare=False)
+    priority: int = field(compare=False, default=0)
+    site: str = field(compare=False, default='unknown')
+    cancelled: bool = field(compare=False, default=False)
+    kwargs: Dict[str, Any] = field(compare=False, default_factory=dict)
+    enqueued_at: datetime = field(compare=False, default_factory=datetime.now)
+
+
+class DownloadScheduler:
+    """有界下载调度器"""
+
+    def __init__(self,
+                 runner: Callable[..., Awaitable[None]],
+                 max_concurrent: int = MAX_CONCURRENT_DOWNLOADS,
+                 info_workers: int = INFO_WORKERS,
+                 limiter: SiteRateLimiter = rate_limiter):
+        self._runner = runner
+        self.limiter = limiter
+        self.max_concurrent = max(1, max_concurrent)
+        self.download_executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrent, thread_name_prefix='download'
+        )
+        self.info_workers = max(1, info_workers)
+        self.info_executor = ThreadPoolExecutor(
+            max_workers=self.info_workers, thread_name_prefix='info'
+        )
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._seq = itertools.count()
+        self._pending: Dict[str, QueuedJob] = {}
+        self._running: Dict[str, QueuedJob] = {}
+        self._started: Dict[str, datetime] = {}
+        self._retrying: Dict[str, asyncio.TimerHandle] = {}
+        self._deferred: Dict[str, asyncio.TimerHandle] = {}
+        # 运行中任务的取消标记 {task_id: 'cancel' | 'pause'}，由下载 hook 检查
+        # 多进程模式下替换为进程间共享的字典
+        self.cancel_flags: MutableMapping[str, str] = {}
+        self._workers: List[asyncio.Task] = []
+
+    async def start(self):
+        """启动 worker 协程"""
+        self._queue = asyncio.PriorityQueue()
+        for i in range(self.max_concurrent):
+            self._workers.append(asyncio.create_task(self._worker(i)))
+        logger.info(f"下载调度器已启动: 并发 {self.max_concurrent}")
+
+    async def stop(self):
+        """停止调度器，未开始的任务丢弃"""
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        for handle in [*self._deferred.values(), *self._retrying.values()]:
+            handle.cancel()
+        self._deferred.clear()
+        self._retrying.clear()
+        self.download_executor.shutdown(wait=False, cancel_futures=True)
+        self.info_executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, task_id: str, priority: int = 0, **kwargs) -> int:
+        """提交下载任务，返回当前排队位置（从 1 开始）"""
+        job = QueuedJob(
+            sort_key=(-priority, next(self._seq)),
+            task_id=task_id,
+            priority=priority,
+            site=site_key(kwargs.get('url', '')),
+            kwargs=kwargs,
+        )
+        self._pending[task_id] = job
+        self._queue.put_nowait(job)
+        return len(self._pending)
+
+    async def run_download(self, fn: Callable[[], Any]) -> Any:
+        """在下载线程池中执行阻塞函数"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.download_executor, fn)
+
+    async def run_info(self, fn: Callable[[], Any]) -> Any:
+        """在元数据线程池中执行阻塞函数"""
+        loop = asyncio.get_running_loop()
+        with EXECUTOR_BUSY.labels('info').track_inprogress():
+            return await loop.run_in_executor(self.info_executor, fn)
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            if job.cancelled:
+                self._queue.task_done()
+                continue
+            if not self.limiter.try_acquire(job.site):
+                # 站点冷却中或并发已满：到点后再放回队列（保留原排序），worker 继续处理其他任务
+                delay = self.limiter.wait_time(job.site)
+                if self.limiter.is_saturated(job.site):
+                    delay = max(delay, 1.0)
+                self._defer(job, delay)
+                self._queue.task_done()
+                continue
+            self._pending.pop(job.task_id, None)
+            self._running[job.task_id] = job
+            self._started[job.task_id] = datetime.now()
+            # 排队等待（含站点限流延后的时间）
+            PHASE_SECONDS.labels('queue').observe(
+                (self._started[job.task_id] - job.enqueued_at).total_seconds()
+            )
+            try:
+                await self._runner(job.task_id, **job.kwargs)
+            except Exception as e:
+                logger.error(f"调度任务异常 [{job.task_id}]: {e}")
+            finally:
+                self.limiter.release(job.site)
+                self.cancel_flags.pop(job.task_id, None)
+                self._running.pop(job.task_id, None)
+                self._started.pop(job.task_id, None)
+                self._queue.task_done()
+
+    def retry_later(self, task_id: str, delay: float) -> bool:
+        """在任务执行过程中调用：delay 秒后以相同参数和优先级重新入队"""
+        job = self._running.get(task_id)
+        if job is None:
+            return False
+        loop = asyncio.get_running_loop()
+
+        def resubmit():
+            self._retrying.pop(task_id, None)
+            self.submit(task_id, priority=job.priority, **job.kwargs)
+
+        self._retrying[task_id] = loop.call_later(delay, resubmit)
+        return True
+
+    def cancel(self, task_id: str, mode: str = 'cancel') -> Optional[str]:
+        """
+        取消/暂停任务，返回任务原来所处的阶段：
+        - queued / retrying: 直接移出队列
+        - running: 设置取消标记。取消是协作式的，不会立即生效：在下载进度回调、频道条目之间、
+          后处理开始前检查标记后中断，元数据解析、yt-dlp 请求间隔、进行中的 ffmpeg 后处理要等其结束
+        - None: 调度器中没有该任务
+        """
+        if task_id in self._running:
+            self.cancel_flags[task_id] = mode
+            return 'running'
+        job = self._pending.pop(task_id, None)
+        if job is not None:
+            job.cancelled = True
+            handle = self._deferred.pop(task_id, None)
+            if handle:
+                handle.cancel()
+            return 'queued'
+        handle = self._retrying.pop(task_id, None)
+        if handle is not None:
+            handle.cancel()
+            return 'retrying'
+        return None
+
+    def _defer(self, job: QueuedJob, delay: float):
+        loop = asyncio.get_running_loop()
+
+        def requeue():
+            self._deferred.pop(job.task_id, None)
+            self._queue.put_nowait(job)
+
+        self._deferred[job.task_id] = loop.call_later(max(delay, 0.05), requeue)
+
+    def counts(self) -> Dict[str, int]:
+        """排队/运行/等待重试的任务数（供监控指标读取）"""
+        return {
+            'queued': len(self._pending),
+            'running': len(self._running),
+            'retrying': len(self._retrying),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """队列快照（供 API 展示）"""
+        queued = sorted(self._pending.values())
+        return {
+            'max_concurrent': self.max_concurrent,
+            'running': [
+                {'task_id': tid, 'started_at': started.isoformat()}
+                for tid, started in self._started.items()
+            ],
+            'retrying': list(self._retrying),
+            'queued': [
+                {
+                    'task_id': job.task_id,
+                    'position': i + 1,
+                    'priority': job.priority,
+                    'site': job.site,
+                    'waiting_rate_limit': job.task_id in self._deferred,
+                    'enqueued_at': job.enqueued_at.isoformat(),
+                }
+                for i, job in enumerate(queued)
+            ],
+        }
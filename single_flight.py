@@ -0,0 +1,99 @@
+"""
+重复下载合并（single-flight）
+
+同一视频（提取器 + 视频 ID + 下载参数相同）已经在下载时，新任务不再启动第二次
+yt-dlp 下载，而是作为跟随任务挂到领头任务上：进度与结果从领头任务同步过去。
+领头任务被取消/暂停/删除时，由第一个跟随任务接手继续下载（暂停时可断点续传）。
+
+所有方法只在事件循环线程中调用，不加锁。
+"""
+import logging
+from functools import lru_cache
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# 不影响下载内容的参数
+_IGNORED_OPTIONS = ('priority', 'connections')
+
+
+@lru_cache(maxsize=1024)
+def extractor_id(url: str) -> Tuple[str, str]:
+    """按 yt-dlp 提取器的 URL 规则识别（提取器, 视频 ID），不发网络请求"""
+    import yt_dlp
+    for ie in yt_dlp.extractor.gen_extractor_classes():
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            if video_id:
+                return ie.ie_key(), video_id
+            break
+    # 识别不出 ID（通用提取器）：使用规范化后的 URL
+    parsed = urlparse(url.strip())
+    return 'url', f"{(parsed.hostname or '').lower()}{parsed.path.rstrip('/')}?{parsed.query}"
+
+
+def download_key(url: str, options: Optional[Dict[str, Any]] = None) -> Tuple[Hashable, ...]:
+    """合并键：(提取器, 视频 ID, 下载参数)"""
+    extractor, video_id = extractor_id(url)
+    variant = tuple(sorted(
+        (k, v) for k, v in (options or {}).items() if k not in _IGNORED_OPTIONS
+    ))
+    return extractor, video_id, variant
+
+
+class SingleFlight:
+    """进行中的下载：合并键 -> 领头任务，领头任务 -> 跟随任务"""
+
+    def __init__(self):
+        self._leaders: Dict[Tuple, str] = {}
+        self._keys: Dict[str, Tuple] = {}
+        self._followers: Dict[str, List[str]] = {}
+
+    def attach(self, key: Tuple, task_id: str) -> Optional[str]:
+        """同一下载进行中则挂为跟随任务并返回领头任务 ID，否则登记为领头任务返回 None"""
+        leader = self._leaders.get(key)
+        if leader is not None and leader != task_id:
+            followers = self._followers.setdefault(leader, [])
+            if task_id not in followers:
+                followers.append(task_id)
+            logger.info(f"任务 {task_id} 与进行中的任务 {leader} 下载相同内容，合并")
+            return leader
+        self._leaders[key] = task_id
+        self._keys[task_id] = key
+        return None
+
+    def followers(self, leader_id: str) -> List[str]:
+        return list(self._followers.get(leader_id, ()))
+
+    def detach(self, task_id: str):
+        """跟随任务被取消/删除"""
+        for followers in self._followers.values():
+            if task_id in followers:
+                followers.remove(task_id)
+                return
+
+    def finish(self, leader_id: str):
+        """领头任务结束（完成/最终失败）"""
+        key = self._keys.pop(leader_id, None)
+        if key is not None and self._leaders.get(key) == leader_id:
+            del self._leaders[key]
+        self._followers.pop(leader_id, None)
+
+    def promote(self, leader_id: str) -> Optional[str]:
+        """领头任务被中断：第一个跟随任务成为新的领头任务，返回其 ID"""
+        key = self._keys.get(leader_id)
+        followers = self._followers.get(leader_id) or []
+        if key is None or not followers:
+            self.finish(leader_id)
+            return None
+        new_leader, rest = followers[0], followers[1:]
+        self.finish(leader_id)
+        self._leaders[key] = new_leader
+        self._keys[new_leader] = key
+        if rest:
+            self._followers[new_leader] = rest
+        return new_leader
+
+    def snapshot(self) -> Dict[str, List[str]]:
+        return {leader: list(f) for leader, f in self._followers.items() if f}
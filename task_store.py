@@ -0,0 +1,584 @@
+"""
+任务存储 - 可插拔后端
+
+- memory: 进程内字典（默认，重启丢失）
+- sqlite: 本地 SQLite 文件（WAL 模式，可多进程共享同一文件）
+- redis:  Redis（多进程/多机共享）
+
+各后端都维护 status / created_at 二级索引，列表查询无需全量扫描排序。
+分页使用不透明游标（created_at + id），单页代价 O(log n + page)。
+
+memory 后端按保留策略（数量/时间/各状态上限）把最近最少访问的已结束任务
+淘汰到归档库（SQLite），长期运行内存不再随任务数增长。
+"""
+import os
+import time
+import base64
+import sqlite3
+import itertools
+import threading
+import logging
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models import DownloadTask, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+TASK_STORE = os.getenv('TASK_STORE', 'memory')           # memory / sqlite / redis
+TASK_DB_PATH = os.getenv('TASK_DB_PATH', './tasks.db')   # sqlite 文件路径
+TASK_DB_SCHEMA_VERSION = 1                               # SQLite 表结构版本（变化时重新统计 task_counts）
+TASK_REDIS_PREFIX = os.getenv('TASK_REDIS_PREFIX', 'vd:task')
+
+# 已结束任务保留策略（memory 后端）
+TASK_RETENTION_MAX = int(os.getenv('TASK_RETENTION_MAX', '1000'))         # 内存中最多保留的已结束任务数
+TASK_RETENTION_DAYS = float(os.getenv('TASK_RETENTION_DAYS', '7'))        # 已结束任务最长保留天数
+TASK_RETENTION_PER_STATUS = os.getenv('TASK_RETENTION_PER_STATUS', '')    # 各状态上限，如 failed=200,cancelled=50
+TASK_ARCHIVE_PATH = os.getenv('TASK_ARCHIVE_PATH', './tasks_archive.db')  # 淘汰任务归档库，留空则直接丢弃
+RETENTION_SWEEP_INTERVAL = 60   # 按时间淘汰的检查间隔（秒）
+REDIS_DELETE_CHUNK = 500        # Redis 批量删除时每个 pipeline 的任务数
+
+# 已结束（不会再变化）的状态
+FINISHED_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED)
+
+# 分页结果: (总数, 当前页, 下一页游标)
+TaskPage = Tuple[int, List[DownloadTask], Optional[str]]
+
+
+def encode_cursor(created_ts: float, task_id: str) -> str:
+    """生成分页游标（指向当前页最后一条）"""
+    raw = f"{created_ts!r}:{task_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """解析分页游标，格式错误抛 ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        ts, task_id = base64.urlsafe_b64decode(padded).decode().split(':', 1)
+        return float(ts), task_id
+    except Exception:
+        raise ValueError(f"无效的游标: {cursor}")
+
+
+class TaskStore:
+    """任务存储接口"""
+
+    def add(self, task: DownloadTask):
+        raise NotImplementedError
+
+    def get(self, task_id: str) -> Optional[DownloadTask]:
+        raise NotImplementedError
+
+    def update(self, task_id: str, **fields) -> Optional[DownloadTask]:
+        """更新字段，任务不存在时返回 None"""
+        raise NotImplementedError
+
+    def update_many(self, updates: Dict[str, Dict]) -> Dict[str, DownloadTask]:
+        """批量更新 {task_id: fields}，返回实际存在并已更新的任务"""
+        result = {}
+        for task_id, fields in updates.items():
+            task = self.update(task_id, **fields)
+            if task is not None:
+                result[task_id] = task
+        return result
+
+    def delete(self, task_id: str) -> bool:
+        raise NotImplementedError
+
+    def list(self,
+             status: Optional[TaskStatus] = None,
+             limit: int = 50,
+             offset: int = 0,
+             cursor: Optional[str] = None) -> TaskPage:
+        """
+        按 created_at 倒序分页，返回 (总数, 当前页, 下一页游标)
+        传入 cursor 时忽略 offset，从游标之后继续
+        """
+        raise NotImplementedError
+
+    def delete_by_status(self, statuses: Iterable[TaskStatus]) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+
+    # 淘汰任务的归档库（只有 memory 后端使用）
+    archive: Optional['TaskStore'] = None
+
+
+def parse_status_limits(spec: str) -> Dict[TaskStatus, int]:
+    """解析 'failed=200,cancelled=50'"""
+    limits = {}
+    for item in filter(None, (p.strip() for p in spec.split(','))):
+        name, _, value = item.partition('=')
+        try:
+            limits[TaskStatus(name.strip())] = int(value)
+        except ValueError:
+            logger.warning(f"忽略无效的保留策略: {item}")
+    return limits
+
+
+@dataclass
+class RetentionPolicy:
+    """已结束任务的保留策略（<= 0 表示不限制）"""
+    max_count: int = TASK_RETENTION_MAX
+    max_age: float = TASK_RETENTION_DAYS * 86400
+    per_status: Dict[TaskStatus, int] = field(
+        default_factory=lambda: parse_status_limits(TASK_RETENTION_PER_STATUS)
+    )
+
+
+_TASK_FIELDS = tuple(DownloadTask.model_fields)
+
+
+class _TaskRecord:
+    """
+    内存中的任务记录：__slots__ 紧凑存储，没有 Pydantic 的 __dict__ / fields_set 开销。
+    只在读取（API 边界）时转换为 DownloadTask。
+    """
+    __slots__ = _TASK_FIELDS
+
+    @classmethod
+    def from_task(cls, task: DownloadTask) -> '_TaskRecord':
+        record = cls.__new__(cls)
+        for name in _TASK_FIELDS:
+            setattr(record, name, getattr(task, name))
+        return record
+
+    def to_task(self) -> DownloadTask:
+        data = {name: getattr(self, name) for name in _TASK_FIELDS}
+        # 可变字段复制一份，调用方修改返回值不会影响存储
+        data['attempts'] = list(data['attempts'])
+        data['options'] = dict(data['options'])
+        return DownloadTask.model_construct(**data)
+
+
+class MemoryTaskStore(TaskStore):
+    """
+    内存存储
+    - 任务以紧凑记录保存，读取时才生成 DownloadTask
+    - 每个状态（以及全部任务）维护一个按 (created_at, id) 升序的有序索引
+    - 总数即索引长度，随增删增量维护
+    - 已结束任务按访问顺序（LRU）记录，超出保留策略时淘汰到 archive
+    """
+
+    def __init__(self,
+                 retention: Optional[RetentionPolicy] = None,
+                 archive: Optional[TaskStore] = None):
+        self._lock = threading.RLock()
+        self._tasks: Dict[str, _TaskRecord] = {}
+        self._index: Dict[Optional[TaskStatus], List[Tuple[float, str]]] = {None: []}
+        for s in TaskStatus:
+            self._index[s] = []
+        self.retention = retention
+        self.archive = archive
+        # 各已结束状态的 LRU：task_id -> 最近访问序号
+        self._finished: Dict[TaskStatus, OrderedDict] = {s: OrderedDict() for s in FINISHED_STATUSES}
+        self._tick = itertools.count()
+        self._last_sweep = time.time()
+
+    @staticmethod
+    def _sort_key(task) -> Tuple[float, str]:
+        return task.created_at.timestamp(), task.id
+
+    def _touch(self, record: _TaskRecord):
+        lru = self._finished.get(record.status)
+        if lru is not None:
+            lru[record.id] = next(self._tick)
+            lru.move_to_end(record.id)
+
+    def _untrack(self, task_id: str, status: TaskStatus):
+        lru = self._finished.get(status)
+        if lru is not None:
+            lru.pop(task_id, None)
+
+    def _index_remove(self, status: Optional[TaskStatus], key: Tuple[float, str]):
+        idx = self._index[status]
+        i = bisect_left(idx, key)
+        if i < len(idx) and idx[i] == key:
+            del idx[i]
+
+    def add(self, task: DownloadTask):
+        with self._lock:
+            if task.id in self._tasks:
+                self.delete(task.id)
+            record = _TaskRecord.from_task(task)
+            key = self._sort_key(record)
+            self._tasks[task.id] = record
+            insort(self._index[None], key)
+            insort(self._index[record.status], key)
+            self._touch(record)
+            self._enforce_retention()
+
+    def get(self, task_id: str) -> Optional[DownloadTask]:
+        with self._lock:
+            record = self._tasks.get(task_id)
+            if record is None:
+                return None
+            self._touch(record)
+            return record.to_task()
+
+    def update(self, task_id: str, **fields) -> Optional[DownloadTask]:
+        with self._lock:
+            record = self._tasks.get(task_id)
+            if record is None:
+                return None
+            old_status = record.status
+            for key, value in fields.items():
+                setattr(record, key, value)
+            if record.status != old_status:
+                key = self._sort_key(record)
+                self._index_remove(old_status, key)
+                insort(self._index[record.status], key)
+                self._untrack(task_id, old_status)
+            self._touch(record)
+            task = record.to_task()
+            if record.status != old_status:
+                self._enforce_retention()
+            return task
+
+    def delete(self, task_id: str) -> bool:
+        with self._lock:
+            record = self._tasks.pop(task_id, None)
+            if record is None:
+                return False
+            key = self._sort_key(record)
+            self._index_remove(None, key)
+            self._index_remove(record.status, key)
+            self._untrack(task_id, record.status)
+            return True
+
+    # ==================== 保留策略 ====================
+
+    def _enforce_retention(self):
+        """淘汰超龄、超出各状态上限、超出总数的已结束任务（调用方持有锁）"""
+        policy = self.retention
+        if policy is None:
+            return
+
+        now = time.time()
+        if policy.max_age > 0 and now - self._last_sweep >= RETENTION_SWEEP_INTERVAL:
+            self._last_sweep = now
+            cutoff = now - policy.max_age
+            expired = [
+                tid for lru in self._finished.values() for tid in lru
+                if (self._tasks[tid].completed_at or self._tasks[tid].created_at).timestamp() < cutoff
+            ]
+            for tid in expired:
+                self._evict(tid)
+
+        for status, limit in policy.per_status.items():
+            lru = self._finished.get(status)
+            while lru and limit > 0 and len(lru) > limit:
+                self._evict(next(iter(lru)))
+
+        if policy.max_count > 0:
+            excess = sum(len(lru) for lru in self._finished.values()) - policy.max_count
+            for _ in range(max(excess, 0)):
+                # 各状态 LRU 队首中最久未访问的一个
+                oldest = min((lru for lru in self._finished.values() if lru),
+                             key=lambda lru: next(iter(lru.values())))
+                self._evict(next(iter(oldest)))
+
+    def _evict(self, task_id: str):
+        record = self._tasks.get(task_id)
+        if record is None:
+            return
+        task = record.to_task()
+        self.delete(task_id)
+        if self.archive is not None:
+            try:
+                self.archive.delete(task_id)
+                self.archive.add(task)
+            except Exception as e:
+                logger.warning(f"任务归档失败 [{task_id}]: {e}")
+
+    def list(self, status=None, limit=50, offset=0, cursor=None):
+        with self._lock:
+            idx = self._index[status]
+            total = len(idx)
+            if cursor:
+                end = bisect_left(idx, decode_cursor(cursor))
+            else:
+                end = max(total - offset, 0)
+            start = max(end - limit, 0)
+            keys = idx[start:end]
+            keys.reverse()
+            page = [self._tasks[tid].to_task() for _, tid in keys]
+            next_cursor = encode_cursor(*keys[-1]) if keys and start > 0 else None
+            return total, page, next_cursor
+
+    def delete_by_status(self, statuses):
+        with self._lock:
+            to_delete = [tid for s in statuses for _, tid in self._index[s]]
+            for tid in to_delete:
+                self.delete(tid)
+            return len(to_delete)
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    SQLite 存储
+    - 任务序列化为 JSON，status/created_at 单独成列并建 (status, created_at, id) 索引
+    - task_counts 表由触发器维护各状态数量，总数查询不扫描
+    """
+
+    def __init__(self, path: str = TASK_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        has_counts = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'task_counts'"
+        ).fetchone() is not None
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_created_id ON tasks (created_at, id);
+            CREATE INDEX IF NOT EXISTS idx_tasks_status_created_id ON tasks (status, created_at, id);
+
+            CREATE TABLE IF NOT EXISTS task_counts (
+                status TEXT PRIMARY KEY,
+                n INTEGER NOT NULL
+            );
+            CREATE TRIGGER IF NOT EXISTS trg_tasks_insert AFTER INSERT ON tasks BEGIN
+                INSERT INTO task_counts (status, n) VALUES (NEW.status, 1)
+                    ON CONFLICT(status) DO UPDATE SET n = n + 1;
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_tasks_delete AFTER DELETE ON tasks BEGIN
+                UPDATE task_counts SET n = n - 1 WHERE status = OLD.status;
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_tasks_status AFTER UPDATE OF status ON tasks
+            WHEN OLD.status != NEW.status BEGIN
+                UPDATE task_counts SET n = n - 1 WHERE status = OLD.status;
+                INSERT INTO task_counts (status, n) VALUES (NEW.status, 1)
+                    ON CONFLICT(status) DO UPDATE SET n = n + 1;
+            END;
+        """)
+        # 计数表刚创建（旧库已有任务）或表结构版本变化时才全表统计一次，之后由触发器维护
+        if not has_counts or version != TASK_DB_SCHEMA_VERSION:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM task_counts')
+            conn.execute('INSERT INTO task_counts SELECT status, COUNT(*) FROM tasks GROUP BY status')
+            conn.execute(f'PRAGMA user_version = {TASK_DB_SCHEMA_VERSION}')
+            conn.execute('COMMIT')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, task: DownloadTask):
+        self._conn().execute(
+            'INSERT INTO tasks (id, status, created_at, data) VALUES (?, ?, ?, ?)',
+            (task.id, task.status.value, task.created_at.timestamp(), task.model_dump_json())
+        )
+
+    def get(self, task_id: str) -> Optional[DownloadTask]:
+        row = self._conn().execute('SELECT data FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        return DownloadTask.model_validate_json(row[0]) if row else None
+
+    def update(self, task_id: str, **fields) -> Optional[DownloadTask]:
+        return self.update_many({task_id: fields}).get(task_id)
+
+    def update_many(self, updates: Dict[str, Dict]) -> Dict[str, DownloadTask]:
+        """所有更新在同一事务内完成"""
+        conn = self._conn()
+        result = {}
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for task_id, fields in updates.items():
+                row = conn.execute('SELECT data FROM tasks WHERE id = ?', (task_id,)).fetchone()
+                if row is None:
+                    continue
+                task = DownloadTask.model_validate_json(row[0]).model_copy(update=fields)
+                conn.execute(
+                    'UPDATE tasks SET status = ?, data = ? WHERE id = ?',
+                    (TaskStatus(task.status).value, task.model_dump_json(), task_id)
+                )
+                result[task_id] = task
+            conn.execute('COMMIT')
+            return result
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, task_id: str) -> bool:
+        cur = self._conn().execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+        return cur.rowcount > 0
+
+    def list(self, status=None, limit=50, offset=0, cursor=None):
+        conn = self._conn()
+        where, params = [], []
+        if status:
+            where.append('status = ?')
+            params.append(status.value)
+            total = conn.execute(
+                'SELECT n FROM task_counts WHERE status = ?', (status.value,)
+            ).fetchone()
+            total = total[0] if total else 0
+        else:
+            total = conn.execute('SELECT COALESCE(SUM(n), 0) FROM task_counts').fetchone()[0]
+        if cursor:
+            where.append('(created_at, id) < (?, ?)')
+            params.extend(decode_cursor(cursor))
+            offset = 0
+
+        sql = 'SELECT created_at, id, data FROM tasks'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?'
+        # 多取一条判断是否还有下一页
+        rows = conn.execute(sql, (*params, limit + 1, offset)).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][0], rows[-1][1])
+        return total, [DownloadTask.model_validate_json(r[2]) for r in rows], next_cursor
+
+    def delete_by_status(self, statuses):
+        values = [TaskStatus(s).value for s in statuses]
+        placeholders = ','.join('?' * len(values))
+        cur = self._conn().execute(f'DELETE FROM tasks WHERE status IN ({placeholders})', values)
+        return cur.rowcount
+
+
+class RedisTaskStore(TaskStore):
+    """
+    Redis 存储
+    - {prefix}:{id}              任务 JSON
+    - {prefix}:idx:all           ZSET，score = created_at
+    - {prefix}:idx:{status}      ZSET，score = created_at
+    """
+
+    def __init__(self, prefix: str = TASK_REDIS_PREFIX):
+        from cache import get_redis
+        self.prefix = prefix
+        self._redis = get_redis
+
+    def _key(self, task_id: str) -> str:
+        return f"{self.prefix}:{task_id}"
+
+    def _idx(self, status: Optional[TaskStatus] = None) -> str:
+        return f"{self.prefix}:idx:{TaskStatus(status).value if status else 'all'}"
+
+    def add(self, task: DownloadTask):
+        score = task.created_at.timestamp()
+        pipe = self._redis().pipeline()
+        pipe.set(self._key(task.id), task.model_dump_json())
+        pipe.zadd(self._idx(), {task.id: score})
+        pipe.zadd(self._idx(task.status), {task.id: score})
+        pipe.execute()
+
+    def get(self, task_id: str) -> Optional[DownloadTask]:
+        data = self._redis().get(self._key(task_id))
+        return DownloadTask.model_validate_json(data) if data else None
+
+    def update(self, task_id: str, **fields) -> Optional[DownloadTask]:
+        import redis
+        r = self._redis()
+        key = self._key(task_id)
+        with r.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    data = pipe.get(key)
+                    if not data:
+                        pipe.unwatch()
+                        return None
+                    old = DownloadTask.model_validate_json(data)
+                    task = old.model_copy(update=fields)
+                    pipe.multi()
+                    pipe.set(key, task.model_dump_json())
+                    if task.status != old.status:
+                        score = task.created_at.timestamp()
+                        pipe.zrem(self._idx(old.status), task_id)
+                        pipe.zadd(self._idx(task.status), {task_id: score})
+                    pipe.execute()
+                    return task
+                except redis.WatchError:
+                    continue
+
+    def delete(self, task_id: str) -> bool:
+        task = self.get(task_id)
+        if task is None:
+            return False
+        pipe = self._redis().pipeline()
+        pipe.delete(self._key(task_id))
+        pipe.zrem(self._idx(), task_id)
+        pipe.zrem(self._idx(task.status), task_id)
+        pipe.execute()
+        return True
+
+    def list(self, status=None, limit=50, offset=0, cursor=None):
+        r = self._redis()
+        idx = self._idx(status)
+        total = r.zcard(idx)
+        if cursor:
+            ts, last_id = decode_cursor(cursor)
+            rank = r.zrevrank(idx, last_id)
+            if rank is None:
+                # 游标对应任务已删除，按 (分数, ID) 定位：与游标同一时间创建、ID 更小的任务仍在之后
+                # （分数相同的成员按 ID 倒序排列，与 SQLite 的 created_at DESC, id DESC 一致）
+                ties = r.zcount(idx, ts, ts)
+                rows = r.zrevrangebyscore(idx, ts, '-inf', start=0, num=ties + limit + 1, withscores=True)
+                ids = [tid for tid, score in rows if score < ts or tid < last_id]
+                has_more = len(ids) > limit
+                ids = ids[:limit]
+            else:
+                ids = r.zrevrange(idx, rank + 1, rank + limit)
+                has_more = rank + 1 + len(ids) < total
+        else:
+            ids = r.zrevrange(idx, offset, offset + limit - 1)
+            has_more = offset + len(ids) < total
+        if not ids:
+            return total, [], None
+        rows = r.mget([self._key(tid) for tid in ids])
+        page = [DownloadTask.model_validate_json(d) for d in rows if d]
+        next_cursor = None
+        if has_more and page:
+            next_cursor = encode_cursor(page[-1].created_at.timestamp(), page[-1].id)
+        return total, page, next_cursor
+
+    def delete_by_status(self, statuses):
+        r = self._redis()
+        count = 0
+        for status in statuses:
+            idx = self._idx(status)
+            task_ids = r.zrange(idx, 0, -1)
+            # 每批一次往返：删除任务 JSON，并从总索引和状态索引中移除
+            for i in range(0, len(task_ids), REDIS_DELETE_CHUNK):
+                chunk = task_ids[i:i + REDIS_DELETE_CHUNK]
+                pipe = r.pipeline()
+                pipe.delete(*(self._key(tid) for tid in chunk))
+                pipe.zrem(self._idx(), *chunk)
+                pipe.zrem(idx, *chunk)
+                count += pipe.execute()[0]
+        return count
+
+
+def create_task_store(backend: str = TASK_STORE) -> TaskStore:
+    """按配置创建任务存储"""
+    if backend == 'sqlite':
+        logger.info(f"任务存储: SQLite ({os.path.abspath(TASK_DB_PATH)})")
+        return SQLiteTaskStore(TASK_DB_PATH)
+    if backend == 'redis':
+        logger.info("任务存储: Redis")
+        return RedisTaskStore()
+    archive = None
+    if TASK_ARCHIVE_PATH:
+        logger.info(f"已结束任务归档: {os.path.abspath(TASK_ARCHIVE_PATH)}")
+        archive = SQLiteTaskStore(TASK_ARCHIVE_PATH)
+    return MemoryTaskStore(RetentionPolicy(), archive)
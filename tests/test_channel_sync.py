@@ -0,0 +1,136 @@
+"""
+频道增量同步测试：列表按页惰性请求，凑够 max_videos 或遇到高水位后不再请求后面的页
+
+运行: python -m unittest discover tests
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp  # noqa: E402
+from yt_dlp.extractor.common import InfoExtractor  # noqa: E402
+from yt_dlp.utils import OnDemandPagedList  # noqa: E402
+
+import downloader  # noqa: E402
+from downloader import UrlType, VideoDownloader  # noqa: E402
+from rate_limiter import SiteRateLimiter, site_key  # noqa: E402
+
+PAGE_SIZE = 30
+CHANNEL_URL = 'https://fake.example/@chan/videos'
+
+
+class FakeChannelIE(InfoExtractor):
+    """按页返回视频的频道（最新在前），记录请求过的页"""
+    _VALID_URL = r'https://fake\.example/@(?P<id>\w+)/videos'
+    videos = []
+    pages = []
+
+    def _real_extract(self, url):
+        def fetch_page(page):
+            FakeChannelIE.pages.append(page)
+            for video_id in FakeChannelIE.videos[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]:
+                yield self.url_result(f'https://www.youtube.com/watch?v={video_id}', 'Youtube', video_id)
+        return self.playlist_result(OnDemandPagedList(fetch_page, PAGE_SIZE), self._match_id(url))
+
+
+@contextmanager
+def fake_acquire(profile, opts):
+    ydl = yt_dlp.YoutubeDL({k: v for k, v in opts.items() if k != 'logger'}, auto_init=False)
+    ydl.add_info_extractor(FakeChannelIE())
+    yield ydl
+
+
+def fake_download_single_video(self, url, progress_callback, format_preference, error_log=None,
+                               timer=None, ie_key=None, **kwargs):
+    video_id = url.rsplit('=', 1)[1]
+    self._save_downloaded_id({'id': video_id, 'extractor_key': 'Youtube'}, f'/videos/{video_id}')
+    return {'success': True, 'title': video_id}
+
+
+class ChannelSyncPagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        FakeChannelIE.videos = [f'v{i:010d}' for i in range(3 * PAGE_SIZE)]
+        FakeChannelIE.pages = []
+        patches = [
+            mock.patch.object(downloader.ydl_pool, 'acquire', fake_acquire),
+            mock.patch.object(VideoDownloader, '_download_single_video', fake_download_single_video),
+            mock.patch.object(downloader.rate_limiter, 'try_acquire', lambda site: True),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.downloader = VideoDownloader(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def sync(self, max_videos):
+        FakeChannelIE.pages = []
+        result = self.downloader._download_channel_with_dedup(
+            CHANNEL_URL, UrlType.CHANNEL, max_videos, 'newest', None, 'best')
+        return [v['id'] for v in result['videos']]
+
+    def mark(self):
+        state = self.downloader.registry.get_sync_state(CHANNEL_URL)
+        return state and state['head'][0]
+
+    def test_first_sync_stops_paging_at_max_videos(self):
+        got = self.sync(5)
+        self.assertEqual(got, FakeChannelIE.videos[:5])
+        self.assertEqual(FakeChannelIE.pages, [0])
+        # 只检查了一部分，没有高水位（下次继续回补更早的视频）
+        self.assertIsNone(self.mark())
+
+    def test_backfill_then_incremental_check_fetches_one_page(self):
+        videos = list(FakeChannelIE.videos)
+        self.assertEqual(self.sync(40), videos[:40])
+        self.assertEqual(FakeChannelIE.pages, [0, 1])
+        self.assertIsNone(self.mark())
+
+        self.assertEqual(self.sync(40), videos[40:80])
+        self.assertIsNone(self.mark())
+
+        # 剩下的补完、列表到底，高水位设为列表头部
+        self.assertEqual(self.sync(40), videos[80:])
+        self.assertEqual(self.mark(), videos[0])
+
+        # 新上传两个：只请求第一页，遇到高水位即停止
+        FakeChannelIE.videos[:0] = ['n0000000001', 'n0000000002']
+        self.assertEqual(self.sync(40), ['n0000000001', 'n0000000002'])
+        self.assertEqual(FakeChannelIE.pages, [0])
+        self.assertEqual(self.mark(), 'n0000000001')
+
+        # 没有新视频：同样只请求第一页
+        self.assertEqual(self.sync(40), [])
+        self.assertEqual(FakeChannelIE.pages, [0])
+
+    def test_entries_take_site_slots_and_wait_for_tokens(self):
+        limiter = SiteRateLimiter(interval=0.05, burst=1, concurrency=2,
+                                  state_file=os.path.join(self.dir, 'rate.json'))
+        acquired = []
+        try_acquire = limiter.try_acquire
+
+        def counting_try_acquire(site):
+            ok = try_acquire(site)
+            acquired.append(ok)
+            return ok
+
+        with mock.patch.object(downloader, 'rate_limiter', limiter), \
+                mock.patch.object(limiter, 'try_acquire', counting_try_acquire):
+            self.assertEqual(self.sync(5), FakeChannelIE.videos[:5])
+        # 第一个视频用任务自己的名额，其余 4 个各占一个；令牌不足时没有占用，等令牌后重试
+        self.assertEqual(acquired.count(True), 4)
+        self.assertIn(False, acquired)
+        self.assertEqual(limiter.snapshot()[site_key(CHANNEL_URL)]['running'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
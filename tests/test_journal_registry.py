@@ -0,0 +1,59 @@
+"""
+journal 登记表测试：按 (提取器, ID) 记录和匹配，没有提取器的旧记录匹配任意提取器
+
+运行: python -m unittest discover tests
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedup import JOURNAL_FILE, SNAPSHOT_FILE, JournalRegistry  # noqa: E402
+
+
+class JournalRegistryExtractorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_same_id_from_another_extractor_is_not_known(self):
+        registry = JournalRegistry(self.dir)
+        registry.add('abc', extractor='Youtube')
+        self.assertEqual(registry.known('Youtube', ['abc']), {'abc'})
+        self.assertEqual(registry.known('Vimeo', ['abc']), set())
+        self.assertIn('abc', registry)
+        self.assertTrue(registry.claim('abc', 'Vimeo', 'w1'))
+        self.assertFalse(registry.claim('abc', 'Youtube', 'w1'))
+
+        # 其他进程（重新加载日志、合并进快照后）看到的相同
+        for reopened in (JournalRegistry(self.dir), self._compacted()):
+            self.assertEqual(reopened.known('Vimeo', ['abc']), set())
+            self.assertEqual(reopened.known('Youtube', ['abc']), {'abc'})
+
+    def test_legacy_rows_without_extractor_match_anything(self):
+        with open(os.path.join(self.dir, SNAPSHOT_FILE), 'w') as f:
+            json.dump({'video_ids': ['old1']}, f)
+        with open(os.path.join(self.dir, JOURNAL_FILE), 'w') as f:
+            f.write('old2\n')
+        registry = JournalRegistry(self.dir)
+        self.assertEqual(registry.known('Vimeo', ['old1', 'old2', 'new']), {'old1', 'old2'})
+        self.assertFalse(registry.claim('old2', 'Youtube', 'w1'))
+
+        registry.compact()
+        self.assertEqual(JournalRegistry(self.dir).known('Vimeo', ['old1', 'old2']), {'old1', 'old2'})
+
+    def _compacted(self) -> JournalRegistry:
+        registry = JournalRegistry(self.dir)
+        registry.compact()
+        return JournalRegistry(self.dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+ydl_pool 复用测试：借出的实例不能带着上一个任务的回调和参数
+
+运行: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ydl_pool  # noqa: E402
+from ydl_pool import YdlPool  # noqa: E402
+
+BASE_OPTS = {
+    'quiet': True,
+    'outtmpl': '%(id)s.%(ext)s',
+    'postprocessors': [{'key': 'FFmpegThumbnailsConvertor', 'format': 'jpg'}],
+}
+
+
+def _hook(d):
+    pass
+
+
+def _pp_hook(d):
+    pass
+
+
+class YdlPoolReuseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = YdlPool(size=2)
+
+    def tearDown(self):
+        self.pool.clear()
+
+    def test_reused_instance_drops_previous_task_state(self):
+        first_opts = {
+            **BASE_OPTS,
+            'outtmpl': '/tmp/first/%(title)s.%(ext)s',
+            'progress_hooks': [_hook],
+            'postprocessor_hooks': [_pp_hook],
+            'ratelimit': 1024,
+            'playlistend': 3,
+        }
+        with self.pool.acquire('download', first_opts) as ydl:
+            first = ydl
+            self.assertIn(_hook, ydl._progress_hooks)
+            self.assertIn(_pp_hook, ydl._postprocessor_hooks)
+            self.assertEqual(ydl.params['ratelimit'], 1024)
+            ydl._num_downloads = 5
+            ydl._playlist_urls.add('https://example.com/list')
+
+        with self.pool.acquire('download', BASE_OPTS) as ydl:
+            self.assertIs(ydl, first)
+            self.assertEqual(ydl._progress_hooks, [])
+            self.assertEqual(ydl._postprocessor_hooks, [])
+            for pps in ydl._pps.values():
+                for pp in pps:
+                    self.assertNotIn(_pp_hook, pp._progress_hooks)
+            self.assertNotIn('ratelimit', ydl.params)
+            self.assertNotIn('playlistend', ydl.params)
+            self.assertEqual(ydl.params['outtmpl']['default'], '%(id)s.%(ext)s')
+            self.assertEqual(ydl._num_downloads, 0)
+            self.assertEqual(ydl._playlist_urls, set())
+
+        self.assertEqual(self.pool.snapshot()['reused'], 1)
+
+    def test_idle_instance_holds_no_callbacks(self):
+        with self.pool.acquire('download', {**BASE_OPTS, 'progress_hooks': [_hook]}) as ydl:
+            pass
+        self.assertEqual(ydl._progress_hooks, [])
+
+    def test_failed_call_discards_instance(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.acquire('download', BASE_OPTS) as ydl:
+                first = ydl
+                raise RuntimeError('boom')
+        with self.pool.acquire('download', BASE_OPTS) as ydl:
+            self.assertIsNot(ydl, first)
+
+    def test_missing_private_attribute_falls_back_to_fresh_instances(self):
+        attrs = ydl_pool._PRIVATE_ATTRS + ('_attribute_removed_upstream',)
+        with mock.patch.object(ydl_pool, '_PRIVATE_ATTRS', attrs):
+            with self.pool.acquire('download', {**BASE_OPTS, 'progress_hooks': [_hook]}) as ydl:
+                first = ydl
+                self.assertIn(_hook, ydl._progress_hooks)
+            with self.pool.acquire('download', BASE_OPTS) as ydl:
+                self.assertIsNot(ydl, first)
+                self.assertNotIn(_hook, ydl._progress_hooks)
+        self.assertFalse(self.pool.enabled)
+        self.assertEqual(self.pool.snapshot()['idle'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
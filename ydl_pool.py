@@ -0,0 +1,209 @@
+"""
+yt-dlp 实例池
+
+构造一个 YoutubeDL 大约需要 80ms（加载提取器列表、编译格式选择器、实例化后处理器），
+提取器首次使用还要再实例化一次；请求由 RequestDirector 的 requests 会话发出，
+同一实例的后续请求可以复用 keep-alive 连接和 cookie。
+
+按配置档（info / list / download + 影响构造结果的参数）缓存空闲实例，
+借出时替换本次调用的进度回调、后处理回调、日志、输出模板、限速/间隔等参数，
+下次借出时重新设置，不会带上上一次调用的回调。
+
+- 实例同一时间只借给一个线程（YoutubeDL 不是线程安全的）
+- 调用中抛出异常（包括取消下载）的实例直接关闭丢弃，不放回池中
+- 每个配置档最多保留 YDL_POOL_SIZE 个空闲实例；YDL_POOL_SIZE=0 关闭复用
+- 多进程下载模式下每个子进程各自一个池
+- yt_dlp 在第一次借出实例时才导入
+- 复用依赖 YoutubeDL 的内部属性（_PRIVATE_ATTRS，yt-dlp 未锁定版本）：新建的实例缺少这些属性，
+  或重置时出错，实例池即停用，之后每次借出都新建实例（行为与不复用相同）
+"""
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+YDL_POOL_SIZE = int(os.getenv('YDL_POOL_SIZE', '4'))   # 每个配置档保留的空闲实例数
+YDL_POOL_PROFILES = 16                                  # 最多缓存多少个配置档（格式参数由用户指定）
+
+# 每次调用可以不同、不影响实例构造的参数（yt-dlp 在调用时才读取）
+CALL_OPTIONS = (
+    'progress_hooks', 'postprocessor_hooks', 'logger', 'outtmpl',
+    'sleep_interval', 'max_sleep_interval', 'ratelimit',
+    'noplaylist', 'playlistend', 'playlist_items', 'playlistreverse', 'lazy_playlist',
+    'concurrent_fragment_downloads', 'range_connections',
+)
+
+# _reset / _prepare 直接改写的 YoutubeDL 内部属性
+_PRIVATE_ATTRS = (
+    '_parse_outtmpl', '_progress_hooks', '_postprocessor_hooks', '_pps',
+    '_download_retcode', '_num_downloads', '_printed_messages', '_playlist_urls',
+)
+
+
+def _reusable(ydl) -> bool:
+    """当前 yt-dlp 版本的实例带有复用需要改写的全部内部属性"""
+    return all(hasattr(ydl, attr) for attr in _PRIVATE_ATTRS)
+
+
+def _profile_key(profile: str, opts: Dict[str, Any]) -> Tuple[str, str]:
+    """配置档：名称 + 除单次调用参数外的全部参数"""
+    static = {k: v for k, v in opts.items() if k not in CALL_OPTIONS}
+    return profile, json.dumps(static, sort_keys=True, default=repr)
+
+
+class YdlPool:
+    """配置档 -> 空闲 YoutubeDL 实例"""
+
+    def __init__(self, size: int = YDL_POOL_SIZE, max_profiles: int = YDL_POOL_PROFILES):
+        self.size = size
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        self._idle: 'OrderedDict[Tuple[str, str], List[yt_dlp.YoutubeDL]]' = OrderedDict()
+        self._stats = {'created': 0, 'reused': 0, 'discarded': 0}
+        self.enabled = True   # 内部属性与预期不符时置为 False，之后每次新建实例
+
+    @contextmanager
+    def acquire(self, profile: str, opts: Dict[str, Any]) -> Iterator['yt_dlp.YoutubeDL']:
+        """借出一个按 opts 配置好的实例，用法同 `with yt_dlp.YoutubeDL(opts) as ydl`"""
+        import yt_dlp
+        key = _profile_key(profile, opts)
+        ydl = (self._take(key) or self._create(yt_dlp, opts)) if self.enabled else None
+        if ydl is not None:
+            try:
+                _prepare(ydl, opts)
+            except AttributeError as e:
+                self._disable(ydl, e)
+                ydl = None
+        if ydl is None:
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                yield ydl
+            return
+        try:
+            yield ydl
+        except BaseException:
+            # 中断的实例内部状态（播放列表层级、半截的下载器）不可靠
+            self._close(ydl)
+            with self._lock:
+                self._stats['discarded'] += 1
+            raise
+        self._put(key, ydl)
+
+    def _create(self, yt_dlp, opts: Dict[str, Any]):
+        ydl = yt_dlp.YoutubeDL({k: v for k, v in opts.items() if k not in CALL_OPTIONS})
+        if not _reusable(ydl):
+            self._disable(ydl, f"缺少属性 {[a for a in _PRIVATE_ATTRS if not hasattr(ydl, a)]}")
+            return None
+        ydl._pool_base = {k: ydl.params[k] for k in CALL_OPTIONS if k in ydl.params}
+        with self._lock:
+            self._stats['created'] += 1
+        return ydl
+
+    def _disable(self, ydl, reason):
+        """yt-dlp 内部结构与预期不同：停用实例池，清掉已缓存的实例"""
+        if self.enabled:
+            logger.warning(f"yt-dlp {_ydl_version()} 不支持复用实例（{reason}），实例池停用")
+        self.enabled = False
+        self._close(ydl)
+        self.clear()
+
+    def _take(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self._idle.move_to_end(key)
+                self._stats['reused'] += 1
+                return idle.pop()
+        return None
+
+    def _put(self, key, ydl):
+        # 不持有调用方的回调和日志，避免空闲期间引用已结束的任务
+        try:
+            _reset(ydl)
+        except AttributeError as e:
+            self._disable(ydl, e)
+            return
+        evicted: List['yt_dlp.YoutubeDL'] = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(idle) < self.size:
+                idle.append(ydl)
+            else:
+                evicted.append(ydl)
+            while len(self._idle) > self.max_profiles:
+                _, old = self._idle.popitem(last=False)
+                evicted.extend(old)
+        for old in evicted:
+            self._close(old)
+
+    @staticmethod
+    def _close(ydl):
+        try:
+            ydl.close()
+        except Exception as e:
+            logger.debug(f"关闭 YoutubeDL 实例失败: {e}")
+
+    def clear(self):
+        with self._lock:
+            instances = [ydl for idle in self._idle.values() for ydl in idle]
+            self._idle.clear()
+        for ydl in instances:
+            self._close(ydl)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            profiles: Dict[str, int] = {}
+            for (profile, _), idle in self._idle.items():
+                profiles[profile] = profiles.get(profile, 0) + len(idle)
+            return {'idle': profiles, 'enabled': self.enabled, **self._stats}
+
+
+def _ydl_version() -> str:
+    try:
+        from yt_dlp.version import __version__
+        return __version__
+    except ImportError:
+        return 'unknown'
+
+
+def _reset(ydl):
+    """恢复构造时的单次调用参数并清空回调"""
+    ydl.params.update(ydl._pool_base)
+    for k in CALL_OPTIONS:
+        if k not in ydl._pool_base:
+            ydl.params.pop(k, None)
+    ydl._parse_outtmpl()
+    ydl._progress_hooks = []
+    ydl._postprocessor_hooks = []
+    for pps in ydl._pps.values():
+        for pp in pps:
+            pp._progress_hooks = [pp.report_progress]
+
+
+def _prepare(ydl, opts: Dict[str, Any]):
+    """设置本次调用的参数，并清掉上一次调用留下的计数状态"""
+    _reset(ydl)
+    for k in CALL_OPTIONS:
+        if k in opts and k not in ('progress_hooks', 'postprocessor_hooks'):
+            ydl.params[k] = opts[k]
+    if 'outtmpl' in opts:
+        outtmpl = opts['outtmpl']
+        ydl.params['outtmpl'] = dict(outtmpl) if isinstance(outtmpl, dict) else {'default': outtmpl}
+        ydl._parse_outtmpl()
+    for ph in opts.get('progress_hooks') or ():
+        ydl.add_progress_hook(ph)
+    for ph in opts.get('postprocessor_hooks') or ():
+        ydl.add_postprocessor_hook(ph)
+    ydl._download_retcode = 0
+    ydl._num_downloads = 0
+    ydl._printed_messages.clear()
+    ydl._playlist_urls.clear()
+
+
+# 进程内共享的实例池
+ydl_pool = YdlPool()